@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Benchmark : speed and accuracy of CoSwID on the gold standard data (data_test_gold)
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+import sys, getopt
+import os
+import json
+import time
+import zipfile
+import numpy
+import coswid
+import dico
+import instrument
+
+#
+# Benchmark on the gold standard data (see data_test_gold/README.md) :
+#   each eval file is analysed as one document (as with coswid.py -t <file>), with fixed parameters and without dicServer (dico.StubDictionary, or a compiled lexicon)
+#   and the results are compared to the gold file
+#
+#   Measures (JSON) : tokens/s, peak RSS, latency of the documents (p50, p99), accuracy of each data set, time of each step of the analysis and counters (see instrument.py)
+#   With a baseline (a previous result), the script fails (exit code 1) if the accuracy or the speed are lower than the baseline
+#
+#   python3 bench.py -m FILTER2 -c 2 -v dico -o bench.json
+#   python3 bench.py -m FILTER2 -c 2 -v dico --baseline bench.json
+#
+#   With --compare, the same benchmark is run with another model (eg. the ldig model and the n-gram model trained with ngram.py), and the two models are compared
+#   python3 bench.py -m FILTER2-NGRAM -c 2 -v dico --compare FILTER2
+#
+
+# data sets : (name, zip file, eval file, gold file)
+DATASETS=[
+    ("UDHR-paragraph", "UDHR.zip", "UDHR/eval_UDHR_paragraph.txt", "UDHR/gold_UDHR_paragraph.txt"),
+    ("UDHR-sentence", "UDHR.zip", "UDHR/eval_UDHR_sentence.txt", "UDHR/gold_UDHR_sentence.txt"),
+    ("UDHR-word", "UDHR.zip", "UDHR/eval_UDHR_word.txt", "UDHR/gold_UDHR_word.txt"),
+    ("BDLC-ethno", "BDLC.zip", "BDLC/eval_BDLC_ethno.txt", "BDLC/gold_BDLC_ethno.txt"),
+]
+NOLG="nolg"     # gold language of the tokens without language (not evaluated)
+GOLD_DIR=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_test_gold")
+
+
+#
+# Load the data sets from the zip files of 'goldDir'
+#   - Output : [ (name, text, [ (token,lg) , ... ]) , ... ]
+#
+def loadDatasets(goldDir, names=None):
+    datasets=[]
+    for (name, zipName, evalFile, goldFile) in DATASETS:
+        if names and name not in names :
+            continue
+        with zipfile.ZipFile(os.path.join(goldDir, zipName)) as z:
+            text=z.read(evalFile).decode('utf-8')
+            gold=[tuple(line.split('\t')[1:3]) for line in z.read(goldFile).decode('utf-8').splitlines() if line.strip()]
+        datasets.append((name, text, gold))
+    return datasets
+
+
+# peak resident memory of the process (in KB ; None if not available)
+def peakRSS():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+#
+# Run the benchmark
+#   - options : settings of the analyses (see CoSwID.analyse)
+#   - Output : results (dictionary, see above)
+#
+def run(cosw, datasets, repeat=1, **options):
+    results={"model":cosw.model, "settings":cosw.settingsFor(options), "repeat":repeat, "datasets":{}}
+    stats=instrument.Stats()
+    latencies=[]
+    (totTokens, totTime)=(0, 0.0)
+    for (name, text, gold) in datasets:
+        for i in range(repeat):
+            start=time.perf_counter()
+            result=cosw.analyse(text, stats=stats, **options)
+            latencies.append(time.perf_counter()-start)
+        if [tok for (tok,lg) in result] != [tok for (tok,lg) in gold] :
+            raise ValueError("%s : the tokens are not the same as the gold tokens"%name)
+        evaluated=[(lg, goldLg) for ((tok,lg), (goldTok,goldLg)) in zip(result, gold) if goldLg != NOLG]
+        correct=sum([1 for (lg, goldLg) in evaluated if lg == goldLg])
+        docTime=sum(latencies[-repeat:])
+        results["datasets"][name]={"tokens":len(gold), "evaluated":len(evaluated), "correct":correct, "accuracy":correct/max(len(evaluated),1),
+                                   "time":docTime/repeat, "tokensPerSec":len(gold)*repeat/docTime}
+        totTokens+=len(gold)*repeat
+        totTime+=docTime
+    results["tokensPerSec"]=totTokens/totTime if totTime>0 else 0
+    results["latency"]={"p50":float(numpy.percentile(latencies, 50)), "p99":float(numpy.percentile(latencies, 99))} if latencies else {}
+    results["peakRSS"]=peakRSS()
+    measures=stats.summary()
+    results["steps"]={step:{"time":res["time"], "calls":res["calls"], "share":res["time"]/totTime if totTime>0 else 0} for (step, res) in measures["steps"].items()}
+    results["counters"]=measures["counters"]
+    return results
+
+
+#
+# Compare the results to a baseline
+#   for each data set of the baseline (and of the results) :
+#   - the accuracy must not be lower than the baseline accuracy - accTolerance
+#   - the speed (tokens/s) must not be lower than (1 - speedTolerance) * the baseline speed
+#   - Output : list of the regressions (empty if none)
+#
+def compare(results, baseline, accTolerance=0.0, speedTolerance=0.2):
+    regressions=[]
+    for (name, base) in baseline["datasets"].items():
+        if name not in results["datasets"] :
+            continue
+        res=results["datasets"][name]
+        if res["accuracy"] < base["accuracy"]-accTolerance :
+            regressions.append("%s : accuracy %0.4f < %0.4f (baseline)"%(name, res["accuracy"], base["accuracy"]))
+        if res["tokensPerSec"] < (1-speedTolerance)*base["tokensPerSec"] :
+            regressions.append("%s : speed %0.0f tokens/s < %0.0f tokens/s (baseline) - %s%%"%(name, res["tokensPerSec"], base["tokensPerSec"], int(speedTolerance*100)))
+    return regressions
+
+
+# accuracy and speed of two models on each data set
+def reportComparison(results, other):
+    print("%-16s %10s %10s %10s %12s %12s %8s"%("data set", "accuracy", "compared", "diff", "tokens/s", "compared", "ratio"))
+    for (name, res) in results["datasets"].items():
+        otherRes=other["datasets"][name]
+        print("%-16s %10.4f %10.4f %+10.4f %12.0f %12.0f %8.2f"%(name, res["accuracy"], otherRes["accuracy"], res["accuracy"]-otherRes["accuracy"], res["tokensPerSec"], otherRes["tokensPerSec"], res["tokensPerSec"]/max(otherRes["tokensPerSec"],1e-9)))
+
+
+def report(results):
+    print("%-16s %8s %10s %10s %12s"%("data set", "tokens", "accuracy", "time (s)", "tokens/s"))
+    for (name, res) in results["datasets"].items():
+        print("%-16s %8s %10.4f %10.3f %12.0f"%(name, res["tokens"], res["accuracy"], res["time"], res["tokensPerSec"]))
+    print("Total : %0.0f tokens/s ; latency p50 %0.3fs, p99 %0.3fs ; peak RSS %s KB ; model %s bytes (%s, %s)"%(results["tokensPerSec"], results["latency"].get("p50",0), results["latency"].get("p99",0), results["peakRSS"], results.get("modelBytes"), results.get("backend"), results.get("quantization") or "not quantized"))
+    print("Steps : %s"%", ".join(["%s %0.3fs (%0.1f%%)"%(step, res["time"], res["share"]*100) for (step, res) in results["steps"].items()]))
+    print("Counters : %s"%", ".join(["%s %s"%(name, n) for (name, n) in results.get("counters", {}).items()]))
+
+
+def usage():
+    print('bench.py -m <model name> [-c <context size> -f <filter threshold> -g <gap> -v <voting method> -s <subset>] [-d <data set,...>] [-r <repetitions>] [-o <results.json>] [--baseline <results.json> --acctolerance <accuracy> --speedtolerance <ratio>] [--gold <data_test_gold directory>] [--diclexicon <lexicon>] [--cachesize <entries>] [--skipmargin <margin> --skipstride <stride>] [--quantize <float32 or int8>] [--threads <threads>] [--compare <model name>]')
+    print('  data sets : %s'%",".join([name for (name, zipName, evalFile, goldFile) in DATASETS]))
+
+
+def main(argv):
+    modelName="FILTER2"
+    options={}
+    names=None
+    repeat=1
+    outputFile=""
+    baselineFile=""
+    accTolerance=0.0
+    speedTolerance=0.2
+    goldDir=GOLD_DIR
+    dicLexicon=""           # compiled lexicon used for the dico vote ; "" = StubDictionary (no word is known)
+    cacheSize=0             # no cache by default (each repetition does the whole analysis)
+    quantize=""             # quantization of the model (see Detector.quantize) ; "" = model as stored by ldig
+    threads=1               # number of threads scoring the sliding windows of a document (see coswid.windowScores)
+    compareName=""          # model compared to the model of -m (same benchmark) ; "" = no comparison
+    try:
+        opts, args = getopt.getopt(argv,"hm:c:f:g:v:s:d:r:o:",["model=","ctxtsize=","fltrtresh=","gap=","vote=","subset=","datasets=","repeat=","output=","baseline=","acctolerance=","speedtolerance=","gold=","diclexicon=","cachesize=","skipmargin=","skipstride=","quantize=","threads=","compare="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt in ('-m','--model') :
+            modelName=arg
+        elif opt in ('-c','--ctxtsize') :
+            options["swSize"]=int(arg)
+        elif opt in ('-f','--fltrtresh') :
+            options["filterGlob"]=float(arg)
+        elif opt in ('-g','--gap') :
+            options["significantGap"]=float(arg)
+        elif opt in ('-v','--vote') :
+            options["voteMethod"]=arg
+        elif opt in ('-s','--subset') :
+            options["acceptedLg"]=arg.split(',')
+        elif opt in ('-d','--datasets') :
+            names=arg.split(',')
+        elif opt in ('-r','--repeat') :
+            repeat=int(arg)
+        elif opt in ('-o','--output') :
+            outputFile=arg
+        elif opt == '--baseline':
+            baselineFile=arg
+        elif opt == '--acctolerance':
+            accTolerance=float(arg)
+        elif opt == '--speedtolerance':
+            speedTolerance=float(arg)
+        elif opt == '--gold':
+            goldDir=arg
+        elif opt == '--diclexicon':
+            dicLexicon=arg
+        elif opt == '--cachesize':
+            cacheSize=int(arg)
+        elif opt == '--skipmargin':
+            options["skipMargin"]=float(arg)
+        elif opt == '--skipstride':
+            options["skipStride"]=int(arg)
+        elif opt == '--quantize':
+            quantize=arg
+        elif opt == '--threads':
+            threads=int(arg)
+        elif opt == '--compare':
+            compareName=arg
+
+    dicFactory=(lambda: dico.MmapLexicon(dicLexicon)) if dicLexicon else dico.StubDictionary
+    datasets=loadDatasets(goldDir, names)
+    # benchmark of a model (with the same settings for all the models)
+    def bench(name):
+        cosw=coswid.CoSwID(coswid.modelList[name], coswid.lgList[name], cacheSize=cacheSize, dicFactory=dicFactory, threads=threads)
+        if quantize :
+            cosw.quantize(quantize, maxLoss=None)
+        results=run(cosw, datasets, repeat, **options)
+        results["dictionary"]=dicLexicon if dicLexicon else "stub"
+        results["backend"]=type(cosw.detector).__name__
+        results["quantization"]=cosw.detector.quantization
+        results["modelBytes"]=cosw.detector.param.nbytes
+        results["threads"]=threads
+        return results
+    results=bench(modelName)
+    report(results)
+    if compareName :
+        results["compared"]=bench(compareName)
+        print("Compared model : %s"%compareName)
+        report(results["compared"])
+        reportComparison(results, results["compared"])
+    if outputFile :
+        with open(outputFile, 'w') as f:
+            json.dump(results, f, indent=1)
+        print("Results written into %s"%outputFile)
+    if baselineFile :
+        with open(baselineFile) as f:
+            baseline=json.load(f)
+        regressions=compare(results, baseline, accTolerance, speedTolerance)
+        for regression in regressions:
+            print("[REGRESSION] %s"%regression)
+        if regressions :
+            sys.exit(1)
+        print("No regression (baseline %s)"%baselineFile)
+
+
+if __name__ == "__main__" :
+    main(sys.argv[1:])
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Bounded caches (LRU) of the detection and dictionary results
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+#
+# Cache with a bounded number of entries : when it is full, the least recently used entry is removed (LRU)
+#   - maxSize : maximum number of entries (0 : nothing is stored)
+#   The numbers of hits and misses are counted. A cache can be shared by several threads.
+#
+class LRUCache(object):
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # value of 'key' (None if the key is not in the cache)
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None :
+                self.misses += 1
+            else :
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxSize <= 0 :
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize :
+                self.entries.popitem(last=False)
+
+    # add the entries of 'items' ([(key, value), ...], from the least to the most recently used)
+    def update(self, items):
+        for (key, value) in items:
+            self.put(key, value)
+
+    # remove all the entries (eg. when the cached values are no longer valid)
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # entries, from the least to the most recently used
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def stats(self):
+        with self.lock:
+            return {"size":len(self.entries), "maxSize":self.maxSize, "hits":self.hits, "misses":self.misses}
+
+
+#
+# Persistence of caches : {name: LRUCache} saved into a single file (pickle)
+#   - key : identifies the context of the cached values (eg. the model) ; the caches saved with another key are not loaded
+#   __REM__ : only load cache files from trusted sources
+#
+def saveCaches(path, caches, key):
+    tmpPath = "%s.tmp%d"%(path, os.getpid())
+    with open(tmpPath, 'wb') as f:
+        pickle.dump({"key":key, "caches":{name:cache.items() for (name, cache) in caches.items()}}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpPath, path)
+
+
+# load the entries saved into 'path' into the caches ; returns False if there is no such file, or if it was saved with another key
+def loadCaches(path, caches, key):
+    if not os.path.isfile(path) :
+        return False
+    with open(path, 'rb') as f:
+        saved = pickle.load(f)
+    if saved.get("key") != key :
+        return False
+    for (name, items) in saved["caches"].items():
+        if name in caches :
+            caches[name].update(items)
+    return True
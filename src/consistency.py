@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Consistency checks : the optimized paths of the analysis give the same results as the direct ones, on the gold standard data (data_test_gold)
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+import sys, getopt
+import io
+import random
+import numpy
+import coswid
+import dico
+import incremental
+import bench
+
+#
+# Consistency checks on the gold standard data (see bench.py) : each check compares an optimized path of the analysis to the direct one, on the first
+# tokens of each data set (without dicServer : dico.StubDictionary, or a compiled lexicon ; without cache, so that each analysis scores its windows again)
+#   - features    : features (and normalized text) of the sliding windows extracted by WindowFeatures = features extracted from each normalized fragment
+#   - stream      : analyseStream (several segments) = analyse (filterGlob=0, _full_ vote replaced by _lgID_ ; except the 2*swSize first and last tokens, see CoSwID.analyseStream)
+#   - multi       : analyseMulti with several context sizes = one analyse for each size
+#   - incremental : incremental.Document after each random edit = analyse of the whole new text
+#   - threads     : analyse with N threads = analyse with 1 thread (the same languages and the same probabilities, bit for bit)
+#   The script fails (exit code 1) if a check finds a difference
+#
+#   python3 consistency.py -m FILTER2-NGRAM -c 2 -v dico
+#   python3 consistency.py -m FILTER2 -c 2 -v lgID -d UDHR-paragraph --checks features,threads
+#
+CHECKS=("features", "stream", "multi", "incremental", "threads")
+
+
+# the first 'maxTokens' tokens of a text (the text up to the end of its token number maxTokens)
+def firstTokens(text, maxTokens):
+    offsets=coswid.tokenize(text)[3]
+    return text[:offsets[maxTokens-1][1]] if len(offsets) > maxTokens else text
+
+
+#
+# Features of the sliding windows : WindowFeatures (incremental extraction, with the check of the normalized fragments, see DetectorBackend.tokenLocal) / extraction on each normalized fragment
+#   - Output : number of windows whose text or features differ
+#
+def checkFeatures(cosw, text, swSize):
+    detector=cosw.detector
+    cleanedTokens=coswid.tokenize(text)[2]
+    nbToks=len(cleanedTokens)
+    # the windows cover a circular sequence, as in windowScores
+    seq=[cleanedTokens[k % nbToks] for k in range(-swSize, nbToks+swSize)] if nbToks>0 else []
+    features=coswid.WindowFeatures(detector, seq)
+    spans=[(c, c+2*swSize) for c in range(nbToks)]
+    texts=[features.window_text(*span) for span in spans]
+    events=list(features.iter_events(spans, texts=texts))
+    nbDiffs=0
+    for c in range(nbToks):
+        fragment=detector.normalize(coswid.slidingWindow(c, cleanedTokens, swSize)[0])
+        if texts[c] != fragment or events[c] != detector.extract_features(u"\u0001" + fragment + u"\u0001") :
+            nbDiffs+=1
+    return nbDiffs
+
+
+#
+# analyseStream / analyse
+#   - Output : number of tokens whose language differs (a different tokenization counts all the tokens)
+#
+def checkStream(cosw, text, segmentSize, **options):
+    options.update({"filterGlob":0, "voteMethod":"lgID" if options.get("voteMethod", cosw.settings["voteMethod"]) == "full" else options.get("voteMethod", cosw.settings["voteMethod"])})
+    swSize=cosw.settingsFor(options)["swSize"]
+    output=io.StringIO()
+    cosw.analyseStream(io.StringIO(text), output, segmentSize, **options)
+    streamed=[tuple(line.split('\t')) for line in output.getvalue().splitlines()]
+    result=cosw.analyse(text, **options)
+    if [tok for (tok,lg) in streamed] != [tok for (tok,lg) in result] :
+        return len(result)
+    edges=2*swSize
+    return sum([1 for (k, (res, ref)) in enumerate(zip(streamed, result)) if edges <= k < len(result)-edges and res != ref])
+
+
+#
+# analyseMulti / one analyse for each size
+#   - Output : number of (token, size) whose language differs
+#
+def checkMulti(cosw, text, swSizes, **options):
+    multi=cosw.analyseMulti(text, swSizes, **options)
+    nbDiffs=0
+    for (i, swSize) in enumerate(swSizes):
+        options["swSize"]=swSize
+        result=cosw.analyse(text, **options)
+        nbDiffs+=sum([1 for (res, ref) in zip(multi, result) if (res[0], res[i+1]) != ref])+abs(len(multi)-len(result))
+    return nbDiffs
+
+
+#
+# incremental.Document / analyse of the whole text, after each of 'nbEdits' random edits (replacement of a range by tokens of the text, spaces or nothing)
+#   - Output : number of edits after which the results differ
+#
+def checkIncremental(cosw, text, nbEdits, seed, **options):
+    rand=random.Random(seed)
+    words=text.split()[:1000] or ["a"]
+    doc=incremental.Document(cosw, text, **options)
+    nbDiffs=0 if doc.result() == cosw.analyse(text, **options) else 1
+    for i in range(nbEdits):
+        start=rand.randint(0, len(doc.text))
+        end=min(len(doc.text), start+rand.choice([0, 1, 5, 20, 100]))
+        replacement="".join([rand.choice(words)+rand.choice([" ", "", "\n"]) for k in range(rand.choice([0, 1, 2, 5]))])
+        try:
+            doc.edit(start, end, replacement)
+        except ValueError:
+            continue        # no language available for the new text : the edit is cancelled
+        if doc.result() != cosw.analyse(doc.text, **options) :
+            nbDiffs+=1
+    return nbDiffs
+
+
+#
+# analyse with 'threads' threads / with 1 thread
+#   - Output : number of tokens whose language or probabilities differ
+#
+def checkThreads(cosw, text, threads, **options):
+    runs=[]
+    for n in (1, threads):
+        cosw.threads=n
+        scores={}
+        runs.append((cosw.analyse(text, scores=scores, **options), scores["probabilities"]))
+    cosw.threads=1
+    ((result, prob), (resultN, probN))=runs
+    if len(result) != len(resultN) :
+        return len(result)
+    return sum([1 for k in range(len(result)) if result[k] != resultN[k] or not numpy.array_equal(prob[k], probN[k])])
+
+
+def usage():
+    print('consistency.py -m <model name> [-c <context size> -f <filter threshold> -g <gap> -v <voting method> -s <subset>] [-d <data set,...>] [--checks <check,...>] [--maxtokens <tokens>] [--ctxtsizes <size,...>] [--segsize <tokens>] [--edits <edits>] [--seed <seed>] [--threads <threads>] [--gold <data_test_gold directory>] [--diclexicon <lexicon>]')
+    print('  checks : %s'%",".join(CHECKS))
+    print('  data sets : %s'%",".join([name for (name, zipName, evalFile, goldFile) in bench.DATASETS]))
+
+
+def main(argv):
+    modelName="FILTER2"
+    options={}
+    names=None
+    checks=CHECKS
+    maxTokens=3000          # tokens of each data set used by the checks (the begining of the text)
+    swSizes=[1,2,3]         # context sizes of the multi check
+    segmentSize=500         # tokens of the segments of the stream check
+    nbEdits=20              # edits of the incremental check
+    seed=1
+    threads=4
+    goldDir=bench.GOLD_DIR
+    dicLexicon=""           # compiled lexicon used for the dico vote ; "" = StubDictionary (no word is known)
+    try:
+        opts, args = getopt.getopt(argv,"hm:c:f:g:v:s:d:",["model=","ctxtsize=","fltrtresh=","gap=","vote=","subset=","datasets=","checks=","maxtokens=","ctxtsizes=","segsize=","edits=","seed=","threads=","gold=","diclexicon="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt in ('-m','--model') :
+            modelName=arg
+        elif opt in ('-c','--ctxtsize') :
+            options["swSize"]=int(arg)
+        elif opt in ('-f','--fltrtresh') :
+            options["filterGlob"]=float(arg)
+        elif opt in ('-g','--gap') :
+            options["significantGap"]=float(arg)
+        elif opt in ('-v','--vote') :
+            options["voteMethod"]=arg
+        elif opt in ('-s','--subset') :
+            options["acceptedLg"]=arg.split(',')
+        elif opt in ('-d','--datasets') :
+            names=arg.split(',')
+        elif opt == '--checks':
+            checks=arg.split(',')
+        elif opt == '--maxtokens':
+            maxTokens=int(arg)
+        elif opt == '--ctxtsizes':
+            swSizes=[int(size) for size in arg.split(',')]
+        elif opt == '--segsize':
+            segmentSize=int(arg)
+        elif opt == '--edits':
+            nbEdits=int(arg)
+        elif opt == '--seed':
+            seed=int(arg)
+        elif opt == '--threads':
+            threads=int(arg)
+        elif opt == '--gold':
+            goldDir=arg
+        elif opt == '--diclexicon':
+            dicLexicon=arg
+    for check in checks:
+        if check not in CHECKS :
+            print("Unknown check : %s"%check)
+            usage()
+            sys.exit(2)
+
+    dicFactory=(lambda: dico.MmapLexicon(dicLexicon)) if dicLexicon else dico.StubDictionary
+    cosw=coswid.CoSwID(coswid.modelList[modelName], coswid.lgList[modelName], cacheSize=0, dicFactory=dicFactory)
+    swSize=cosw.settingsFor(options)["swSize"]
+    print("Model %s (%s, token-local normalization : %s) ; settings %s"%(modelName, type(cosw.detector).__name__, cosw.detector.tokenLocal, cosw.settingsFor(options)))
+    print("%-16s %-12s %10s"%("data set", "check", "differences"))
+    failed=False
+    for (name, text, gold) in bench.loadDatasets(goldDir, names):
+        text=firstTokens(text, maxTokens)
+        for check in checks:
+            if check == "features" :
+                nbDiffs=checkFeatures(cosw, text, swSize)
+            elif check == "stream" :
+                nbDiffs=checkStream(cosw, text, segmentSize, **options)
+            elif check == "multi" :
+                nbDiffs=checkMulti(cosw, text, swSizes, **options)
+            elif check == "incremental" :
+                nbDiffs=checkIncremental(cosw, text, nbEdits, seed, **options)
+            else :
+                nbDiffs=checkThreads(cosw, text, threads, **options)
+            print("%-16s %-12s %10s"%(name, check, nbDiffs))
+            failed=failed or nbDiffs > 0
+    if failed :
+        print("[INCONSISTENT] some optimized paths do not give the same results as the direct ones")
+        sys.exit(1)
+    print("All the checks passed")
+
+
+if __name__ == "__main__" :
+    main(sys.argv[1:])
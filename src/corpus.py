@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Corpus mode : analysis of many files, the model being loaded once and shared by a pool of processes
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+import sys
+import os
+import glob
+import time
+import codecs
+import multiprocessing
+import multiprocessing.util
+import logging
+
+import instrument
+import probmatrix
+
+#
+# Corpus mode (see coswid.py, --corpus option)
+#
+#   The files to analyse are given by :
+#       - a directory : all the .txt files of the directory and its sub-directories
+#       - a glob pattern, eg. "BDLC/*.txt" (use "**" to search the sub-directories)
+#       - a manifest, given as "@<file>" : one file path per line
+#   Each file is analysed as a document (same results as coswid.py -t <file>, also with the positions of the tokens (spans) or several context sizes
+#   (swSizes, combine ; see CoSwID.analyseMulti)), and its results are written into <file>.out
+#   The files are distributed to a pool of worker processes. The model is loaded once, before the workers are created (fork) :
+#   the workers share its memory (copy-on-write, or the memory-mapped model bundle). Each worker has its own connection to dicServer.
+#   The detailed information about the analysis of each file is not displayed; the progress is displayed as each file is done.
+#   The caches of the workers (see CoSwID) start with the entries of the parent process ; if a cache file is given, each worker saves its cache
+#   into a temporary file when it stops, and the parent process merges them into the cache file.
+#   The measures of each file (see instrument.py) are sent back to the parent process, which adds them to its own measures and trace file.
+#   With a type of probability matrix, the probability matrix of each file is also written into <file>.out.pm (see probmatrix.py).
+#
+
+# CoSwID instance of the worker processes (inherited from the parent process)
+worker = None
+# type of the probability matrices ("" = no probability matrix)
+matrixType = ""
+# output of the workers : positions of the tokens, context sizes (None = the context size of the settings) and their combination (see CoSwID.analyseMulti)
+showSpans = False
+swSizes = None
+combine = False
+
+
+#
+# List the files of the corpus (see above)
+#
+def listFiles(corpus):
+    if corpus.startswith("@") :
+        with codecs.open(corpus[1:], 'r', "utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    if os.path.isdir(corpus) :
+        return sorted(glob.glob(os.path.join(corpus, "**", "*.txt"), recursive=True))
+    return sorted(glob.glob(corpus, recursive=True))
+
+
+#
+# Write the results of a file : into a temporary file, then renamed (a .out file is never partially written)
+#
+def writeResults(outputFile, result):
+    tmpFile = "%s.tmp%d"%(outputFile, os.getpid())
+    with codecs.open(tmpFile, 'w', "utf-8") as fout:
+        for res in result:
+            fout.write("\t".join([str(x) for x in res])+"\n")
+    os.replace(tmpFile, outputFile)
+
+
+#
+# Analyse a file (in a worker process)
+#   - Output : (path, number of tokens, analysis time, error message or None, measures (see instrument.Stats.summary))
+#
+def analyseFile(path):
+    start = time.time()
+    stats = instrument.Stats()
+    try:
+        with codecs.open(path, 'r', "utf-8") as ftxt:
+            text = ftxt.read()
+        if swSizes :
+            result = worker.analyseMulti(text, swSizes, combine, stats=stats, document=path, spans=showSpans)
+        else :
+            scores = {} if matrixType else None
+            result = worker.analyse(text, stats=stats, document=path, spans=showSpans, scores=scores)
+        writeResults("%s.out"%path, result)
+        if matrixType :
+            probmatrix.write("%s.out.pm"%path, [res[-2] for res in result], scores["offsets"], [res[-1] for res in result], scores["lgCodes"], scores["probabilities"], scores["votes"], matrixType, worker.settingsFor({}))
+    except (ValueError, IOError) as e:
+        return (path, 0, time.time()-start, str(e), stats.summary())
+    return (path, len(result), time.time()-start, None, stats.summary())
+
+
+def initWorker(cosw, cacheFile="", forked=False, matrix="", spans=False, sizes=None, combined=False):
+    global worker, matrixType, showSpans, swSizes, combine
+    worker = cosw
+    matrixType = matrix
+    (showSpans, swSizes, combine) = (spans, sizes, combined)
+    if forked :
+        # the measures are recorded by the parent process (see run)
+        cosw.trace = None
+    if cacheFile :
+        multiprocessing.util.Finalize(None, cosw.saveCache, args=("%s.worker%d"%(cacheFile, os.getpid()),), exitpriority=10)
+    # the detailed information of the analysis is not displayed (it would be mixed between the workers)
+    sys.stdout = open(os.devnull, 'w')
+    log = logging.getLogger("coswid")
+    log.setLevel(max(log.getEffectiveLevel(), logging.WARNING))
+
+
+#
+# Analyse all the files of the corpus with 'workers' processes
+#   - matrix : type of the probability matrices ("float16" or "float32", see probmatrix.py) ; "" = no probability matrix
+#   - spans, swSizes, combine : output of the files (see coswid.py --spans, --ctxtsizes and --combine)
+#   - Output : (number of files analysed, number of errors, number of tokens)
+#
+def run(cosw, corpus, workers, cacheFile="", matrix="", spans=False, swSizes=None, combine=False):
+    files = listFiles(corpus)
+    print("Corpus %s : %s files, %s workers"%(corpus, len(files), workers))
+    if workers > 1 and "fork" not in multiprocessing.get_all_start_methods() :
+        print("WARNING : the workers can not share the model on this platform, the files are analysed by a single process")
+        workers = 1
+    start = time.time()
+    (nbDone, nbErrors, nbTokens) = (0, 0, 0)
+    stdout = sys.stdout
+    logLevel = logging.getLogger("coswid").level
+    if workers > 1 :
+        pool = multiprocessing.get_context("fork").Pool(workers, initializer=initWorker, initargs=(cosw, cacheFile, True, matrix, spans, swSizes, combine))
+        results = pool.imap_unordered(analyseFile, files)
+    else :
+        pool = None
+        initWorker(cosw, matrix=matrix, spans=spans, sizes=swSizes, combined=combine)
+        results = map(analyseFile, files)
+    try:
+        for (path, nbToks, analysisTime, error, measures) in results:
+            nbDone += 1
+            if pool is not None :
+                stats = instrument.Stats()
+                stats.merge(measures)
+                cosw.record(stats, path, analysisTime)
+            if error is not None :
+                nbErrors += 1
+                print("[%s/%s] %s : [ERROR] : %s"%(nbDone, len(files), path, error), file=stdout)
+            else :
+                nbTokens += nbToks
+                print("[%s/%s] %s : %s tokens, %0.3fs (%0.0f tokens/s)"%(nbDone, len(files), path, nbToks, analysisTime, nbToks/max(analysisTime,1e-9)), file=stdout)
+    finally:
+        if pool is not None :
+            pool.close()
+            pool.join()
+            for workerCache in glob.glob(glob.escape(cacheFile)+".worker*") if cacheFile else [] :
+                cosw.loadCache(workerCache)
+                os.remove(workerCache)
+        elif sys.stdout is not stdout :
+            sys.stdout.close()
+            sys.stdout = stdout
+            logging.getLogger("coswid").setLevel(logLevel)
+    elapsed = time.time()-start
+    print("Corpus done : %s files (%s errors), %s tokens in %0.3fs (%0.0f tokens/s)"%(nbDone, nbErrors, nbTokens, elapsed, nbTokens/max(elapsed,1e-9)))
+    return (nbDone, nbErrors, nbTokens)
@@ -50,10 +50,23 @@ import sys, getopt
 import os, errno
 import numpy
 import codecs
-import re
 import json
+import mmap
+import pickle
+import struct
 import operator
-import socket
+import numbers
+import copy
+import abc
+import threading
+import time
+import logging
+import dico
+import cache
+import instrument
+import tokenizer
+import probmatrix
+import ngram
 
 #
 # INSTALL(1) : Please specify below where the LDIG folder is located
@@ -61,6 +74,9 @@ import socket
 sys.path.append('../../ldig-python3')
 import ldig
 
+# messages about the analysis (levels : debug = details of each window, token and vote ; info = parameters and summary of the run ; warning, error), see --log
+log = logging.getLogger("coswid")
+
 # 
 # Detection of the language word by word, using a sliding window and the language detector LDIG + dictionaries
 #
@@ -79,204 +95,661 @@ import ldig
 
 
 #
-# Language detection class
-# CoSwID is curently designed to work with ldig as an external library. In order to adapt it to another language identification module, this class has to be modified.
+# Model bundle (see Detector.compile) : header = magic number + size of the metadata ; param starts at the first 64 bytes boundary after the metadata
 #
-class Detector(object):
-    def __init__(self, modeldir):
-        self.ldig = ldig.ldig(modeldir)
-        self.features = self.ldig.load_features()
-        self.trie = self.ldig.load_da()
-        self.labels = self.ldig.load_labels()
-        self.param = numpy.load(self.ldig.param)
+BUNDLE_MAGIC=b"CSWMOD1\0"
+BUNDLE_HEADER=struct.Struct("<8sQ")
 
-    def detect(self, st):
-        label, text, org_text = ldig.normalize_text(st)
-        events = self.trie.extract_features(u"\u0001" + text + u"\u0001")
-        sum = numpy.zeros(len(self.labels))
-
-        for id in sorted(events, key=lambda id:self.features[id][0]):
-            phi = self.param[id,]
-            sum += phi * events[id]
-        sumPositive=sum[sum > 0].sum()
-        prob=[]
-        for x in sum:
-            if x>0 :
-                prob.append(x/sumPositive)
+def bundleParamOffset(metaSize):
+    return ((BUNDLE_HEADER.size+metaSize+63)//64)*64
+
+# quantizations of the model (see Detector.quantize)
+QUANTIZATIONS=("float32", "int8")
+
+
+#
+# Language detection backend : interface of the language detectors (CoSwID only uses the detectors through this interface, see openDetector)
+# A backend gives :
+#   - labels of the model ; lgCodes (long language codes of the labels) and lgIndex (code -> index) : the columns of the probabilities (see initLanguages)
+#   - normalize(st) : normalized text of a fragment
+#   - tokenLocal : True if the normalization always works inside the tokens (the normalized text of tokens joined by a space is the normalized tokens joined by a space,
+#     the empty ones removed) ; otherwise the normalized fragment of each window is checked by the incremental extraction of the features (see WindowFeatures)
+#   - extract_features(st) : features of a normalized fragment ("\u0001" at its edges) : dictionary id:count, the ids being lower than nbFeatures ;
+#     the features are substrings of at most maxFeatureLen characters, counted at each occurrence (so that they can be extracted incrementally, see WindowFeatures)
+#   - param : array (nbFeatures, number of labels) of the weights of the features ; quantization and paramScale : see quantize
+#   - probabilities(sums) : probabilities of the fragments (one row per fragment) from the sums of the weights of their features
+#   - compile(path) : write the model into a single file, loaded by the same backend
+# (normalize, extract_features, probabilities and compile are abstract : a backend can not be instantiated without them)
+# The detection (detect_batch : N fragments at once, the results being arrays ; detect_array and detect : one fragment), the cache of the probabilities,
+# the subsets of languages (subset) and the quantization (quantize) are common to all the backends.
+#
+class DetectorBackend(abc.ABC):
+    tokenLocal = False
+
+    # attributes common to all the backends, once the labels of the model are known
+    def initLanguages(self):
+        # label <-> language code mapping, computed once at model load (always output in long lg code (3 chars))
+        self.lgCodes = [toLongLgCode.get(x, x) for x in self.labels]
+        self.lgIndex = {lg:idx for (idx,lg) in enumerate(self.lgCodes)}
+        self.cache = None   # cache of the probabilities of the fragments : normalized text -> vector of probabilities (see cache.LRUCache), None = no cache
+        self.featureMap = None  # pruned model (see subset) : feature id -> row of param (-1 = pruned feature), None = all the features are kept
+        self.minWeight = 0
+
+    @abc.abstractmethod
+    def normalize(self, st):
+        pass
+
+    @abc.abstractmethod
+    def extract_features(self, st):
+        pass
+
+    @abc.abstractmethod
+    def probabilities(self, sums):
+        pass
+
+    @abc.abstractmethod
+    def compile(self, path):
+        pass
+
+    # type of the scores (param, or float32 for an int8 model)
+    @property
+    def scoreType(self):
+        return self.param.dtype if self.paramScale is None else self.paramScale.dtype
+
+    # pruned view of the model for a subset of its languages (the other languages are never scored) :
+    #   - only the columns of param of the languages of 'lgCodes' are kept (the languages unknown by the model are ignored)
+    #   - if minWeight > 0, only the features having a weight of at least minWeight (absolute value) for one of these languages are kept (the other features are ignored when scoring)
+    # The probabilities are normalized over the subset : they are the same as the probabilities of the whole model recalibrated on the subset (see recalibrateResults) when minWeight = 0
+    def subset(self, lgCodes, minWeight=0):
+        idx = [i for (i,lg) in enumerate(self.lgCodes) if lg in lgCodes]
+        if not idx :
+            raise ValueError("no language of the model in %s"%str(lgCodes))
+        view = copy.copy(self)
+        view.labels = [self.labels[i] for i in idx]
+        view.lgCodes = [self.lgCodes[i] for i in idx]
+        view.lgIndex = {lg:i for (i,lg) in enumerate(view.lgCodes)}
+        view.cache = None
+        param = self.param[:, idx]
+        if self.paramScale is not None :
+            view.paramScale = self.paramScale[idx]
+        view.minWeight = max(minWeight, self.minWeight)
+        if view.minWeight > 0 :
+            weights = param if self.paramScale is None else param * view.paramScale
+            kept = numpy.abs(weights).max(axis=1) >= view.minWeight
+            featureMap = numpy.full(len(kept), -1, dtype=numpy.intp)
+            featureMap[kept] = numpy.arange(int(kept.sum()))
+            if self.featureMap is not None :
+                featureMap = numpy.where(self.featureMap >= 0, featureMap[self.featureMap], -1)
+            view.featureMap = featureMap
+            param = param[kept]
+        view.param = numpy.ascontiguousarray(param)
+        return view
+
+    # quantized view of the model (less memory, faster scoring) :
+    #   - "float32" : param is stored as float32
+    #   - "int8" : param is stored as int8, with one scale for each column (language) : weight = param * scale, scale = max(|weights of the column|)/127
+    # The fragments are then scored with float32 (see score_events_array) : the probabilities are close to the probabilities of the full model,
+    # but they may change some decisions (see CoSwID.quantize for an accuracy check)
+    def quantize(self, mode):
+        if mode not in QUANTIZATIONS :
+            raise ValueError("unknown quantization : %s (%s)"%(mode, ",".join(QUANTIZATIONS)))
+        if self.quantization is not None :
+            raise ValueError("the model is already quantized (%s)"%self.quantization)
+        view = copy.copy(self)
+        view.cache = None
+        view.quantization = mode
+        if mode == "float32" :
+            view.param = numpy.ascontiguousarray(self.param, dtype=numpy.float32)
+        else :
+            scale = numpy.abs(self.param).max(axis=0) / 127
+            scale = numpy.where(scale > 0, scale, 1)
+            view.param = numpy.ascontiguousarray(numpy.rint(self.param / scale), dtype=numpy.int8)
+            view.paramScale = scale.astype(numpy.float32)
+        return view
+
+    # returns (index of the best label, numpy vector of probabilities -- same order as self.lgCodes)
+    def detect_array(self, st, useCache=True):
+        (bestIdx, prob) = self.detect_batch([st], useCache)
+        return (int(bestIdx[0]), prob[0])
+
+    # detection of N fragments at once
+    # returns (vector of the N best label indexes, matrix of probabilities -- one row per fragment, columns ordered as self.lgCodes)
+    #   - useCache : use the cache (if any) ; False for the long texts which are analysed once (eg. the global detection)
+    def detect_batch(self, fragments, useCache=True):
+        texts = [self.normalize(st) for st in fragments]
+        extract = lambda indexes: [self.extract_features(u"\u0001" + texts[i] + u"\u0001") for i in indexes]
+        if not useCache :
+            return self.score_events(extract(range(len(texts))))
+        return self.score_cached(texts, extract)
+
+    # probabilities of N fragments given by their normalized text, taken from the cache when possible
+    #   - extract : function returning the features of the fragments that are not in the cache (called once, with the list of their indexes, in increasing order)
+    # The fragments that are not in the cache are scored together (once for each different text), and added to the cache
+    def score_cached(self, texts, extract):
+        stats = instrument.current()
+        stats.count("fragments", len(texts))
+        if self.cache is None :
+            return self.score_events(extract(range(len(texts))))
+        prob = numpy.empty((len(texts), len(self.labels)), dtype=self.scoreType)
+        missing = {}        # text -> row in the results of the missing fragments
+        missingIdx = []     # index of the first fragment of each missing text
+        for (i,text) in enumerate(texts):
+            if text in missing :
+                continue
+            cached = self.cache.get(text)
+            if cached is None :
+                missing[text] = len(missingIdx)
+                missingIdx.append(i)
             else :
-                prob.append(0)
-        # put result into JSON format
-        labelsList=""
-        for x in self.labels:
-            if x in toLongLgCode : # always output in long lg code (3 chars)
-                x=toLongLgCode[x]
-            labelsList+="\"%s\"," % x
-        labelsList=labelsList[:-1]
-        probList=""
-        for x in prob:
-            probList+="\"%0.3f\"," % x
-        probList=probList[:-1]
+                prob[i] = cached
+        if missingIdx :
+            (best, missingProb) = self.score_events(extract(missingIdx))
+            for (text, row) in missing.items():
+                value = missingProb[row].copy()
+                value.flags.writeable = False
+                self.cache.put(text, value)
+            for (i,text) in enumerate(texts):
+                if text in missing :
+                    prob[i] = missingProb[missing[text]]
+        stats.count("fragmentsCached", len(texts)-len(missingIdx))
+        return (prob.argmax(axis=1), prob)
+
+    # score the extracted features of N fragments with a single gather/dot against param
+    #   the features are stored as a sparse count matrix (CSR like: 'ids' and 'counts' of all fragments, one after the other, 'lengths' gives the number of features of each fragment)
+    def score_events(self, events):
+        with instrument.current().timer("scoring"):
+            return self.score_events_array(events)
+
+    def score_events_array(self, events):
+        nbFrags = len(events)
+        lengths = numpy.fromiter((len(ev) for ev in events), dtype=numpy.intp, count=nbFrags)
+        nbEvents = int(lengths.sum())
+        ids = numpy.fromiter((id for ev in events for id in ev), dtype=numpy.intp, count=nbEvents)
+        counts = numpy.fromiter((n for ev in events for n in ev.values()), dtype=self.scoreType, count=nbEvents)
+        sums = numpy.zeros((nbFrags, len(self.labels)), dtype=self.scoreType)
+        if nbEvents > 0 :
+            # features are summed by increasing id inside each fragment, so that the scores only depend on the counts (not on the extraction order)
+            frags = numpy.repeat(numpy.arange(nbFrags, dtype=numpy.int64), lengths)
+            order = numpy.argsort(frags * self.nbFeatures + ids, kind='stable')
+            ids = ids[order]
+            counts = counts[order]
+            if self.featureMap is not None :
+                # pruned model (see subset) : ids of the rows of param, the pruned features are removed
+                ids = self.featureMap[ids]
+                kept = ids >= 0
+                (ids, counts) = (ids[kept], counts[kept])
+                lengths = numpy.bincount(frags[kept], minlength=nbFrags)
+            weighted = self.param[ids] * counts[:, None]
+            nonEmpty = lengths > 0
+            offsets = numpy.cumsum(lengths) - lengths
+            sums[nonEmpty] = numpy.add.reduceat(weighted, offsets[nonEmpty], axis=0)
+            if self.paramScale is not None :
+                sums *= self.paramScale
+        prob = self.probabilities(sums)
+        return (prob.argmax(axis=1), prob)
+
+    # JSON output (only used at the edges: information output, external callers)
+    def detect(self, st):
+        (bestIdx, prob) = self.detect_array(st)
+        return self.to_json(prob)
+
+    def to_json(self, prob):
+        labelsList=",".join(["\"%s\""%x for x in self.lgCodes])
+        probList=",".join(["\"%0.3f\""%x for x in prob])
         return "{\"labels\":[%s], \"prob\":[%s]}" % (labelsList,probList)
 
 
+#
+# Language detection with ldig (external library)
+#   - model : ldig model directory, or model bundle file (see compile)
+# The normalization of ldig (normalize_text) does not always work inside the tokens (eg. the Turkish dotted I, the rules of the tweets) : tokenLocal = False (see WindowFeatures)
+#
+class Detector(DetectorBackend):
+    def __init__(self, model):
+        if os.path.isfile(model) :
+            self.load_bundle(model)
+        else :
+            self.ldig = ldig.ldig(model)
+            features = self.ldig.load_features()
+            self._trie = self.ldig.load_da()
+            self.labels = self.ldig.load_labels()
+            self.param = numpy.load(self.ldig.param)
+            self.nbFeatures = len(features)
+            self.maxFeatureLen = max([len(f[0]) for f in features])     # no feature is longer than this (used by the incremental extraction of the sliding windows features)
+            self.quantization = None    # quantized model (see quantize) : "float32" or "int8", None = param as stored by ldig
+            self.paramScale = None      # int8 quantization : scale of each column of param (weight = param * paramScale), None = param gives the weights
+        self.initLanguages()
+
+    # the trie of a model bundle is only deserialized when it is used for the first time
+    @property
+    def trie(self):
+        if self._trie is None :
+            self._trie = pickle.loads(self.bundle[self.trieOffset:self.trieOffset+self.trieSize])
+        return self._trie
+
+    # features of a normalized fragment (function of the trie)
+    @property
+    def extract_features(self):
+        return self.trie.extract_features
+
+    def normalize(self, st):
+        return ldig.normalize_text(st)[1]
+
+    # probabilities : the positive sums, normalized
+    def probabilities(self, sums):
+        prob = numpy.where(sums > 0, sums, 0)
+        sumPositive = prob.sum(axis=1, keepdims=True)
+        numpy.divide(prob, sumPositive, out=prob, where=sumPositive > 0)
+        return prob
+
+    # write the model into a single bundle file, loaded much faster than ldig files (see load_bundle)
+    #   - header : magic number, size of the metadata
+    #   - metadata (JSON) : labels, language codes, number of features, max length of the features, type and shape of param, size of the trie, quantization (and scales of the columns)
+    #   - param (raw array, 64 bytes aligned ; quantized if the model is quantized, see quantize)
+    #   - trie (pickle)
+    def compile(self, path):
+        param = numpy.ascontiguousarray(self.param)
+        trie = pickle.dumps(self.trie, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.featureMap is not None :
+            raise ValueError("a pruned model can not be compiled")
+        meta = json.dumps({"labels":self.labels, "lgCodes":self.lgCodes, "nbFeatures":self.nbFeatures, "maxFeatureLen":self.maxFeatureLen,
+                           "dtype":param.dtype.str, "shape":param.shape, "trieSize":len(trie), "quantization":self.quantization,
+                           "scale":self.paramScale.tolist() if self.paramScale is not None else None}).encode('utf-8')
+        tmpPath = "%s.tmp%d"%(path, os.getpid())
+        with open(tmpPath, 'wb') as f:
+            f.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, len(meta)))
+            f.write(meta)
+            f.write(b"\0"*(bundleParamOffset(len(meta))-BUNDLE_HEADER.size-len(meta)))
+            f.write(param.tobytes())
+            f.write(trie)
+        os.replace(tmpPath, path)
+
+    # load a model bundle : param is memory-mapped (read only; its pages are loaded when needed and shared by all the processes using the bundle), the trie is deserialized on first use
+    #   __REM__ : the trie is stored with pickle, only load bundles from trusted sources
+    def load_bundle(self, path):
+        with open(path, 'rb') as f:
+            self.bundle = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, metaSize) = BUNDLE_HEADER.unpack_from(self.bundle, 0)
+        if magic != BUNDLE_MAGIC :
+            raise ValueError("%s is not a CoSwID model bundle"%path)
+        meta = json.loads(self.bundle[BUNDLE_HEADER.size:BUNDLE_HEADER.size+metaSize].decode('utf-8'))
+        self.labels = meta["labels"]
+        self.nbFeatures = meta["nbFeatures"]
+        self.maxFeatureLen = meta["maxFeatureLen"]
+        paramOffset = bundleParamOffset(metaSize)
+        self.param = numpy.ndarray(tuple(meta["shape"]), dtype=numpy.dtype(meta["dtype"]), buffer=self.bundle, offset=paramOffset)
+        self.trieOffset = paramOffset + self.param.nbytes
+        self.trieSize = meta["trieSize"]
+        self._trie = None
+        self.quantization = meta.get("quantization")
+        self.paramScale = numpy.array(meta["scale"], dtype=numpy.float32) if meta.get("scale") is not None else None
+
 
 #
-# Remove from the results (resJson) all languages that are not in acceptedLg, and normalize probabilities for the remaining lg
+# Built-in language detection : hashed character n-grams (see ngram.py ; a model is trained in a few minutes from the data of data_lgID_learn)
+#   - model : model file (the weights are memory-mapped)
 #
-def recalibrateResults(resJson, acceptedLg):
-    res=json.loads(resJson)
-    recalibrated={'labels':[],'prob':[]}
-    tot=0
-    i=0
-    for lg in res['labels'] :
-        prob=float(res['prob'][i])
-        if lg in acceptedLg :
-            recalibrated['labels'].append(lg)
-            recalibrated['prob'].append(prob)
-            tot+=prob
-        i+=1
-    if tot==0 : # if no lg in acceptedLg : fill with all acceptedLd and balance the probabilities
-        nbAccepted=len(acceptedLg)
-        for (i,prob) in enumerate(recalibrated['prob']) :
-            recalibrated['prob'][i]=1/nbAccepted
-    else :
-        for (i,prob) in enumerate(recalibrated['prob']) :       # normalize the prob values
-            recalibrated['prob'][i]=recalibrated['prob'][i]/tot
+class NgramDetector(DetectorBackend):
+    tokenLocal = True       # (see ngram.normalize)
+
+    def __init__(self, model):
+        (self.meta, self.param) = ngram.load(model)
+        self.labels = self.meta["labels"]
+        self.ngrams = ngram.HashedNgrams(self.meta["maxOrder"], self.meta["bits"])
+        self.nbFeatures = self.param.shape[0]
+        self.maxFeatureLen = self.meta["maxOrder"]
+        self.temperature = self.meta["temperature"]
+        self.quantization = self.meta.get("quantization")
+        self.paramScale = numpy.array(self.meta["scale"], dtype=numpy.float32) if self.meta.get("scale") is not None else None
+        self.initLanguages()
+
+    # features of a normalized fragment (function of the hashed n-grams)
+    @property
+    def extract_features(self):
+        return self.ngrams.extract_features
+
+    def normalize(self, st):
+        return ngram.normalize(st)
+
+    # probabilities : softmax of the sums divided by the temperature of the model
+    def probabilities(self, sums):
+        prob = numpy.exp((sums - sums.max(axis=1, keepdims=True)) / self.temperature)
+        prob /= prob.sum(axis=1, keepdims=True)
+        return prob
+
+    # write the model into a model file (see ngram.save ; with its languages and its quantization)
+    def compile(self, path):
+        if self.featureMap is not None :
+            raise ValueError("a pruned model can not be compiled")
+        ngram.save(path, self.param, dict(self.meta, labels=self.labels, quantization=self.quantization,
+                                          scale=self.paramScale.tolist() if self.paramScale is not None else None))
+
+
+# language detection backends : (test on the model, backend), the first backend accepting the model is used (see openDetector)
+detectorBackends=[(ngram.isModel, NgramDetector), (lambda model: True, Detector)]
+
 
+#
+# Open the language detector of a model : n-gram model file (see ngram.py), or ldig model directory or bundle (see Detector)
+#
+def openDetector(model):
+    for (accepts, backend) in detectorBackends:
+        if accepts(model) :
+            return backend(model)
+    raise ValueError("no language detection backend for the model %s"%model)
+
+
+
+#
+# Incremental extraction of the features of all the sliding windows of a text
+# The fragment of a window is "\u0001" + normalized tokens joined by a space + "\u0001" : the same string as detector.normalize on the fragment when the normalization works inside the tokens.
+# Otherwise (eg. the Turkish dotted I or the rules of the tweets of ldig), the normalized fragment is checked for each window (see window_text), and the features of the windows
+# whose normalized fragment is not their normalized tokens are extracted from it (detectors whose normalization always works inside the tokens skip the check, see DetectorBackend.tokenLocal).
+# Instead of extracting the features of each fragment (each token would be processed (swSize*2)+1 times), the features are computed once for each token :
+#   - tokEnd : features ending inside the token
+#   - sepEnd : features ending on the space after the token
+#   - cross : features crossing the boundary before the token (starting before the token, ending inside or after it)
+# and the features of a window (first token a, last token b) are obtained by : sum(tokEnd[a..b]) + sum(sepEnd[a..b-1]) - cross[a] + features involving the "\u0001" at the edges.
+# When the window slides, the contributions of the dropped token are removed and those of the added token are added.
+# The counts are exactly the same as a new extraction on the fragment (the cost only depends on the text length, not on swSize).
+#   - seq : sequence of the (cleaned) tokens covered by the windows
+#
+class WindowFeatures(object):
+    def __init__(self, detector, seq):
+        self.extract = detector.extract_features
+        self.maxLen = detector.maxFeatureLen
+        self.normalize = None if detector.tokenLocal else detector.normalize    # normalization of the fragments checked for each window (None : no check needed)
+        self.seq = seq
+        seq = [detector.normalize(tok) for tok in seq]
+        # text of the sequence (empty tokens disapear) and position of the non empty tokens in the text
+        self.starts = []
+        self.ends = []
+        self.firstRank = []     # for each token of seq : rank of the first non empty token at this position or after
+        self.lastRank = []      # for each token of seq : rank of the last non empty token at this position or before
+        parts = []
+        pos = 0
+        for tok in seq:
+            if tok :
+                if parts :
+                    pos += 1
+                self.starts.append(pos)
+                pos += len(tok)
+                self.ends.append(pos)
+                parts.append(tok)
+            self.lastRank.append(len(parts)-1)
+            self.firstRank.append(len(parts)-1 if tok else len(parts))
+        self.text = " ".join(parts)
+        self.cache = {}
+        self.edges = ({}, {})   # features involving the "\u0001" at the begining (resp. end) of the windows starting (resp. ending) with each non empty token (shared by the windows of several sizes, see multiWindowScores)
+
+    # normalized text of the window (first, last) (positions in seq of its first and last tokens), without the "\u0001" at the edges : detector.normalize on its fragment
+    # (the tokens joined by a space), or the normalized tokens joined by a space when the normalization always works inside the tokens
+    def window_text(self, first, last):
+        if self.normalize is not None :
+            return self.normalize(" ".join(self.seq[first:last+1]))
+        (a, b) = (self.firstRank[first], self.lastRank[last])
+        return self.text[self.starts[a]:self.ends[b]] if a<=b else ""
+
+    # features of the string 'st' minus the features of the string 'sub' (same counts as the detector : dictionary id:count)
+    def diff(self, st, sub):
+        events = self.extract(st)
+        for (id,n) in self.extract(sub).items():
+            events[id] -= n
+            if events[id] == 0 :
+                del events[id]
+        return events
+
+    # (tokEnd, sepEnd, cross) for the non empty token of rank r (computed once)
+    def tokenEvents(self, r):
+        if r not in self.cache :
+            (start, end, L) = (self.starts[r], self.ends[r], self.maxLen)
+            text = self.text
+            tokEnd = self.diff(text[max(0,start-L+1):end], text[max(0,start-L+1):start])
+            sepEnd = self.diff(text[max(0,end-L+1):end+1], text[max(0,end-L+1):end])
+            cross = self.diff(text[max(0,start-L+1):start+L-1], text[max(0,start-L+1):start])
+            for (id,n) in self.extract(text[start:start+L-1]).items():
+                cross[id] -= n
+                if cross[id] == 0 :
+                    del cross[id]
+            self.cache[r] = (tokEnd, sepEnd, cross)
+        return self.cache[r]
+
+    # forget the features of the non empty tokens before the rank 'rank' (they will not be used by the next windows)
+    def forget(self, rank):
+        for cache in (self.cache,)+self.edges :
+            for r in [r for r in cache if r < rank] :
+                del cache[r]
+
+    # add (sign=1) or remove (sign=-1) 'events' to the counts 'counts'
+    def update(self, counts, events, sign):
+        for (id,n) in events.items():
+            n = counts.get(id, 0) + sign*n
+            if n == 0 :
+                del counts[id]
+            else :
+                counts[id] = n
+
+    # generator : features of the windows
+    #   - windows : [ (first, last) , ... , (first, last) ] positions in seq of the first and last tokens of each window (the windows must be given in increasing order)
+    #   - forget : forget the features of the tokens before the current window (False to keep them for windows given later, see windowScores)
+    #   - texts : normalized texts of the windows (see window_text), computed if not given
+    def iter_events(self, windows, forget=True, texts=None):
+        L = self.maxLen
+        counts = None       # counts of the inner part of the current window
+        (prevA, prevB) = (0, -1)
+        for (i, (first, last)) in enumerate(windows):
+            a = self.firstRank[first]
+            b = self.lastRank[last]
+            inner = self.text[self.starts[a]:self.ends[b]] if a<=b else ""
+            text = (texts[i] if texts is not None else self.window_text(first, last)) if self.normalize is not None else inner
+            # the normalized fragment is not the normalized tokens (the normalization does not work inside the tokens) : direct extraction
+            if text != inner :
+                counts = None
+                yield self.extract(u"\u0001" + text + u"\u0001")
+                continue
+            if len(inner) < L-1 :
+                # small window : direct extraction
+                counts = None
+                yield self.extract(u"\u0001" + inner + u"\u0001")
+                continue
+            if counts is None or a > prevB :
+                counts = {}
+                for r in range(a, b+1):
+                    (tokEnd, sepEnd, cross) = self.tokenEvents(r)
+                    self.update(counts, tokEnd, 1)
+                    if r < b :
+                        self.update(counts, sepEnd, 1)
+                self.update(counts, self.tokenEvents(a)[2], -1)
+            else :
+                # slide : remove the tokens before 'a', add the tokens after 'prevB'
+                self.update(counts, self.tokenEvents(prevA)[2], 1)
+                for r in range(prevA, a):
+                    (tokEnd, sepEnd, cross) = self.tokenEvents(r)
+                    self.update(counts, tokEnd, -1)
+                    self.update(counts, sepEnd, -1)
+                for r in range(prevB+1, b+1):
+                    (tokEnd, sepEnd, cross) = self.tokenEvents(r)
+                    self.update(counts, self.tokenEvents(r-1)[1], 1)
+                    self.update(counts, tokEnd, 1)
+                self.update(counts, self.tokenEvents(a)[2], -1)
+            if forget :
+                self.forget(a)
+            (prevA, prevB) = (a, b)
+            # features involving the "\u0001" at the begining and at the end of the fragment (they only depend on the first (resp. last) token, as the window is not smaller than L-1)
+            (left, right) = self.edges
+            if a not in left :
+                left[a] = self.diff(u"\u0001" + inner[:L-1], inner[:L-1])
+            if b not in right :
+                right[b] = self.diff(inner[len(inner)-L+1:] + u"\u0001", inner[len(inner)-L+1:])
+            events = dict(counts)
+            self.update(events, left[a], 1)
+            self.update(events, right[b], 1)
+            yield events
+
+
+#
+# Remove from the results (prob, vector ordered as detector.lgCodes -- or matrix with one such vector per row) all languages that are not in acceptedIdx (indexes of the accepted languages), and normalize probabilities for the remaining lg
+#   - Output : vector (or matrix) of probabilities, ordered as acceptedIdx
+#
+def recalibrateResults(prob, acceptedIdx):
+    recalibrated=prob[...,acceptedIdx]
+    tot=recalibrated.sum(axis=-1, keepdims=True)
+    # if no lg in acceptedLg : fill with all acceptedLd and balance the probabilities, else normalize the prob values
+    recalibrated=numpy.where(tot==0, 1/len(acceptedIdx), recalibrated/numpy.where(tot==0, 1, tot))
     return recalibrated
 
 
 #
-# Update the score for a token and its context (i.e. for a sliding window / a fragment)
-#   - resLgID : results of the language identification for a fragment 
-#   - toUpdate : ids of the tokens to update
-#   - results : structure like [ tokenId : {lg:sum, ... ,lg:sum} , ... , tokenId : {lg:sum, ... ,lg:sum} to update
+# Build the sliding window (fragment) around the token 'curTok'
+#   - Output : (fragment, toksToUpdate) where toksToUpdate are the ids of the tokens of the fragment [cur, prev, next]
+# At the begining (resp. end) of the text, the "previous" (resp. "following") tokens are taken at the end (resp. begining) of the text to have a full sliding window (TODO: this could be modified for something more relevant in the future)
+#
+def slidingWindow(curTok, cleanedTokens, swSize):
+    nbToks=len(cleanedTokens)
+    toksToUpdate=[curTok]
+    # initialize fragment with current token
+    fragment=cleanedTokens[curTok]
+    # add swSize tokens BEFORE curTok
+    for i in range(1,swSize+1):
+        if curTok-i<0 :
+            # begining of the text
+            fragment="%s %s"%(cleanedTokens[nbToks+(curTok-i)],fragment)
+            toksToUpdate.append(nbToks+(curTok-i))
+        else :
+            # add token before the current fragment
+            fragment="%s %s"%(cleanedTokens[curTok-i],fragment)
+            toksToUpdate.append(curTok-i)
+    # add swSize tokens AFTER curTok
+    for i in range(1,swSize+1):
+        if curTok+i>=nbToks :
+            # end of the text
+            fragment="%s %s"%(fragment,cleanedTokens[(curTok+i)-nbToks])
+            toksToUpdate.append((curTok+i)-nbToks)
+        else :
+            # add token after the current fragment
+            fragment="%s %s"%(fragment,cleanedTokens[curTok+i])
+            toksToUpdate.append(curTok+i)
+    return (fragment, toksToUpdate)
+
+
+#
+# Update the score for tokens and their context (i.e. for sliding windows / fragments)
+#   - recProbs : recalibrated probabilities of the language identification for the fragments (one row per fragment, columns ordered as possibleLg)
+#   - toUpdate : ids of the tokens to update (one row per fragment)
+#   - results : array (nbToks, len(possibleLg)) of the cumulated scores of each token, updated in place
 # For each token in the fragment, add the probabilities for all the languages in the language identification result to the current recorded scores 
 # (in other words, for each language in the lgId result, add the given probability to the score of each fragment' token)
 #
-def updateResults(resLgID, toUpdate, results):
-    i=0
-    for lg in resLgID['labels'] :
-        prob=float(resLgID['prob'][i])
-        for idx in toUpdate:
-            if lg in results[idx] :
-                results[idx][lg]+=prob
-            else:
-                results[idx][lg]=prob
-        i+=1
+def updateResults(recProbs, toUpdate, results):
+    numpy.add.at(results, toUpdate, recProbs[:,None,:])
     return results
 
 
 #
 # For each token, norm the languages score in order to express it as a probability
 # (i.e. divide the cumulated score by the length of the sliding window)
-#   - Input (values are sums of probabilities) : [ tokenId : {lg:sum, ... ,lg:sum} , ... , tokenId : {lg:sum, ... ,lg:sum} ]
-#   - Output (values are normalised probabilities) : [ tokenId : {lg:prob, ... ,lg:prob} , ... , tokenId : {lg:prob, ... ,lg:prob} ]
+#   - Input (values are sums of probabilities) : array (nbToks, nbLg), normalised in place
+#   - Output (values are normalised probabilities) : the same array
 #
-def normLanguageScores(results):
-    filteredResults=[]
-    for (idx,tokProb) in enumerate(results):
-        filteredResults.append({})
-        for (lg,prob) in tokProb.items() :  
-            filteredResults[idx][lg]=results[idx][lg]/((swSize*2)+1)
-    return filteredResults
+def normLanguageScores(results, swSize):
+    results/=(swSize*2)+1
+    return results
 
 
 
 #
 # Remove languages with a probability lesser than (best language score - threshold)
-#   - Input : { lg:prob , ... , lg:prob } dictionary with N items
-#   - Output : { lg:prob , ... , lg:prob } dictionary with M items, M<=N
+#   - Input : array (nbToks, nbLg) of probabilities
+#   - Output : boolean array (nbToks, nbLg), True for the languages that are kept
 #
 def removeUnsignificantLanguages(resProb, threshold):
-    bestLg=max(resProb.items(), key=operator.itemgetter(1))[0]
-    bestLgProb=resProb[bestLg]
-    resProbFiltered={}
-    for (lg,prob) in resProb.items():
-        if prob>=(bestLgProb-threshold) :
-            resProbFiltered[lg]=prob
-    return resProbFiltered
+    bestLgProb=resProb.max(axis=1, keepdims=True)
+    return resProb>=(bestLgProb-threshold)
 
 
 #
 # _lgID_ method for verifying possible languages (when several languages remain after thresholding)
 #   = run the language identification on the single token and choose among the possible languages (i.e. the remaining languages after thresholding, listed in 'detectedLg') the language with the highest probability in the new result
 #   If there is no common language between the new lgId result (on the single token) and 'detectedLg' list, the returned values will be empty
-#   - Input : token="tok", detectedLg=(lg, ... ,lg)
+#   - Input : detector, token="tok", detectedLg=(lg, ... ,lg), tokProb=result of the language identification on the token (if already known)
 #   - Output : (lg,score)
 #
-def simpleVote_lgID (token, detectedLg) :
-    tokResJson=detector.detect(token)
-    tokRes=json.loads(tokResJson)
-    print("lgID vote : ")
-    print(tokRes)
+def simpleVote_lgID (detector, token, detectedLg, tokProb=None) :
+    if tokProb is None :
+        (tokBest,tokProb)=detector.detect_array(token)
+    if log.isEnabledFor(logging.DEBUG) :
+        log.debug("lgID vote : \n%s", detector.to_json(tokProb))
     vote=""
     bestProba=0
-    i=0
-    for lg in tokRes['labels'] :
-        if lg in detectedLg and float(tokRes['prob'][i])>bestProba :
+    for (i,lg) in enumerate(detector.lgCodes) :
+        if lg in detectedLg and tokProb[i]>bestProba :
             vote=lg
-            bestProba=float(tokRes['prob'][i])
-            res=1
-        i+=1
+            bestProba=float(tokProb[i])
 
     return (vote,bestProba)
 
 
+#
+# Token to look for in the dictionaries : the longest subtoken (made of alphabet chars and digits) of the token
+#
+def dicoToken(token):
+    return tokenizer.forAlphabet(alphabet).longestWord(token)
+
+
+#
+# Languages (amongst detectedLg) of the dictionaries containing 'extractedToken'
+#   - dictionary : dictionary backend (see dico.py; the answers fetched in advance for the whole document (see prefetchDico) are used when available)
+#   - Output : [lg, ... ,lg] (empty list if dicServer didn't answer)
+#
+def dicoLookup(dictionary, extractedToken, detectedLg):
+    dicRes=dictionary.possibleLanguages(extractedToken, detectedLg)
+    if dicRes is None :
+        instrument.current().count("dicoFailures")
+        log.error("it wasn't possible to get result from dicServer (%s)", dictionary.request(extractedToken, detectedLg).strip())
+        dicRes=list()
+    return dicRes
+
+
+#
+# Ask the dictionary backend for all the (token, detectedLg) of a document at once (one pipelined exchange with dicServer)
+#   - Input : dictionary (dico.PrefetchedDictionary), [ (token, detectedLg) , ... , (token, detectedLg) ]
+#
+def prefetchDico(dictionary, ambiguousToks):
+    with instrument.current().timer("dicoVote"):
+        dictionary.prefetch([(dicoToken(tok),detectedLg) for (tok,detectedLg) in ambiguousToks])
+
+
 #
 # _dico_ method for verifying possible languages (when several languages remain after thresholding)
 #   = verify the presence of the token into dictionaries (of possible languages, i.e. the remaining languages after thresholding, listed in 'detectedLg') 
 #   If there is no common language between the dico result and 'detectedLg' list, the returned values will be empty
 #   If the token is present in more than one language dictionary, the result will be empty (no decision possible)
 #   If the token is presnt in one (and only one) language dictionary, the language code will be returned in 'vote', the score ('res') will be 1 
-#   - Input : token="tok", detectedLg=(lg, ... ,lg)
+#   - Input : dictionary (see dicoLookup), token="tok", detectedLg=(lg, ... ,lg)
 #   - Output : (lg,score)
-#   __REM__ : this method uses the dictionary server through TCP Socket (port 1112). It must be up and running.
+#   __REM__ : this method uses the dictionary server through TCP Socket (port 1112 by default). It must be up and running (unless a compiled lexicon is used, see --diclexicon).
 #
-def simpleVote_dico (token, detectedLg) :
+def simpleVote_dico (dictionary, token, detectedLg) :
     res=0
     vote=""
-    HOST, PORT = "", 1112
-    # clean token
-    cleanedToken=re.sub(r"([^%s0-9]+)$"%(alphabet),r"", token) # remove unalpha at the end
-    cleanedToken=re.sub(r"^([^%s0-9]+)"%(alphabet),r"", cleanedToken) # remove unalpha at the begining
-    cleanedToken=re.sub(r"([^%s0-9]+)"%(alphabet),r" ", cleanedToken) # replace remaining unalpha (inside the token) by a space char
-    # extract the longest subtoken (separated by space char)
-    cleanedTokenList=cleanedToken.split()
-    extractedToken=""
-    for tok in cleanedTokenList:
-        if len(tok)>len(extractedToken):
-            extractedToken=tok
-    req=" word_possibleLanguages::%s::%s"%(extractedToken,",".join(detectedLg))   # REM: max legth of req is 2048 chars
-    print("Sending request : %s"%req)
-    # -- Create a socket (SOCK_STREAM means a TCP socket)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    dicRes=list()
-    try:
-        # -- Connect to server and send data
-        sock.connect((HOST, PORT))
-        sock.sendall(("%s\n"%req).encode(encoding='utf-8'))
-        # Receive data from the server and shut down
-        received = sock.recv(1024)
-        dicRes=json.loads(received)
-    except:
-        print("ERROR : it wasn't possible to get result from dicServer (%s)"%req)
-    finally:
-        sock.close()
-    print("DicRes: {}".format(dicRes))
+    extractedToken=dicoToken(token)
+    if log.isEnabledFor(logging.DEBUG) :
+        log.debug("Sending request : %s", dictionary.request(extractedToken, detectedLg).strip())
+    dicRes=dicoLookup(dictionary, extractedToken, detectedLg)
+    log.debug("DicRes: %s", dicRes)
     nbLgOk=0
     for (lgIdx,lgDic) in enumerate(dicRes):
         if lgDic in detectedLg:
-            print("%s %s in Dico and detectedLg"%(lgIdx,lgDic))
+            log.debug("%s %s in Dico and detectedLg", lgIdx, lgDic)
             nbLgOk+=1
             lgToVote=lgIdx
     if nbLgOk==1 :
         # we only decide if there is only one detetcted language amongst the given detectedLg!
-        print(" %s (%s) is the only to know the token "%(dicRes[lgToVote],lgToVote))
+        log.debug(" %s (%s) is the only to know the token ", dicRes[lgToVote], lgToVote)
         vote=dicRes[lgToVote]
         res=1
     else :
-        print("No decision (possible lg: %s)"%(nbLgOk))
+        log.debug("No decision (possible lg: %s)", nbLgOk)
     return (vote,res)
 
 
@@ -286,79 +759,52 @@ def simpleVote_dico (token, detectedLg) :
 #       1. lgID method on the token alone : the language with the highest probability wich is also present into detectedLg will score 1 point (into 'votes[lg]')
 #       2. dico method : if the token is present into the dictionary of one (and only one) of the predetermined detectedLg, this language will score 1 point (into 'votes[lg]')
 #       3. If the two first steps gave different results, try to choose between those languages by comparing to the best language detected globally (bestGlobLg). If it doesn't match with one language chose during steps 1 or 2, do not choose (empty result)
-#   - Input : token="tok", detectedLg=(lg, ... ,lg), bestGlobLg="lg"
+#   - Input : detector, dictionary (see dicoLookup), token="tok", detectedLg=(lg, ... ,lg), bestGlobLg="lg", tokProb=result of the language identification on the token (if already known)
 #   - Output : (lg,score)
 #
-def voteForAmbigousLg (token, detectedLg, bestGlobLg) :
+def voteForAmbigousLg (detector, dictionary, token, detectedLg, bestGlobLg, tokProb=None) :
     votes={x:0 for x in detectedLg}
     totVote=0
     winLg=""
     res=0
 
     # --- VOTE 1 : first get an estimation from lgID for the token alone (best probability amongst the predetermined detectedLg given as parameter) ---
-    tokResJson=detector.detect(token)
-    tokRes=json.loads(tokResJson)
-    print(tokRes)
+    if tokProb is None :
+        (tokBest,tokProb)=detector.detect_array(token)
+    if log.isEnabledFor(logging.DEBUG) :
+        log.debug(detector.to_json(tokProb))
     vote1=""
     bestProba=0
-    i=0
-    for lg in tokRes['labels'] :
-        if lg in detectedLg and float(tokRes['prob'][i])>bestProba :
+    for (i,lg) in enumerate(detector.lgCodes) :
+        if lg in detectedLg and tokProb[i]>bestProba :
             vote1=lg
-            bestProba=float(tokRes['prob'][i])
-        i+=1
+            bestProba=float(tokProb[i])
     if vote1 != "" :
         votes[vote1]+=1
         totVote+=1
-    print("Votes after (1): ")
-    print(votes)
+    log.debug("Votes after (1): \n%s", votes)
 
     # --- VOTE 2 : check dictionary (check if we can find the token into the dictionary of one (and only one) of the predetermined detectedLg) ---
     vote2=""
-    HOST, PORT = "", 1112
-    # clean token
-    cleanedToken=re.sub(r"([^%s0-9]+)$"%(alphabet),r"", token) # remove unalpha at the end
-    cleanedToken=re.sub(r"^([^%s0-9]+)"%(alphabet),r"", cleanedToken) # remove unalpha at the begining
-    cleanedToken=re.sub(r"([^%s0-9]+)"%(alphabet),r" ", cleanedToken) # replace remaining unalpha (inside the token) by a space char
-    # extract the longest subtoken (separated by space char)
-    cleanedTokenList=cleanedToken.split()
-    extractedToken=""
-    for tok in cleanedTokenList:
-        if len(tok)>len(extractedToken):
-            extractedToken=tok
-    req=" word_possibleLanguages::%s::%s"%(extractedToken,",".join(detectedLg))   # REM: max legth of req is 2048 chars
-    # -- Create a socket (SOCK_STREAM means a TCP socket)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    dicRes=list()
-    try:
-        # -- Connect to server and send data
-        sock.connect((HOST, PORT))
-        sock.sendall(("%s\n"%req).encode(encoding='utf-8'))
-        # Receive data from the server and shut down
-        received = sock.recv(1024)
-        dicRes=json.loads(received)
-    except:
-        print("ERROR : it wasn't possible to get result from dicServer (%s)"%req)
-    finally:
-        sock.close()
-    print("DicRes: {}".format(dicRes))
+    extractedToken=dicoToken(token)
+    dicRes=dicoLookup(dictionary, extractedToken, detectedLg)
+    log.debug("DicRes: %s", dicRes)
     nbLgOk=0
     for (lgIdx,lgDic) in enumerate(dicRes):
         if lgDic in detectedLg:
-            print("%s %s in Dico and detectedLg"%(lgIdx,lgDic))
+            log.debug("%s %s in Dico and detectedLg", lgIdx, lgDic)
             nbLgOk+=1
             lgToVote=lgIdx
     if nbLgOk==1 :
         # we only give this vote if there is only one detetcted language amongst the given detectedLg!
-        print("Vote2 given to %s (%s)"%(dicRes[lgToVote],lgToVote))
+        log.debug("Vote2 given to %s (%s)", dicRes[lgToVote], lgToVote)
         vote2=dicRes[lgToVote]
         votes[vote2]+=1
         totVote+=1
     else :
-        print("Vote2 is not given (possible lg: %s)"%(nbLgOk))
+        log.debug("Vote2 is not given (possible lg: %s)", nbLgOk)
     
-    print("Votes after (2) : ")
-    print(votes)
+    log.debug("Votes after (2) : \n%s", votes)
 
     # --- VOTE 3 : if we have 2 different votes, try to decide using global probability (or do not decide at all) ---
     if totVote == 2 and vote1 != vote2 :
@@ -374,12 +820,667 @@ def voteForAmbigousLg (token, detectedLg, bestGlobLg) :
     if totVote>0 :
         winLg=max(votes.items(), key=operator.itemgetter(1))[0]
         res=votes[winLg]
-    print("FinalVotes: ")
-    print(votes)
+    log.debug("FinalVotes: \n%s", votes)
     return (winLg,res)
 
 
 
+
+
+#
+# Tokenize and preprocess a text (see tokenizer.py : U+00AC and U+00AD chars removed, whitespaces normalized, unalpha removed at the begining and at the end of the cleaned tokens)
+#   - Output : (cleanedText, tokens, cleanedTokens, offsets) ; 'tokens' are the ORIGINAL tokens (used for the output), 'cleanedTokens' are used to build the fragments,
+#     'offsets' are the (start, end) positions of the tokens in 'text'
+#
+def tokenize(text):
+    return tokenizer.forAlphabet(alphabet).tokenize(text)
+
+
+#
+# Read a text stream (file object) by blocks of 'chunkSize' chars and tokenize it, by segments of 'segmentSize' tokens
+#   - Output (generator) : (tokens, cleanedTokens) of each segment (see tokenize)
+# The blocks are cut after their last whitespace (the incomplete token is kept for the next block) : the tokens are the same as if the whole text was tokenized at once
+#
+def readSegments(stream, segmentSize, chunkSize=1<<20):
+    rest=""
+    tokens=[]
+    cleanedTokens=[]
+    eof=False
+    while not eof:
+        block=stream.read(chunkSize)
+        eof=len(block)==0
+        block=rest+block
+        rest=""
+        if not eof :
+            cut=len(block)
+            while cut>0 and not block[cut-1].isspace():
+                cut-=1
+            (block,rest)=(block[:cut],block[cut:])
+        (cleanedText, blockTokens, blockCleanedTokens, offsets)=tokenize(block)
+        tokens+=blockTokens
+        cleanedTokens+=blockCleanedTokens
+        while len(tokens)>=segmentSize or (eof and tokens) :
+            yield (tokens[:segmentSize], cleanedTokens[:segmentSize])
+            del tokens[:segmentSize]
+            del cleanedTokens[:segmentSize]
+
+
+#
+# Detect languages globally
+#   - Output : (possibleLg, bestGlobLg)
+#   IF filterGlob==0 THEN possibleLg will be equivalent to acceptedLg ELSE possibleLg will be the intersection between languages that are detected globally _AND_ the user defined language (if set, or by default the languages defined in the chosen model)
+#
+def globalLanguages(detector, cleanedText, acceptedLg, filterGlob):
+    (globBest,globProb)=detector.detect_array(cleanedText, useCache=False)
+    if log.isEnabledFor(logging.DEBUG) :
+        log.debug(detector.to_json(globProb))
+    return selectLanguages(detector, globProb, acceptedLg, filterGlob)
+
+
+# possibleLg and bestGlobLg from the probabilities of the global detection (see globalLanguages)
+def selectLanguages(detector, globProb, acceptedLg, filterGlob):
+    possibleLg=[]
+    bestGlobLg=""
+    bestGlobProb=0
+    for (idx,prob) in enumerate(globProb) :
+        if detector.lgCodes[idx] in acceptedLg :
+            if prob>=filterGlob : # allow to remove languages with a global probability less than 'filterGlob' (given as a parameter; default value 0 keeps all languages)
+                possibleLg.append(detector.lgCodes[idx])
+                # REM : filtering on a list of possible languages detected globally could work for a sentence or a small paragraph with a small number of different languages,
+                # BUT it is not appropriate for a big text with many different languages --> BY DEFAULT it is recommended to use all languages !!!
+            if prob > bestGlobProb :
+                bestGlobLg=detector.lgCodes[idx]
+                bestGlobProb=float(prob)
+    log.debug("Possible languages found globally (user defined -- if any -- and globally detected) : \n%s", possibleLg)
+    log.debug("Best language globally detected : %s", bestGlobLg)
+    return (possibleLg, bestGlobLg)
+
+
+#
+# Generate sliding window data & detect language (we use CLEANED tokens to build fragment with sliding window)
+#   - skipMargin, skipStride : adaptive window skipping (skipMargin = 0 : all the windows are analysed)
+#     the windows are first analysed every skipStride tokens ; between two analysed windows having the same best language with a margin (difference between the
+#     two best probabilities) of at least skipMargin, the windows are not analysed : they take the probabilities of the nearest analysed window.
+#     The other windows (near the switch points, or with a low margin) are all analysed.
+#   - threads : without skipping, the windows are scored by chunks of consecutive tokens on 'threads' threads (see chunkRanges and instrument.parallel) ;
+#     the probabilities of the chunks are merged in order before the accumulation : the scores are the same whatever the number of threads
+#   - Output : array (nbToks, len(possibleLg)) of the cumulated scores of each token
+#
+def windowScores(detector, cleanedTokens, swSize, possibleLg, batchSize, skipMargin=0, skipStride=4, threads=1):
+    nbToks=len(cleanedTokens)
+    possibleIdx=numpy.array([detector.lgIndex[lg] for lg in possibleLg], dtype=int)    # indexes of possibleLg in the detector results
+    log.debug("Nombre de tokens : %s", nbToks)
+    results=numpy.zeros((nbToks,len(possibleLg)), dtype=numpy.float32)    # cumulated scores of each token (columns ordered as possibleLg)
+    stats=instrument.current()
+
+    # features of the windows centered on the tokens first..last-1, incrementally extracted
+    # (the windows cover a circular sequence : swSize tokens before 'first' + tokens + swSize tokens after 'last-1', the last and first tokens of the text at its edges, see slidingWindow)
+    def windowFeatures(first, last):
+        with stats.timer("features"):
+            seq=[cleanedTokens[k % nbToks] for k in range(first-swSize, last+swSize)] if nbToks>0 else []
+            return WindowFeatures(detector, seq)
+
+    # recalibrated probabilities of the windows centered on the tokens 'centers' (in increasing order ; 'features' : see windowFeatures(first, ...))
+    # windows are submitted to the language detector by blocks of 'batchSize' windows
+    def scoreWindows(features, centers, first=0, forget=True):
+        blocks=[numpy.zeros((0,len(possibleLg)))]
+        for blockStart in range(0,len(centers),batchSize):
+            block=centers[blockStart:blockStart+batchSize]
+            with stats.timer("features"):
+                spans=[(curTok-first, curTok-first+2*swSize) for curTok in block]
+                texts=[features.window_text(*span) for span in spans]
+            stats.count("windows", len(block))
+
+            # detect language of the fragments (the features are only extracted for the fragments that are not in the cache)
+            def extract(indexes):
+                with stats.timer("features"):
+                    return list(features.iter_events([spans[i] for i in indexes], forget, texts=[texts[i] for i in indexes]))
+            (fragBest,fragProb)=detector.score_cached(texts, extract)
+
+            # recalibrate probabilities with regard to possibleLg
+            with stats.timer("recalibration"):
+                recProbs=recalibrateResults(fragProb,possibleIdx)
+            if log.isEnabledFor(logging.DEBUG) :
+                with stats.timer("display"):
+                    for (idx,curTok) in enumerate(block):
+                        (fragment,toksToUpdate)=slidingWindow(curTok, cleanedTokens, swSize)
+                        log.debug("%s : \nraw : %s\nrecalibrated : %s\nTokens to update [cur, prev, next] :\n%s", fragment, detector.to_json(fragProb[idx]), dict(zip(possibleLg,recProbs[idx].tolist())), toksToUpdate)
+            blocks.append(recProbs)
+        return numpy.concatenate(blocks)
+
+    if skipMargin>0 and skipStride>1 and nbToks>0 :
+        features=windowFeatures(0, nbToks)
+        coarse=list(range(0,nbToks,skipStride))
+        if coarse[-1]!=nbToks-1 :
+            coarse.append(nbToks-1)
+        winProbs=numpy.zeros((nbToks,len(possibleLg)))
+        (confident, best)=(numpy.zeros(len(coarse), dtype=bool), numpy.zeros(len(coarse), dtype=int))
+        nbSkipped=0
+        # by blocks of coarse windows : the coarse windows, then the windows between them that must be analysed (the features of the tokens are kept for them)
+        for blockStart in range(0,len(coarse),batchSize):
+            block=coarse[blockStart:blockStart+batchSize]
+            probs=scoreWindows(features, block, forget=False)
+            winProbs[block]=probs
+            top=numpy.sort(probs, axis=1)
+            confident[blockStart:blockStart+len(block)]=top[:,-1]-top[:,-2]>=skipMargin if len(possibleLg)>1 else True
+            best[blockStart:blockStart+len(block)]=probs.argmax(axis=1)
+            fine=[]
+            for i in range(max(blockStart-1,0), blockStart+len(block)-1):
+                (c1,c2)=(coarse[i],coarse[i+1])
+                if confident[i] and confident[i+1] and best[i]==best[i+1] :
+                    mid=(c1+c2)//2
+                    winProbs[c1+1:mid+1]=winProbs[c1]
+                    winProbs[mid+1:c2]=winProbs[c2]
+                    nbSkipped+=c2-c1-1
+                else :
+                    fine+=range(c1+1,c2)
+            winProbs[fine]=scoreWindows(features, fine)
+        stats.count("windowsSkipped", nbSkipped)
+    else :
+        chunks=instrument.parallel(lambda first, last: scoreWindows(windowFeatures(first, last), list(range(first, last)), first), chunkRanges(nbToks, threads, batchSize), threads)
+        winProbs=numpy.concatenate(chunks)
+
+    # add the results of each window to the scores of its tokens
+    with stats.timer("accumulation"):
+        results=accumulateWindows(winProbs, numpy.arange(nbToks), swSize, results)
+    return results
+
+
+#
+# Split the tokens [0, nbToks[ into at most nbChunks ranges of consecutive tokens, of at least minSize tokens (see windowScores)
+#   - Output : [ (first, last) , ... , (first, last) ] (last excluded)
+#
+def chunkRanges(nbToks, nbChunks, minSize):
+    nbChunks=max(1, min(nbChunks, nbToks//max(minSize,1)))
+    bounds=[nbToks*i//nbChunks for i in range(nbChunks+1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+#
+# Raw probabilities of the sliding windows (see windowScores) : array (nbToks, len(detector.lgCodes)), one row per window (centered on each token)
+#   - threads : the windows are scored by chunks of consecutive tokens on 'threads' threads (see windowScores)
+#
+def windowProbabilities(detector, cleanedTokens, swSize, batchSize, threads=1):
+    nbToks=len(cleanedTokens)
+    stats=instrument.current()
+    # probabilities of the windows centered on the tokens first..last-1
+    def chunkProbabilities(first, last):
+        with stats.timer("features"):
+            seq=[cleanedTokens[k % nbToks] for k in range(first-swSize, last+swSize)] if nbToks>0 else []
+            features=WindowFeatures(detector, seq)
+        blocks=[numpy.zeros((0,len(detector.lgCodes)), dtype=detector.scoreType)]
+        for blockStart in range(first,last,batchSize):
+            with stats.timer("features"):
+                spans=[(curTok-first, curTok-first+2*swSize) for curTok in range(blockStart,min(blockStart+batchSize,last))]
+                texts=[features.window_text(*span) for span in spans]
+            stats.count("windows", len(spans))
+            def extract(indexes):
+                with stats.timer("features"):
+                    return list(features.iter_events([spans[i] for i in indexes], texts=[texts[i] for i in indexes]))
+            blocks.append(detector.score_cached(texts, extract)[1])
+        return numpy.concatenate(blocks)
+    return numpy.concatenate(instrument.parallel(chunkProbabilities, chunkRanges(nbToks, threads, batchSize), threads))
+
+
+#
+# Add the (recalibrated) probabilities of the windows centered on the tokens 'centers' to the scores of their tokens [cur, prev, next] (see slidingWindow and updateResults)
+#
+def accumulateWindows(recProbs, centers, swSize, results):
+    shifts=numpy.array([0]+[-i for i in range(1,swSize+1)]+list(range(1,swSize+1)), dtype=int)
+    return updateResults(recProbs, (numpy.asarray(centers)[:,None]+shifts[None,:]) % max(len(results),1), results)
+
+
+#
+# Window scores for several context sizes at once (see windowScores) : the features of the tokens are extracted once for all the sizes
+#   - Output : { swSize : array (nbToks, len(possibleLg)) of the cumulated scores of each token , ... } (the same scores as windowScores for each size)
+#
+def multiWindowScores(detector, cleanedTokens, swSizes, possibleLg, batchSize):
+    nbToks=len(cleanedTokens)
+    possibleIdx=numpy.array([detector.lgIndex[lg] for lg in possibleLg], dtype=int)
+    maxSw=max(swSizes)
+    results={swSize:numpy.zeros((nbToks,len(possibleLg)), dtype=numpy.float32) for swSize in swSizes}
+    stats=instrument.current()
+    # the sequence covers the windows of the largest size (maxSw last tokens + tokens + maxSw first tokens) : the window of size swSize centered on the token t is (t+maxSw-swSize, t+maxSw+swSize)
+    with stats.timer("features"):
+        seq=[cleanedTokens[k % nbToks] for k in range(-maxSw, nbToks+maxSw)] if nbToks>0 else []
+        features=WindowFeatures(detector, seq)
+    for blockStart in range(0,nbToks,batchSize):
+        block=numpy.arange(blockStart,min(blockStart+batchSize,nbToks))
+        for swSize in swSizes:
+            with stats.timer("features"):
+                spans=[(curTok+maxSw-swSize, curTok+maxSw+swSize) for curTok in block]
+                texts=[features.window_text(*span) for span in spans]
+            stats.count("windows", len(spans))
+            def extract(indexes):
+                with stats.timer("features"):
+                    return list(features.iter_events([spans[i] for i in indexes], forget=False, texts=[texts[i] for i in indexes]))
+            (fragBest,fragProb)=detector.score_cached(texts, extract)
+            with stats.timer("recalibration"):
+                recProbs=recalibrateResults(fragProb,possibleIdx)
+            with stats.timer("accumulation"):
+                accumulateWindows(recProbs, block, swSize, results[swSize])
+        # the features of the tokens before the windows of the next block are not needed anymore
+        features.forget(features.firstRank[block[-1]+1])
+    return results
+
+
+#
+# Choose the language of each token (tresholding and, if needed, vote)
+#   - filteredResults : array (nbToks, len(possibleLg)) of probabilities
+#   - firstIdx : number of the first token in the document (for the debug trace, see instrument.DebugTrace)
+#   - votes : list to which the score of the vote of each token is appended (None if there was no vote), None = not needed
+#   - Output : [lg, ... ,lg] one language per token
+#
+def decideLanguages(detector, dictionary, tokens, filteredResults, possibleLg, bestGlobLg, significantGap, voteMethod, firstIdx=0, votes=None):
+    stats=instrument.current()
+    # tresholding (remove lg with probability < (best language probability) - margin
+    with stats.timer("thresholding"):
+        keptLg=removeUnsignificantLanguages(filteredResults, significantGap)
+        bestLgIdx=filteredResults.argmax(axis=1)
+
+    # --- PHASE 1 : inputs of the votes of all the ambiguous tokens (several languages after thresholding), each different token being resolved once ---
+    #   the dictionary lookups (pipelined / concurrent exchanges with dicServer) run in a thread, while the language identification of the tokens is done in one batch
+    ambiguousToks=[(tokens[idx],[possibleLg[i] for i in numpy.flatnonzero(keptLg[idx])]) for idx in numpy.flatnonzero(keptLg.sum(axis=1)>1)]
+    stats.count("ambiguousTokens", len(ambiguousToks))
+    lookups=None
+    if voteMethod in ("full","dico") and ambiguousToks :
+        lookups=instrument.thread(prefetchDico, (dictionary, ambiguousToks))
+        lookups.start()
+    tokProbs={}
+    if voteMethod in ("full","lgID") and ambiguousToks :
+        with stats.timer("lgIDVote"):
+            uniqueToks=list(dict.fromkeys([tok for (tok,detectedLg) in ambiguousToks]))
+            (tokBest,tokProb)=detector.detect_batch(uniqueToks)
+            tokProbs=dict(zip(uniqueToks, tokProb))
+    if lookups is not None :
+        lookups.join()
+
+    # --- PHASE 2 : decision for each token ---
+    with stats.timer("decision"):
+        return decisions(detector, dictionary, tokens, filteredResults, keptLg, bestLgIdx, tokProbs, possibleLg, bestGlobLg, voteMethod, firstIdx, votes)
+
+
+# decision for each token (see decideLanguages)
+def decisions(detector, dictionary, tokens, filteredResults, keptLg, bestLgIdx, tokProbs, possibleLg, bestGlobLg, voteMethod, firstIdx=0, votes=None):
+    # --- Outputs in a human friendly format (we use ORIGINAL tokens to output), if the debug messages are enabled ---
+    debug=log.isEnabledFor(logging.DEBUG)
+    trace=instrument.debugTrace()
+    log.debug("OUTPUT")
+    languages=[]
+    for (idx,tok) in enumerate(tokens):
+        resProb=filteredResults[idx]
+        detectedIdx=numpy.flatnonzero(keptLg[idx])
+        if debug :
+            log.debug("[%s] : %s\n%s\nThresholding :\n%s", idx, tok, dict(zip(possibleLg,resProb.tolist())), dict([(possibleLg[i],float(resProb[i])) for i in detectedIdx]))
+        tokRes="%s : "%tok
+        # if there are still several possibilities, use the voting procedure
+        detectedLg=[possibleLg[i] for i in detectedIdx]
+        bestLg=possibleLg[bestLgIdx[idx]]
+        score=0
+        winLg=""
+        ccl=""
+        if len(detectedLg)>1 :
+            log.debug("Vote for remaining languages after thresholding :")
+            if voteMethod=="full":
+                (winLg,score)=voteForAmbigousLg (detector, dictionary, tok, detectedLg, bestGlobLg, tokProbs.get(tok))
+            elif voteMethod=="lgID":
+                (winLg,score)=simpleVote_lgID (detector, tok, detectedLg, tokProbs.get(tok))
+            else :
+                (winLg,score)=simpleVote_dico (dictionary, tok, detectedLg)
+            log.debug(" %s : %s", winLg, score)
+            if score>0 :
+                ccl=" => %s (%s)"%(winLg,score)
+            else: # if voting doesn't help, keep the language with the higher probability
+                ccl="=> %s (%s)"%(bestLg,resProb[bestLgIdx[idx]])
+        # display all the languages kept after tresholding in descending order (for information)
+        if debug :
+            for i in sorted(detectedIdx, key=lambda i:-resProb[i]):
+                if resProb[i]>0 :
+                    tokRes="%s%s (%s)  "%(tokRes, possibleLg[i], resProb[i])
+            log.debug("%s%s", tokRes, ccl)
+        if len(winLg)==0 :
+            languages.append(bestLg)
+        else:
+            languages.append(winLg)
+        if votes is not None :
+            votes.append(float(score) if len(detectedLg)>1 else None)
+        if trace is not None and trace.sampled(firstIdx+idx) :
+            trace.write({"document":instrument.document(), "index":firstIdx+idx, "token":tok, "probabilities":dict(zip(possibleLg,resProb.tolist())),
+                         "kept":detectedLg, "vote":[winLg,float(score)] if len(detectedLg)>1 else None, "language":languages[-1]})
+    return languages
+
+
+#
+# CoSwID analyser : keeps the language detector (model loaded once) and the default settings
+#   The settings (swSize, filterGlob, significantGap, voteMethod, acceptedLg) can be changed for each analysis (see analyse)
+#   An instance can be shared by several threads (each thread has its own dictionary backend, i.e. its own connection to dicServer ; see dicFactory to use another backend).
+#   The threads that end (eg. the request threads of the service) give their backend back to a pool with releaseDictionary, so that the next threads reuse it
+#   The probabilities of the fragments (sliding windows and tokens of the votes) and the answers of the dictionary are kept in bounded caches (cacheSize entries each, 0 = no cache),
+#   shared by all the analyses (see saveCache/loadCache to keep them from one run to another)
+#   When acceptedLg is given, the model is pruned (see Detector.subset) : only these languages are scored for the sliding windows and the votes (and only the features having a weight
+#   of at least minWeight for them, if minWeight > 0) ; the analyses can then only use these languages (or a subset of them). The global detection (and the filter threshold filterGlob)
+#   still uses the whole model, so that the results are the same as without pruning (when minWeight = 0)
+#   Eg. : cosw=CoSwID(modelList["FILTER2"], lgList["FILTER2"], swSize=2)
+#         cosw.analyse("Voici un texte à analyser in order to predict the languages", voteMethod="lgID")  --> [(token,lg), ... ,(token,lg)]
+#
+class CoSwID(object):
+    def __init__(self, model, modelLg, swSize=1, filterGlob=0, significantGap=0.1, voteMethod="dico", acceptedLg=None, skipMargin=0, skipStride=4, batchSize=256, dicLexicon="", dicHost="localhost", dicPort=1112, dicTimeout=5.0, cacheSize=100000, dicFactory=None, minWeight=0, threads=1):
+        self.model = model
+        self.modelLg = modelLg
+        self.detector = openDetector(model)
+        self.globalDetector = self.detector     # the global detection (and filterGlob) always uses the whole model (one detection per document)
+        if acceptedLg :
+            self.detector = self.detector.subset(acceptedLg, minWeight)
+        self.caches = {"detection":cache.LRUCache(cacheSize), "dictionary":cache.LRUCache(cacheSize)}
+        if cacheSize > 0 :
+            self.detector.cache = self.caches["detection"]
+        self.settings = {"swSize":swSize, "filterGlob":filterGlob, "significantGap":significantGap, "voteMethod":voteMethod, "acceptedLg":acceptedLg if acceptedLg else modelLg,
+                         "skipMargin":skipMargin, "skipStride":skipStride}
+        self.batchSize = batchSize
+        self.threads = threads              # number of threads scoring the windows of a document (see windowScores)
+        self.dicSettings = (dicLexicon, dicHost, dicPort, dicTimeout)
+        self.dicFactory = dicFactory if dicFactory else lambda: dico.openDictionary(*self.dicSettings)     # function opening a dictionary backend (called once for each thread without a released backend)
+        self.local = threading.local()
+        self.dicPool = []                   # released dictionary backends (see releaseDictionary)
+        self.dicPoolLock = threading.Lock()
+        self.stats = instrument.Stats()     # measures of all the analyses (see instrument.py)
+        self.trace = None
+        self.traceLock = threading.Lock()
+        self.debugTrace = None              # instrument.DebugTrace (see openDebugTrace)
+
+    # dictionary backend of the current thread (a released backend if there is one, see releaseDictionary)
+    def dictionary(self):
+        if getattr(self.local, "dictionary", None) is None :
+            with self.dicPoolLock:
+                self.local.dictionary = self.dicPool.pop() if self.dicPool else None
+            if self.local.dictionary is None :
+                self.local.dictionary = self.dicFactory()
+        return self.local.dictionary
+
+    # give the dictionary backend of the current thread back to the pool (the thread will not use it anymore) : the backends are opened once
+    # for all the threads that run one after the other (eg. one thread for each connection to the service, see service.py)
+    def releaseDictionary(self):
+        if getattr(self.local, "dictionary", None) is not None :
+            with self.dicPoolLock:
+                self.dicPool.append(self.local.dictionary)
+            self.local.dictionary = None
+
+    # cache of the dictionary answers (None if there is no cache)
+    def dicoCache(self):
+        return self.caches["dictionary"] if self.caches["dictionary"].maxSize > 0 else None
+
+    def close(self):
+        self.releaseDictionary()
+        with self.dicPoolLock:
+            (dictionaries, self.dicPool) = (self.dicPool, [])
+        for dictionary in dictionaries:
+            dictionary.close()
+        if self.trace is not None :
+            self.trace.close()
+            self.trace = None
+        if self.debugTrace is not None :
+            self.debugTrace.close()
+            self.debugTrace = None
+
+    # keep the caches in a file (the detection cache is only valid for the same model)
+    def saveCache(self, path):
+        cache.saveCaches(path, self.caches, (self.model, self.detector.lgCodes, self.detector.nbFeatures, self.detector.minWeight, self.detector.quantization))
+
+    def loadCache(self, path):
+        return cache.loadCaches(path, self.caches, (self.model, self.detector.lgCodes, self.detector.nbFeatures, self.detector.minWeight, self.detector.quantization))
+
+    # quantize the model (see Detector.quantize), after an accuracy check on the gold standard data (see bench.py) :
+    #   the data sets are analysed with the current model and with the quantized model (settings of this instance, without dictionary),
+    #   and the quantized model is refused (ValueError) if the accuracy decreases by more than maxLoss on one of them (maxLoss=None : no check)
+    #   - goldDir, names : directory and names of the data sets (see bench.loadDatasets)
+    #   - Output : { data set : (accuracy of the current model, accuracy of the quantized model) }
+    def quantize(self, mode, maxLoss=0.005, goldDir=None, names=None):
+        quantized = self.detector.quantize(mode)
+        accuracies = {}
+        if maxLoss is not None :
+            import bench
+            datasets = bench.loadDatasets(goldDir if goldDir else bench.GOLD_DIR, names)
+            results = []
+            for detector in (self.detector, quantized):
+                checker = copy.copy(self)
+                (checker.detector, checker.dicFactory, checker.local, checker.dicPool) = (detector, dico.StubDictionary, threading.local(), [])
+                (checker.stats, checker.trace, checker.debugTrace) = (instrument.Stats(), None, None)
+                results.append(bench.run(checker, datasets)["datasets"])
+            accuracies = {name:(results[0][name]["accuracy"], results[1][name]["accuracy"]) for name in results[0]}
+            lost = ["%s %0.4f -> %0.4f"%(name, ref, acc) for (name, (ref, acc)) in accuracies.items() if acc < ref-maxLoss]
+            if lost :
+                raise ValueError("the %s model is less accurate (%s ; maximum loss : %s)"%(mode, ", ".join(lost), maxLoss))
+        # the cached probabilities were computed with the previous model
+        self.caches["detection"].clear()
+        self.globalDetector = quantized if self.globalDetector is self.detector else self.globalDetector.quantize(mode)
+        self.detector = quantized
+        if self.caches["detection"].maxSize > 0 :
+            self.detector.cache = self.caches["detection"]
+        return accuracies
+
+    # hits/misses of the caches
+    def cacheStats(self):
+        return {name:c.stats() for (name, c) in self.caches.items()}
+
+    # settings for one analysis : default settings updated with 'options' (same names as the settings)
+    #   ValueError if a setting is unknown or has an invalid type or value (swSize >= 0, skipStride >= 1, filterGlob/significantGap/skipMargin in [0,1])
+    def settingsFor(self, options):
+        settings = dict(self.settings)
+        for (name, value) in options.items():
+            if name not in settings :
+                raise ValueError("unknown setting : %s"%name)
+            if value is not None :
+                settings[name] = value
+        for name in ("swSize", "skipStride") :
+            if not isinstance(settings[name], numbers.Integral) or isinstance(settings[name], bool) or settings[name] < (1 if name == "skipStride" else 0) :
+                raise ValueError("invalid %s : %r (integer >= %d expected)"%(name, settings[name], 1 if name == "skipStride" else 0))
+        for name in ("filterGlob", "significantGap", "skipMargin") :
+            if not isinstance(settings[name], numbers.Real) or isinstance(settings[name], bool) or not 0 <= settings[name] <= 1 :
+                raise ValueError("invalid %s : %r (number in [0,1] expected)"%(name, settings[name]))
+        if settings["voteMethod"] not in ("full","lgID","dico") :
+            raise ValueError("unknown voting method : %s"%settings["voteMethod"])
+        if isinstance(settings["acceptedLg"], str) or not all(isinstance(lg, str) for lg in settings["acceptedLg"]) :
+            raise ValueError("invalid acceptedLg : %r (list of language codes expected)"%(settings["acceptedLg"],))
+        pruned = [lg for lg in settings["acceptedLg"] if lg in self.modelLg and lg not in self.detector.lgIndex]
+        if pruned :
+            raise ValueError("languages pruned from the model : %s"%",".join(pruned))
+        return settings
+
+    # analyse a text
+    #   - options : swSize, filterGlob, significantGap, voteMethod, acceptedLg, skipMargin, skipStride (default: settings given at initialisation ; see windowScores for skipMargin/skipStride)
+    #   - stats : instrument.Stats collecting the measures of this analysis (the measures are also added to self.stats, and written into the trace file if any)
+    #   - document : name of the document in the trace file
+    #   - spans : True to get the positions of the tokens in 'text'
+    #   - scores : dictionary filled with the details of the analysis (None = not needed) : 'lgCodes' (possible languages), 'probabilities' (array (nbToks, len(lgCodes)), see normLanguageScores),
+    #              'votes' (score of the vote of each token, None if there was no vote), 'offsets' (positions of the tokens in 'text') ; see probmatrix.py
+    #   - Output : [ (token,lg) , ... , (token,lg) ] or, with spans, [ (start,end,token,lg) , ... , (start,end,token,lg) ] (text[start:end] is the original token)
+    def analyse(self, text, stats=None, document=None, spans=False, scores=None, **options):
+        settings = self.settingsFor(options)
+        stats = stats if stats is not None else instrument.Stats()
+        start = time.perf_counter()
+        with instrument.collect(stats, self.debugTrace, document):
+            with stats.timer("tokenize"):
+                (cleanedText, tokens, cleanedTokens, offsets) = tokenize(text)
+            with stats.timer("global"):
+                (possibleLg, bestGlobLg) = globalLanguages(self.globalDetector, cleanedText, settings["acceptedLg"], settings["filterGlob"])
+            if len(possibleLg)==0:
+                raise ValueError("no language available!")
+            results = windowScores(self.detector, cleanedTokens, settings["swSize"], possibleLg, self.batchSize, settings["skipMargin"], settings["skipStride"], self.threads)
+            # --- Finalize the results  ---
+            # this step is needed to transform scores into probabilities
+            with stats.timer("accumulation"):
+                filteredResults = normLanguageScores(results, settings["swSize"])
+            votes = [] if scores is not None else None
+            languages = decideLanguages(self.detector, dico.PrefetchedDictionary(self.dictionary(), self.dicoCache()), tokens, filteredResults, possibleLg, bestGlobLg, settings["significantGap"], settings["voteMethod"], votes=votes)
+        stats.count("documents")
+        stats.count("tokens", len(tokens))
+        self.record(stats, document, time.perf_counter()-start)
+        if scores is not None :
+            scores.update({"lgCodes":possibleLg, "probabilities":filteredResults, "votes":votes, "offsets":offsets})
+        if spans :
+            return [(begin, end, tok, lg) for ((begin, end), tok, lg) in zip(offsets, tokens, languages)]
+        return list(zip(tokens, languages))
+
+    # analyse a text with several context sizes in one pass (the tokenization, the global detection and the features of the tokens are shared by all the sizes)
+    #   - swSizes : [swSize, ... , swSize] context sizes (the swSize setting is not used)
+    #   - combine : False = one decision for each size ; True = one decision, on the mean of the probabilities of all the sizes
+    #   - options, stats, document, spans : see analyse (the adaptive window skipping is not available)
+    #   - Output : [ (token, lg of the first size, ... , lg of the last size) , ... ] or, with combine, [ (token,lg) , ... , (token,lg) ] (with spans : start and end before the token)
+    def analyseMulti(self, text, swSizes, combine=False, stats=None, document=None, spans=False, **options):
+        settings = self.settingsFor(options)
+        if settings["skipMargin"] > 0 :
+            raise ValueError("the adaptive window skipping (skipMargin) is not available with several context sizes")
+        if not swSizes or min(swSizes) < 1 :
+            raise ValueError("invalid context sizes : %s"%str(swSizes))
+        stats = stats if stats is not None else instrument.Stats()
+        start = time.perf_counter()
+        with instrument.collect(stats, self.debugTrace, document):
+            with stats.timer("tokenize"):
+                (cleanedText, tokens, cleanedTokens, offsets) = tokenize(text)
+            with stats.timer("global"):
+                (possibleLg, bestGlobLg) = globalLanguages(self.globalDetector, cleanedText, settings["acceptedLg"], settings["filterGlob"])
+            if len(possibleLg)==0:
+                raise ValueError("no language available!")
+            results = multiWindowScores(self.detector, cleanedTokens, swSizes, possibleLg, self.batchSize)
+            with stats.timer("accumulation"):
+                filteredResults = [normLanguageScores(results[swSize], swSize) for swSize in swSizes]
+            if combine :
+                with stats.timer("accumulation"):
+                    filteredResults = [sum(filteredResults)/len(filteredResults)]
+            dictionary = dico.PrefetchedDictionary(self.dictionary(), self.dicoCache())
+            languages = [decideLanguages(self.detector, dictionary, tokens, res, possibleLg, bestGlobLg, settings["significantGap"], settings["voteMethod"]) for res in filteredResults]
+        stats.count("documents")
+        stats.count("tokens", len(tokens))
+        self.record(stats, document, time.perf_counter()-start)
+        if spans :
+            return [(begin, end)+res for ((begin, end), res) in zip(offsets, zip(tokens, *languages))]
+        return list(zip(tokens, *languages))
+
+    # add the measures of an analysis to self.stats, and write them into the trace file (if any, see openTrace)
+    def record(self, stats, document=None, analysisTime=None):
+        self.stats.merge(stats)
+        if self.trace is not None :
+            line = json.dumps({"document":document, "time":analysisTime, "measures":stats.summary()}, ensure_ascii=False)
+            with self.traceLock:
+                self.trace.write(line+"\n")
+                self.trace.flush()
+
+    # trace file : one JSON line with the measures of each document analysed
+    def openTrace(self, path):
+        self.trace = codecs.open(path, 'a', "utf-8")
+
+    # debug trace file : one JSON line for one token every 'every' tokens (see instrument.DebugTrace)
+    def openDebugTrace(self, path, every=1):
+        self.debugTrace = instrument.DebugTrace(path, every)
+
+    # analyse a text stream (file object) with a bounded memory ; the results ("token\tlg" lines) are written to 'output' (file object) as soon as the tokens are decided
+    #   - the text is read by segments of 'segmentSize' tokens, and the global detection (possibleLg, bestGlobLg) is done on each segment
+    #   - only the tokens that are not decided yet are kept in memory (at most segmentSize + 2*swSize tokens)
+    #   - unlike analyse, the windows do not wrap around at the begining and at the end of the text : they only contain the existing tokens, and the score of each token is divided by its number of windows
+    # With filterGlob=0 (possibleLg does not depend on the global detection), the results are the same as analyse, except for the 2*swSize first and last tokens (and the _full_ votes relying on bestGlobLg)
+    #   - options, stats : see analyse
+    #   - Output : number of tokens
+    def analyseStream(self, stream, output, segmentSize=10000, stats=None, **options):
+        settings = self.settingsFor(options)
+        if settings["skipMargin"] > 0 :
+            raise ValueError("the adaptive window skipping (skipMargin) is not available in streaming mode")
+        stats = stats if stats is not None else instrument.Stats()
+        swSize = settings["swSize"]
+        detector = self.detector
+        nbLabels = len(detector.lgCodes)
+        start = time.perf_counter()
+        with instrument.collect(stats, self.debugTrace, getattr(stream, "name", None)):
+            segments = readSegments(stream, segmentSize)
+            segInfo = {}        # segment number -> (possibleLg, bestGlobLg, indexes of possibleLg in the detector results)
+            nbSegments = 0
+            # tokens not decided yet (from the token number 'base'), their segment number and their cumulated scores (columns ordered as detector.lgCodes)
+            (tokens, cleanedTokens, tokSeg) = ([], [], [])
+            scores = numpy.zeros((0, nbLabels), dtype=numpy.float32)
+            base = 0
+            nbRead = 0          # number of tokens read
+            nextCenter = 0      # token at the center of the next window to compute
+            eof = False
+            while not eof:
+                with stats.timer("tokenize"):
+                    segment = next(segments, None)
+                eof = segment is None
+                if not eof :
+                    (segTokens, segCleanedTokens) = segment
+                    with stats.timer("global"):
+                        (possibleLg, bestGlobLg) = globalLanguages(self.globalDetector, " ".join(segTokens), settings["acceptedLg"], settings["filterGlob"])
+                    if len(possibleLg)==0:
+                        raise ValueError("no language available!")
+                    segNo = nbSegments
+                    nbSegments += 1
+                    segInfo[segNo] = (possibleLg, bestGlobLg, numpy.array([detector.lgIndex[lg] for lg in possibleLg], dtype=int))
+                    tokens += segTokens
+                    cleanedTokens += segCleanedTokens
+                    tokSeg += [segNo]*len(segTokens)
+                    scores = numpy.concatenate((scores, numpy.zeros((len(segTokens), nbLabels), dtype=numpy.float32)))
+                    nbRead += len(segTokens)
+
+                # --- windows whose swSize following tokens are known (all the remaining windows at the end of the stream) ---
+                lastCenter = nbRead if eof else nbRead-swSize
+                centers = range(nextCenter, max(nextCenter, lastCenter))
+                windows = [(max(c-swSize,0)-base, min(c+swSize,nbRead-1)-base) for c in centers]
+                stats.count("windows", len(windows))
+                with stats.timer("features"):
+                    features = WindowFeatures(detector, cleanedTokens)
+                for blockStart in range(0, len(windows), self.batchSize):
+                    block = range(blockStart, min(blockStart+self.batchSize, len(windows)))
+                    spans = windows[blockStart:blockStart+len(block)]
+                    with stats.timer("features"):
+                        texts = [features.window_text(*span) for span in spans]
+                    def extract(indexes):
+                        with stats.timer("features"):
+                            return list(features.iter_events([spans[i] for i in indexes], texts=[texts[i] for i in indexes]))
+                    (fragBest, fragProb) = detector.score_cached(texts, extract)
+                    # recalibrate each window with regard to the possibleLg of the segment of its central token, and add the results to the scores of its tokens
+                    for segNo in sorted(set([tokSeg[centers[w]-base] for w in block])):
+                        segWindows = [w for w in block if tokSeg[centers[w]-base]==segNo]
+                        possibleIdx = segInfo[segNo][2]
+                        with stats.timer("recalibration"):
+                            recProbs = recalibrateResults(fragProb[[w-blockStart for w in segWindows]], possibleIdx)
+                        with stats.timer("accumulation"):
+                            rows = numpy.array([r for w in segWindows for r in range(windows[w][0], windows[w][1]+1)], dtype=int)
+                            rowWindow = numpy.array([i for (i,w) in enumerate(segWindows) for r in range(windows[w][0], windows[w][1]+1)], dtype=int)
+                            numpy.add.at(scores, (rows[:,None], possibleIdx[None,:]), recProbs[rowWindow])
+                nextCenter = max(nextCenter, lastCenter)
+
+                # --- tokens whose windows are all computed : decision and output ---
+                decided = nbRead if eof else max(base, nextCenter-swSize)
+                if decided > base :
+                    nbWindows = numpy.array([min(t+swSize,nbRead-1)-max(t-swSize,0)+1 for t in range(base, decided)], dtype=numpy.float32)
+                    scores[:decided-base] /= nbWindows[:,None]
+                    first = 0
+                    while first < decided-base :
+                        segNo = tokSeg[first]
+                        end = first
+                        while end < decided-base and tokSeg[end]==segNo :
+                            end += 1
+                        (possibleLg, bestGlobLg, possibleIdx) = segInfo[segNo]
+                        languages = decideLanguages(detector, dico.PrefetchedDictionary(self.dictionary(), self.dicoCache()), tokens[first:end], scores[first:end][:,possibleIdx], possibleLg, bestGlobLg, settings["significantGap"], settings["voteMethod"], base+first)
+                        with stats.timer("output"):
+                            for (tok,lg) in zip(tokens[first:end], languages):
+                                output.write("%s\t%s\n"%(tok,lg))
+                        first = end
+                    output.flush()
+                    # forget the decided tokens (the tokens of the windows still to compute are kept)
+                    keep = decided-base
+                    del tokens[:keep]
+                    del cleanedTokens[:keep]
+                    del tokSeg[:keep]
+                    scores = scores[keep:]
+                    base = decided
+                    for segNo in set(segInfo)-set(tokSeg) :
+                        del segInfo[segNo]
+        stats.count("documents")
+        stats.count("tokens", nbRead)
+        self.record(stats, getattr(stream, "name", None), time.perf_counter()-start)
+        return nbRead
+
+
+
 # ___ MAIN ___
 
 # --- default parameters ---
@@ -387,10 +1488,12 @@ def voteForAmbigousLg (token, detectedLg, bestGlobLg) :
 # INSTALL(2): Insert your models.
 modelList={ 
             "FILTER2" : "/<YOUR_WORKING_DIRECTORY>/CoSwID/models/filter2/",
+            "FILTER2-NGRAM" : "/<YOUR_WORKING_DIRECTORY>/CoSwID/models/filter2.ngm",     # n-gram model trained with ngram.py on the same data (see ngram.py)
           }
 
 lgList={ 
          "FILTER2" : ["cos","deu","eng","fra","ita","nld","por","ron","spa"],
+         "FILTER2-NGRAM" : ["cos","deu","eng","fra","ita","nld","por","ron","spa"],
        }
 
 toShortLgCode={"bul":"bg","ces":"cs","cos":"co","dan":"da","deu":"de","ell":"el","eng":"en","fin":"fi","fra":"fr","hun":"hu","ita":"it","lit":"lt","nld":"nl","pol":"pl","por":"pt","ron":"ro","spa":"es","swe":"sv"}
@@ -398,233 +1501,307 @@ toLongLgCode={"bg":"bul","cs":"ces","co":"cos","da":"dan","de":"deu","el":"ell",
 
 alphabet="ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyzÀÂÄĂÇÈÉÊËÎÏÒÓÔÖȘȚÙÛÜàâäăçèéêëìîïòóôöșțùûüÿŸ"
 
-# INSTALL(3) : default values
-
-modelName="FILTER2"
-model=modelList[modelName]      # default model
-modelLg=lgList[modelName]       # modelLg are the languages supported by the language identification model
-text=""                         # text to analyse
-swSize=1                        # context size to set the lenght of the sliding window: tot length = (swSize*2)+1) ; (swSize token before) TOK (swSize tokens after)
-filterGlob=0                    # filter threshold for global language detetction: probability must be higher than filterGlob; 0 = keep all languages; 0.01 = remove languages with a probability lesser than 0.01 during the global evaluation
-significantGap=0.1              # minimum gap/margin between the first and the second languages detected (if the difference is smaller: keep uncertainty); 0 = keep the two first
-voteMethod="dico"               # when several lg after thresholding according to GAP, use VOTE METHOD in order to choose; possible values : "full", "lgID", "dico" (REM: to choose the best lg after lg identification, without voting, put GAP to 0)
-acceptedLg=modelLg              # it is possible (for the user) to force the use of a subset of languages, DEFAULT = all languages supported by the model
-outputFile="default.out"        # default output file
-
-# --- Parsing command line parameters ---
-try:
-    opts, args = getopt.getopt(sys.argv[1:],"hm:t:c:f:g:v:s:",["model=","txt=","ctxtsize=","fltrtresh=","gap=","vote=","subset="])
-except getopt.GetoptError:
-    print ('coswid.py -m modelName -t <text or filename> -c <context size> -f <(global) filter threshold> -g <minimum gap to choose lg> -v <voting method> -s <subset of accepted languages: list separated by a "," whithout spaces>')
-    print ('coswid.py -h for more options')
-    sys.exit(2)
-
-if len(opts)==0 :
-    print ('coswid.py -m modelName -t <text or filename> -c <context size> -f <(global) filter threshold> -g <minimum gap to choose lg> -v <voting method> -s <subset of accepted languages: list separated by a "," whithout spaces>')
-    print ('coswid.py -h for more options')
-    sys.exit(2)
-
-
-print("%s"%str(opts))
-for opt, arg in opts:
-    if opt == '-h':
-        print ('coswid.py -m <model name> -t <text or filename> -c <context size> -f <(global) filter threshold> -g <minimum gap to choose lg> -v <voting method> -s <subset of accepted languages: list separated by a "," whithout spaces>')
-        print ('OR : coswid.py --model <model name> --txt <text or filename> --ctxtsize <context size> --fltrtresh <(global) filter threshold> --gap <min gap to choose lg> --vote <voting method>  --subset <subset of accepted languages: list separated by a "," whithout spaces>')
-        print ('DEFAULT : -c 1 -f 0 -g 0.1 -v dico')
-        print ('  Model : %s'%model)
-        print ('  Languages : %s'%str(modelLg))
-        print ('WARNING : dictionary server must be started before using this script')
-        sys.exit()
-    elif opt in ('-m','--model') :          # MODEL : get model path and possible languages from provided model name
-        model=modelList[arg]
-        modelLg=lgList[arg]
-    elif opt in ('-t','--txt') :            # TEXT : try to open a file, if it's not working use the provided string as text to process
-        txtArg=arg
-        try :
-            ftxt=codecs.open(txtArg,'r',"utf-8")
-            text=ftxt.read()
-            ftxt.close()
-            outputFile="%s.out"%txtArg
-            print ("Opening text file : %s [Output to %s]"%(txtArg,outputFile))
-        except IOError as e :
-            print(os.strerror(e.errno))
-            print("Using the provided chars as text to analyse [Output to %s]"%outputFile)
-            text=txtArg
-    elif opt in ('-c','--ctxtsize') :
-        swSize=int(arg)                     # CONTEXT SIZE : number of token(s) before AND after to build a fragment (total size=(swSize*2)+1)
-    elif opt in ('-f','--fltrtresh') :
-        filterGlob=float(arg)               # FILTER TRESHOLD : threshold filter to keep only globally detected languages (keep all : 0)
-    elif opt in ('-g','--gap'):
-        significantGap=float(arg)           # GAP : Treshold for choosing a language or keeping uncertainty between two languages (0 = do not choose between the two first if there are more than one language)
-    elif opt in ('-v','--vote'):
-        voteMethod=arg
-    elif opt in ('-s', '--subset'):
-        acceptedLg=arg.split(',')           # ACCEPTED LANGUAGES : user defined possible languages
-
-
-# --- initialisation of the language detector ---
-detector = Detector(model)
-
-
-# --- Output selected parameters for user information ---
-print("___ Parameters ___\n")
-print("Total length of the sliding Window : %s"%((swSize*2)+1))
-print("Treshold for keeping globally detected languages (0=all) : %s"%filterGlob)
-print("Treshold for choosing a language or keeping uncertainty between two languages : %s"%significantGap)
-print("Voting method : %s"%voteMethod)
-print ('Model : %s'%model)
-print("Languages : %s"%str(acceptedLg))
-print("__________________")
-
-
-# --- Tokenize and preprocessing ---
-
-# _ Preprocessing/cleaning _
-cleanedText=text.replace('\u00AC','') # U+00AC	NOT SIGN / SIGNE NÉGATION
-cleanedText=cleanedText.replace('\u00AD','') # U+00AD	SOFT HYPHEN / TRAIT D'UNION CONDITIONNEL
-
-# _ Norm spaces / tabulations _
-cleanedText=re.sub(r"\s+",r" ",cleanedText) 
-#print("%s --> %s"%(text,cleanedText))
-
-# _ Split on whitespaces _
-tokens=cleanedText.split()
-nbToks=len(tokens)
-results=[]
-cleanedTokens=[]
-for tok in tokens:
-    results.append({})  # initialize an empty dictionary for each token in order to store future results
-    cleanedTok=re.sub(r"([^%s0-9]+)$"%(alphabet),r"", tok) # remove unalpha at the end
-    cleanedTok=re.sub(r"^([^%s0-9]+)"%(alphabet),r"", cleanedTok) # remove unalpha at the begining
-    cleanedTokens.append(cleanedTok)
-
-
-# --- detect languages globally ---
-globRes=detector.detect(cleanedText)
-globRes=json.loads(globRes)
-print (globRes)
-possibleLg=[]  # IF filterGlob==0 THEN possibleLg will be equivalent to acceptedLg ELSE possibleLg will be the intersection between languages that are detected globally _AND_ the user defined language (if set, or by default the languages defined in the chosen model)
-bestGlobLg=""
-bestGlobProb=0
-for (idx,prob) in enumerate(globRes["prob"]) :
-    if globRes["labels"][idx] in acceptedLg :
-        if float(prob)>=filterGlob : # allow to remove languages with a global probability less than 'filterGlob' (given as a parameter; default value 0 keeps all languages)
-            possibleLg.append(globRes["labels"][idx])
-            # REM : filtering on a list of possible languages detected globally could work for a sentence or a small paragraph with a small number of different languages,
-            # BUT it is not appropriate for a big text with many different languages --> BY DEFAULT it is recommended to use all languages !!!
-        if float(prob) > bestGlobProb :
-            bestGlobLg=globRes["labels"][idx]
-            bestGlobProb=float(prob)
-print ("Possible languages found globally (user defined -- if any -- and globally detected) : ")
-print (possibleLg)
-print ("Best language globally detected : %s"%bestGlobLg)
-if len(possibleLg)==0:
-    print("[ERROR] : no language available!")
-    sys.exit()
-
-# --- Generate sliding window data & detect language (we use CLEANED tokens to build fragment with sliding window) ---
-print("Nombre de tokens : %s"%nbToks)
-curTok=0
-fragment=""
-while curTok<nbToks :
-    # construct and test the 'fragment' around the token
-    toksToUpdate=[]
-    # initialize fragment with current token
-    fragment=cleanedTokens[curTok]
-    toksToUpdate.append(curTok)
-    # add swSize tokens BEFORE curTok
-    i=1
-    while i<=swSize:
-        if curTok-i<0 :
-            # begining of the text : get "previous" tokens at the end of the text to have a full sliding window (TODO: this could be modified for something more relevant in the future)
-            fragment="%s %s"%(cleanedTokens[nbToks+(curTok-i)],fragment)
-            toksToUpdate.append(nbToks+(curTok-i))
-        else :
-            # add token before the current fragment
-            fragment="%s %s"%(cleanedTokens[curTok-i],fragment)
-            toksToUpdate.append(curTok-i)
-        i+=1
-    # add swSize tokens AFTER curTok
-    i=1
-    while i<=swSize:
-        if curTok+i>=nbToks :
-            # end of the text : get "following" tokens at the begining of the text to have a full sliding window (TODO: this could be modified for something more relevant in the future)
-            fragment="%s %s"%(fragment,cleanedTokens[(curTok+i)-nbToks])
-            toksToUpdate.append((curTok+i)-nbToks)
+
+def main(argv):
+    # INSTALL(3) : default values
+
+    modelName="FILTER2"
+    model=modelList[modelName]      # default model
+    modelLg=lgList[modelName]       # modelLg are the languages supported by the language identification model
+    text=""                         # text to analyse
+    swSize=1                        # context size to set the lenght of the sliding window: tot length = (swSize*2)+1) ; (swSize token before) TOK (swSize tokens after)
+    filterGlob=0                    # filter threshold for global language detetction: probability must be higher than filterGlob; 0 = keep all languages; 0.01 = remove languages with a probability lesser than 0.01 during the global evaluation
+    significantGap=0.1              # minimum gap/margin between the first and the second languages detected (if the difference is smaller: keep uncertainty); 0 = keep the two first
+    voteMethod="dico"               # when several lg after thresholding according to GAP, use VOTE METHOD in order to choose; possible values : "full", "lgID", "dico" (REM: to choose the best lg after lg identification, without voting, put GAP to 0)
+    acceptedLg=None                 # it is possible (for the user) to force the use of a subset of languages, DEFAULT (None) = all languages supported by the model
+    outputFile="default.out"        # default output file
+    batchSize=256                   # number of sliding windows submitted together to the language detector
+    dicHost="localhost"             # dicServer host
+    dicPort=1112                    # dicServer port
+    dicTimeout=5.0                  # timeout (in seconds) for the dicServer requests
+    dicLexicon=""                   # compiled lexicon (see dico.py) used instead of dicServer for the dico vote ; "" = use dicServer
+    serve=""                        # service mode : "[host:]port" to listen to (see service.py) ; "" = analyse the text given with -t
+    compileTo=""                    # compile the model into a bundle file (see Detector.compile) and exit
+    txtArg=""                       # text or file name given with -t
+    stream=False                    # streaming mode : the file (or the standard input, with "-t -") is read and analysed by segments, with a bounded memory (see CoSwID.analyseStream)
+    segmentSize=10000               # streaming mode : number of tokens of the segments
+    corpus=""                       # corpus mode : directory, glob pattern or @manifest of the files to analyse (see corpus.py) ; "" = analyse the text given with -t
+    workers=os.cpu_count() or 1     # corpus mode : number of worker processes
+    cacheSize=100000                # maximum number of entries of the caches (detection and dictionary, see CoSwID) ; 0 = no cache
+    cacheFile=""                    # file where the caches are kept from one run to another ; "" = no persistence
+    statsFile=""                    # file where the measures of the run (time of each step, counters, see instrument.py) are written at the end (JSON) ; "-" = standard output
+    traceFile=""                    # file where the measures of each document are written (one JSON line per document)
+    profile=None                    # profiling of the run : (profiler, file) given as "cprofile:<file>" (cProfile statistics) or "sample:<file>" (sampling profiler, collapsed stacks)
+    logLevel="warning"              # level of the messages displayed : "debug" (details of each window, token and vote ; slow on large texts), "info" (parameters and summary of the run), "warning", "error"
+    logFile=""                      # file where the messages are written ; "" = standard output
+    debugTraceFile=""               # file where the details of the tokens are written (one JSON line per token, see instrument.DebugTrace)
+    debugEvery=1                    # debug trace : one token every 'debugEvery' tokens is written
+    swSizes=None                    # several context sizes analysed in one pass (see CoSwID.analyseMulti) : one output column for each size ; None = only the context size given with -c
+    combine=False                   # with several context sizes : one decision on the mean of the probabilities of all the sizes (instead of one column for each size)
+    skipMargin=0                    # adaptive window skipping (see windowScores) : minimum margin between the two best languages to skip the windows between two analysed windows ; 0 = analyse all the windows
+    skipStride=4                    # adaptive window skipping : the windows are first analysed every skipStride tokens
+    threads=1                       # number of threads scoring the sliding windows of a document (see windowScores) ; the results do not depend on it
+    minWeight=0                     # with -s, the model is pruned (only the accepted languages are scored) ; minWeight > 0 also removes the features having a weight lower than minWeight for all the accepted languages
+    quantize=""                     # quantization of the model (see Detector.quantize) : "float32" or "int8" ; "" = model as stored by ldig
+    quantizeLoss=0.005              # maximum accuracy loss of the quantized model on each gold standard data set (see CoSwID.quantize) ; the quantized model is refused above ; < 0 = no check
+    quantizeData=None               # gold standard data sets of the accuracy check (see bench.DATASETS) ; None = all
+    matrix=""                       # type of the probabilities ("float16" or "float32") of the probability matrix written alongside the output file (<output file>.pm, see probmatrix.py) ; "" = no probability matrix
+    spans=False                     # output the positions of the tokens in the text ("start\tend\ttoken\tlg" lines, start/end being char offsets in the original text) instead of "token\tlg" lines
+
+    # --- Parsing command line parameters ---
+    try:
+        opts, args = getopt.getopt(argv,"hm:t:c:f:g:v:s:",["model=","txt=","ctxtsize=","fltrtresh=","gap=","vote=","subset=","dichost=","dicport=","dictimeout=","diclexicon=","serve=","compile=","stream","segsize=","corpus=","workers=","cachesize=","cache=","stats=","trace=","profile=","log=","logfile=","debugtrace=","debugevery=","spans","matrix=","quantize=","quantizeloss=","quantizedata=","minweight=","skipmargin=","skipstride=","threads=","ctxtsizes=","combine"])
+    except getopt.GetoptError:
+        print ('coswid.py -m modelName -t <text or filename> -c <context size> -f <(global) filter threshold> -g <minimum gap to choose lg> -v <voting method> -s <subset of accepted languages: list separated by a "," whithout spaces>')
+        print ('coswid.py -h for more options')
+        sys.exit(2)
+
+    if len(opts)==0 :
+        print ('coswid.py -m modelName -t <text or filename> -c <context size> -f <(global) filter threshold> -g <minimum gap to choose lg> -v <voting method> -s <subset of accepted languages: list separated by a "," whithout spaces>')
+        print ('coswid.py -h for more options')
+        sys.exit(2)
+
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print ('coswid.py -m <model name> -t <text or filename> -c <context size> -f <(global) filter threshold> -g <minimum gap to choose lg> -v <voting method> -s <subset of accepted languages: list separated by a "," whithout spaces>')
+            print ('OR : coswid.py --model <model name> --txt <text or filename> --ctxtsize <context size> --fltrtresh <(global) filter threshold> --gap <min gap to choose lg> --vote <voting method>  --subset <subset of accepted languages: list separated by a "," whithout spaces>')
+            print ('DEFAULT : -c 1 -f 0 -g 0.1 -v dico')
+            print ('dicServer : --dichost <host> --dicport <port> --dictimeout <timeout in seconds> (DEFAULT : --dichost %s --dicport %s --dictimeout %s)'%(dicHost,dicPort,dicTimeout))
+            print ('OR, without dicServer : --diclexicon <lexicon file built with dico.py>')
+            print ('SERVICE MODE : coswid.py -m <model name> [-c ... -f ... -g ... -v ... -s ...] --serve <[host:]port> (the parameters are the default values for the requests)')
+            print ('MODEL BUNDLE : coswid.py -m <model name> --compile <bundle file> (the bundle file can then be used in modelList instead of the ldig model directory)')
+            print ('CORPUS MODE : coswid.py -m <model name> [-c ... -f ... -g ... -v ... -s ...] --corpus <directory, glob pattern or @manifest> [--workers <number of processes> (DEFAULT : %s)]'%workers)
+            print ('CACHE : --cachesize <max number of entries, 0 = no cache> (DEFAULT : %s) --cache <file to keep the cache from one run to another>'%cacheSize)
+            print ('MEASURES : --stats <file, or - for the standard output> --trace <file (one line per document)> --profile <cprofile:file or sample:file>')
+            print ('MODEL PRUNING (with -s) : --minweight <minimum weight of the features for the accepted languages> (DEFAULT : %s = keep all the features)'%minWeight)
+            print ('SEVERAL CONTEXT SIZES : --ctxtsizes <list separated by a ","> (output : token, lg for each context size) [--combine (output : token, lg decided on the mean of the probabilities of all the sizes)]')
+            print ('ADAPTIVE WINDOW SKIPPING : --skipmargin <minimum margin between the two best languages, 0 = off> (DEFAULT : %s) --skipstride <stride of the first analysed windows> (DEFAULT : %s)'%(skipMargin,skipStride))
+            print ('THREADS : --threads <number of threads scoring the sliding windows of a document> (DEFAULT : %s)'%threads)
+            print ('SPANS : --spans (output : start, end, token, lg ; start/end = char offsets of the token in the text)')
+            print ('QUANTIZED MODEL : --quantize <float32 or int8> [--quantizeloss <maximum accuracy loss on the gold data, < 0 = no check> (DEFAULT : %s) --quantizedata <gold data sets>] (also with --compile)'%quantizeLoss)
+            print ('PROBABILITY MATRIX : --matrix <float16 or float32> (binary file <output file>.pm : offsets, languages and probabilities of the tokens ; see probmatrix.py to convert it to TSV or JSONL)')
+            print ('MESSAGES : --log <debug, info, warning or error> (DEFAULT : %s) --logfile <file> --debugtrace <file (one JSON line per token)> --debugevery <N : one token every N tokens>'%logLevel)
+            print ('STREAMING MODE (large files, bounded memory) : coswid.py -m <model name> -t <filename, or - for the standard input> [-c ... -f ... -g ... -v ... -s ...] --stream [--segsize <number of tokens of the segments> (DEFAULT : %s)]'%segmentSize)
+            print ('  Model : %s'%model)
+            print ('  Languages : %s'%str(modelLg))
+            print ('WARNING : dictionary server must be started before using this script')
+            sys.exit()
+        elif opt in ('-m','--model') :          # MODEL : get model path and possible languages from provided model name
+            model=modelList[arg]
+            modelLg=lgList[arg]
+        elif opt in ('-t','--txt') :            # TEXT : text or file name (see below)
+            txtArg=arg
+        elif opt in ('-c','--ctxtsize') :
+            swSize=int(arg)                     # CONTEXT SIZE : number of token(s) before AND after to build a fragment (total size=(swSize*2)+1)
+        elif opt in ('-f','--fltrtresh') :
+            filterGlob=float(arg)               # FILTER TRESHOLD : threshold filter to keep only globally detected languages (keep all : 0)
+        elif opt in ('-g','--gap'):
+            significantGap=float(arg)           # GAP : Treshold for choosing a language or keeping uncertainty between two languages (0 = do not choose between the two first if there are more than one language)
+        elif opt in ('-v','--vote'):
+            voteMethod=arg
+        elif opt in ('-s', '--subset'):
+            acceptedLg=arg.split(',')           # ACCEPTED LANGUAGES : user defined possible languages
+        elif opt == '--dichost':
+            dicHost=arg
+        elif opt == '--dicport':
+            dicPort=int(arg)
+        elif opt == '--dictimeout':
+            dicTimeout=float(arg)
+        elif opt == '--diclexicon':
+            dicLexicon=arg
+        elif opt == '--serve':
+            serve=arg
+        elif opt == '--compile':
+            compileTo=arg
+        elif opt == '--stream':
+            stream=True
+        elif opt == '--segsize':
+            segmentSize=int(arg)
+        elif opt == '--corpus':
+            corpus=arg
+        elif opt == '--workers':
+            workers=int(arg)
+        elif opt == '--cachesize':
+            cacheSize=int(arg)
+        elif opt == '--cache':
+            cacheFile=arg
+        elif opt == '--stats':
+            statsFile=arg
+        elif opt == '--trace':
+            traceFile=arg
+        elif opt == '--profile':
+            profile=tuple(arg.split(":", 1))
+            if len(profile) != 2 or profile[0] not in instrument.PROFILERS or not profile[1] :
+                print ('[ERROR] : unknown profiler or missing file : --profile %s (expected : <cprofile:file or sample:file>)'%arg)
+                print ('coswid.py -m modelName -t <text or filename> -c <context size> -f <(global) filter threshold> -g <minimum gap to choose lg> -v <voting method> -s <subset of accepted languages: list separated by a "," whithout spaces>')
+                print ('coswid.py -h for more options')
+                sys.exit(2)
+        elif opt == '--log':
+            logLevel=arg
+        elif opt == '--logfile':
+            logFile=arg
+        elif opt == '--debugtrace':
+            debugTraceFile=arg
+        elif opt == '--debugevery':
+            debugEvery=int(arg)
+        elif opt == '--spans':
+            spans=True
+        elif opt == '--matrix':
+            matrix=arg
+        elif opt == '--quantize':
+            quantize=arg
+        elif opt == '--quantizeloss':
+            quantizeLoss=float(arg)
+        elif opt == '--quantizedata':
+            quantizeData=arg.split(',')
+        elif opt == '--minweight':
+            minWeight=float(arg)
+        elif opt == '--ctxtsizes':
+            swSizes=[int(x) for x in arg.split(',')]
+        elif opt == '--combine':
+            combine=True
+        elif opt == '--skipmargin':
+            skipMargin=float(arg)
+        elif opt == '--skipstride':
+            skipStride=int(arg)
+        elif opt == '--threads':
+            threads=int(arg)
+
+    if logLevel.upper() not in ("DEBUG","INFO","WARNING","ERROR") :
+        print("[ERROR] : unknown log level : %s"%logLevel)
+        sys.exit(2)
+    if logFile :
+        logging.basicConfig(level=logLevel.upper(), format="%(message)s", filename=logFile, encoding="utf-8")
+    else :
+        logging.basicConfig(level=logLevel.upper(), format="%(message)s", stream=sys.stdout)
+    log.debug("%s", opts)
+    if matrix and (matrix not in probmatrix.DTYPES or swSizes or stream or serve) :
+        print("[ERROR] : the probability matrix (--matrix %s) is only available for one context size, with -t or --corpus, and its type must be one of %s"%(matrix, ",".join(probmatrix.DTYPES)))
+        sys.exit(2)
+
+    if compileTo :
+        if quantize :
+            # the quantized model is checked before it is compiled (with the settings given on the command line)
+            cosw = CoSwID(model, modelLg, swSize=swSize, filterGlob=filterGlob, significantGap=significantGap, voteMethod=voteMethod, cacheSize=0, dicFactory=dico.StubDictionary)
+            try:
+                accuracies = cosw.quantize(quantize, quantizeLoss if quantizeLoss >= 0 else None, names=quantizeData)
+            except ValueError as e:
+                print("[ERROR] : %s"%e)
+                sys.exit(1)
+            log.info("Accuracy of the %s model : %s", quantize, accuracies)
+            cosw.detector.compile(compileTo)
         else :
-            # add token after the current fragment
-            fragment="%s %s"%(fragment,cleanedTokens[curTok+i])
-            toksToUpdate.append(curTok+i)
-        i+=1
-    
-    # detect language of a fragment
-    print("%s : "%fragment)
-    fragRes=detector.detect(fragment)
-
-    # recalibrate probabilities with regard to possibleLg
-    print("raw : %s"%str(fragRes))
-    recRes=recalibrateResults(fragRes,possibleLg)
-    print("recalibrated : %s"%str(recRes))
-
-    print("Tokens to update [cur, prev, next] :")
-    print(toksToUpdate)
-    # add the results to the already collected data
-    results=updateResults(recRes, toksToUpdate, results)
-    curTok+=1   # move forward the sliding window (1 token)
-
-
-# --- Finalize the results  ---
-# this step is needed to transform scores into probabilities
-filteredResults=normLanguageScores(results)
-
-
-# --- Outputs in a human friendly format (we use ORIGINAL tokens to output) ---
-print("OUTPUT")
-fout=codecs.open(outputFile,'w',"utf-8")
-for (idx,tok) in enumerate(tokens):
-    print ("[%s] : %s"%(idx,tok))
-    resProb=filteredResults[idx]
-    print(resProb)
-    # tresholding (remove lg with probability < (best language probability) - margin
-    resProbTresholded=removeUnsignificantLanguages(resProb, significantGap)
-    print ("Thresholding :")
-    print(resProbTresholded)
-    tokRes="%s : "%tok
-    # if there are still several possibilities, use the voting procedure
-    detectedLg=resProbTresholded.keys()
-    bestLg=""
-    score=0
-    winLg=""
-    ccl=""
-    if len(resProbTresholded)>1 :
-        print ("Vote for remaining languages after thresholding :")
-        if voteMethod=="full":
-            (winLg,score)=voteForAmbigousLg (tok, detectedLg, bestGlobLg)
-        elif voteMethod=="lgID":
-            (winLg,score)=simpleVote_lgID (tok, detectedLg)
+            openDetector(model).compile(compileTo)
+        print("Model %s compiled into %s"%(model, compileTo))
+        return
+
+
+    # --- initialisation of the language detector (and of the dictionary backend : compiled lexicon (if any) or client of the dictionary server) ---
+    cosw = CoSwID(model, modelLg, swSize=swSize, filterGlob=filterGlob, significantGap=significantGap, voteMethod=voteMethod, acceptedLg=acceptedLg,
+                  skipMargin=skipMargin, skipStride=skipStride, batchSize=batchSize, dicLexicon=dicLexicon, dicHost=dicHost, dicPort=dicPort, dicTimeout=dicTimeout, cacheSize=cacheSize, minWeight=minWeight, threads=threads)
+    if quantize :
+        try:
+            accuracies = cosw.quantize(quantize, quantizeLoss if quantizeLoss >= 0 else None, names=quantizeData)
+            log.info("Accuracy of the %s model : %s", quantize, accuracies)
+        except ValueError as e:
+            log.warning("[WARNING] : %s : the model is not quantized", e)
+
+
+    # --- Output selected parameters for user information ---
+    log.info("___ Parameters ___\n")
+    log.info("Total length of the sliding Window : %s", (swSize*2)+1)
+    log.info("Treshold for keeping globally detected languages (0=all) : %s", filterGlob)
+    log.info("Treshold for choosing a language or keeping uncertainty between two languages : %s", significantGap)
+    log.info("Voting method : %s", voteMethod)
+    log.info("Model : %s", model)
+    log.info("Languages : %s", cosw.settings["acceptedLg"])
+    log.info("__________________")
+
+    if cacheFile and cosw.loadCache(cacheFile) :
+        log.info("Cache loaded from %s : %s", cacheFile, cosw.cacheStats())
+
+    if traceFile :
+        cosw.openTrace(traceFile)
+    if debugTraceFile :
+        cosw.openDebugTrace(debugTraceFile, debugEvery)
+
+    # --- analysis (according to the mode) ---
+    def process():
+        nonlocal text, outputFile
+        if serve :
+            import service
+            service.serve(cosw, serve)
+        elif corpus :
+            import corpus as corpusMode
+            corpusMode.run(cosw, corpus, workers, cacheFile, matrix, spans, swSizes, combine)
+        elif stream :
+            # --- streaming mode : the text is never loaded entirely (REM: the results are written as soon as the tokens are decided) ---
+            if txtArg=="-" :
+                ftxt=codecs.getreader("utf-8")(sys.stdin.buffer)
+            else :
+                ftxt=codecs.open(txtArg,'r',"utf-8")
+                outputFile="%s.out"%txtArg
+            log.info("Streaming text from : %s [Output to %s]", txtArg, outputFile)
+            fout=codecs.open(outputFile,'w',"utf-8")
+            try:
+                nbToks = cosw.analyseStream(ftxt, fout, segmentSize=segmentSize)
+                log.info("Number of tokens : %s", nbToks)
+            except ValueError as e:
+                log.error("[ERROR] : %s", e)
+                sys.exit()
+            finally:
+                fout.close()
+                ftxt.close()
         else :
-            (winLg,score)=simpleVote_dico (tok, detectedLg)
-        print(" %s : %s"%(winLg,score))
-        if score>0 :
-            ccl=" => %s (%s)"%(winLg,score)
-        else: # if voting doesn't help, keep the language with the higher probability
-            bestLg=max(resProbTresholded.items(), key=operator.itemgetter(1))[0]
-            ccl="=> %s (%s)"%(bestLg,resProbTresholded[bestLg])
+            # TEXT : try to open a file, if it's not working use the provided string as text to process
+            if txtArg :
+                try :
+                    ftxt=codecs.open(txtArg,'r',"utf-8")
+                    text=ftxt.read()
+                    ftxt.close()
+                    outputFile="%s.out"%txtArg
+                    log.info("Opening text file : %s [Output to %s]", txtArg, outputFile)
+                except IOError as e :
+                    log.info(os.strerror(e.errno))
+                    log.info("Using the provided chars as text to analyse [Output to %s]", outputFile)
+                    text=txtArg
+
+            try:
+                if swSizes :
+                    result = cosw.analyseMulti(text, swSizes, combine, document=outputFile[:-len(".out")], spans=spans)
+                else :
+                    scores = {} if matrix else None
+                    result = cosw.analyse(text, document=outputFile[:-len(".out")], spans=spans, scores=scores)
+            except ValueError as e:
+                log.error("[ERROR] : %s", e)
+                sys.exit()
+
+            with cosw.stats.timer("output"):
+                fout=codecs.open(outputFile,'w',"utf-8")
+                for res in result:
+                    fout.write("\t".join([str(x) for x in res])+"\n")
+                fout.close()
+                if matrix :
+                    probmatrix.write("%s.pm"%outputFile, [res[-2] for res in result], scores["offsets"], [res[-1] for res in result], scores["lgCodes"], scores["probabilities"], scores["votes"], matrix, cosw.settingsFor({}))
+
+    if profile :
+        instrument.profile(profile[0], profile[1], process)
     else :
-        bestLg=max(resProbTresholded.items(), key=operator.itemgetter(1))[0]
-    # display all the languages kept after tresholding in descending order (for information)
-    prob=1
-    while (prob>0):
-        lg=max(resProbTresholded.items(), key=operator.itemgetter(1))[0]
-        prob=resProbTresholded[lg]
-        if prob>0 :
-            tokRes="%s%s (%s)  "%(tokRes, lg, prob)
-        resProbTresholded[lg]=0
-    print ("%s%s"%(tokRes,ccl))
-    if len(winLg)==0 :
-        fout.write("%s\t%s\n"%(tok,bestLg))
-    else:
-        fout.write("%s\t%s\n"%(tok,winLg))
-
-fout.close()
+        process()
+    cosw.close()
+
+    log.info("Cache : %s", cosw.cacheStats())
+    if cacheFile :
+        cosw.saveCache(cacheFile)
+        log.info("Cache saved into %s", cacheFile)
+    if statsFile :
+        summary=json.dumps({"measures":cosw.stats.summary(), "cache":cosw.cacheStats()}, indent=1)
+        if statsFile=="-" :
+            print(summary)
+        else :
+            with open(statsFile, 'w') as f:
+                f.write(summary)
 
+if __name__ == "__main__" :
+    main(sys.argv[1:])
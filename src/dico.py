@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Dictionary backends used by the _dico_ voting method of CoSwID
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+import sys, getopt
+import os
+import codecs
+import json
+import re
+import mmap
+import socket
+import asyncio
+import time
+import instrument
+import struct
+import numpy
+
+
+#
+# Replies received from dicServer : the received bytes are decoded as they arrive (a UTF-8 character may be split between two reads) into a text buffer,
+# and the JSON replies are read from it one after the other from a read offset (each received character is decoded once, and each reply is parsed from its start)
+#   A reply is incomplete only if the JSON decoder stopped at the end of the buffer (an unterminated string, or a number, literal or escape cut by the end) ;
+#   any other decoding error is a malformed reply (ValueError)
+#
+class ReplyBuffer(object):
+    truncatedToken = re.compile(r"[\w.+\-]*$")     # characters of a JSON number, literal or \u escape
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.bytesDecoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ""
+        self.pos = 0        # read offset in text
+
+    # add received bytes (the replies already read are removed from the text)
+    def feed(self, received):
+        self.text = self.text[self.pos:] + self.bytesDecoder.decode(received)
+        self.pos = 0
+
+    # next complete JSON reply, None if it is not complete yet
+    def next(self):
+        while self.pos < len(self.text) and self.text[self.pos].isspace() :
+            self.pos += 1
+        if self.pos == len(self.text) :
+            return None
+        try:
+            (reply, end) = self.decoder.raw_decode(self.text, self.pos)
+        except json.JSONDecodeError as e:
+            if e.pos == len(self.text) or e.msg.startswith("Unterminated string") or self.truncatedToken.match(self.text, e.pos) :
+                return None
+            raise ValueError("malformed reply from dicServer : %s"%e)
+        self.pos = end
+        return reply
+
+
+#
+# Client of the dictionary server (dicServer, https://github.com/lkevers/dicServer)
+#   - a single TCP connection is kept open and reused for all the requests (it is re-opened if the server closed it)
+#   - requests are sent as lines " word_possibleLanguages::<word>::<lg>,...,<lg>"; each reply is a JSON list of language codes
+#   - replies are read until a complete JSON value is received (no limit on their length, see ReplyBuffer) ; a malformed reply raises ValueError
+#   - possibleLanguagesBatch() sends the requests by blocks (maxPipelined) and then reads the replies (pipelining). If the server closes the
+#     connection after each reply, the client notices it and falls back to one connection per request.
+#   - large batches (more than one block, or several requests to a server that closes the connection after each reply) are sent concurrently
+#     on up to maxConnections connections (asyncio), in addition to the persistent connection
+# Lookups return None when no result could be obtained from the server.
+#
+class DicServerClient(object):
+    def __init__(self, host="localhost", port=1112, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = ReplyBuffer()
+        self.pipelining = True      # set to False if the server closes the connection after each reply
+        self.maxPipelined = 256     # maximum number of requests sent before reading the replies
+        self.maxConnections = 4     # maximum number of concurrent connections for the large batches (REM: keep it under the listen backlog of the server)
+
+    def connect(self):
+        self.close()
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.buffer = ReplyBuffer()
+
+    def close(self):
+        if self.sock is not None :
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.buffer = ReplyBuffer()
+
+    # request line for a word and the languages to check (REM: max length of a request is 2048 chars)
+    def request(self, word, languages):
+        return " word_possibleLanguages::%s::%s\n"%(word, ",".join(languages))
+
+    # read one complete JSON reply (raise EOFError if the connection is closed before, ValueError if the reply is malformed)
+    def readReply(self):
+        while True:
+            reply = self.buffer.next()
+            if reply is not None :
+                return reply
+            received = self.sock.recv(65536)
+            if not received :
+                raise EOFError("connection closed by dicServer")
+            self.buffer.feed(received)
+
+    # True if the failed exchange shows a server closing the connection after each reply : the connection was closed by the server (not a connection
+    # failure nor a timeout) after at least one reply on a new connection ; the other failures are only transient (the requests are tried again once)
+    def closedAfterReply(self, error, fresh, nbReplies):
+        return fresh and nbReplies > 0 and isinstance(error, (EOFError, ConnectionResetError))
+
+    # possible languages of one word, amongst 'languages'
+    def possibleLanguages(self, word, languages):
+        return self.possibleLanguagesBatch([(word, languages)])[0]
+
+    # possible languages of several words : queries=[(word, languages), ...] ; returns a list of results in the same order
+    def possibleLanguagesBatch(self, queries):
+        if len(queries) > (self.maxPipelined if self.pipelining else 1) and self.maxConnections > 1 :
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:    # (no event loop running in this thread)
+                return asyncio.run(self.asyncBatch(queries))
+        return self.syncBatch(queries)
+
+    # send the queries on the persistent connection
+    def syncBatch(self, queries):
+        stats = instrument.current()
+        results = [None]*len(queries)
+        next = 0
+        failed = -1     # last request for which the exchange failed (a request is retried only once)
+        while next < len(queries):
+            nbReplies = 0
+            toSend = []
+            fresh = self.sock is None
+            start = time.perf_counter()
+            try:
+                if fresh :
+                    self.connect()
+                if self.pipelining :
+                    toSend = queries[next:next+self.maxPipelined]
+                else :
+                    toSend = queries[next:next+1]
+                self.sock.sendall("".join([self.request(word, languages) for (word, languages) in toSend]).encode('utf-8'))
+                for i in range(len(toSend)):
+                    results[next] = self.readReply()
+                    next += 1
+                    nbReplies += 1
+                if not self.pipelining :
+                    self.close()
+                stats.add("dicoRTT", time.perf_counter()-start)
+                stats.count("dicoRequests", len(toSend))
+            except (OSError, EOFError) as e:
+                self.close()
+                stats.count("dicoRequests", nbReplies)
+                if self.pipelining and self.closedAfterReply(e, fresh, nbReplies) :
+                    # the server closes the connection after each reply : one connection per request from now on
+                    self.pipelining = False
+                elif failed == next :
+                    next += 1       # second failure for the same request: give up for this one
+                else :
+                    failed = next   # (the connection may have been closed by the server since the last exchange) try again
+            except ValueError:
+                self.close()        # (malformed reply : the next replies of the connection cannot be read)
+                raise
+        return results
+
+    # send the queries concurrently, on up to maxConnections connections : each connection sends blocks of requests (one request per connection if the
+    # server closes the connection after each reply) ; a block is tried again once if its exchange failed
+    async def asyncBatch(self, queries):
+        stats = instrument.current()
+        results = [None]*len(queries)
+        blockSize = self.maxPipelined if self.pipelining else 1
+        blocks = [(list(range(start, min(start+blockSize, len(queries)))), 0) for start in range(0, len(queries), blockSize)]
+        blocks.reverse()
+
+        async def exchange():
+            (reader, writer) = (None, None)
+            while blocks:
+                (block, attempt) = blocks.pop()
+                nbReplies = 0
+                fresh = writer is None
+                start = time.perf_counter()
+                try:
+                    if fresh :
+                        (reader, writer) = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                    writer.write("".join([self.request(*queries[i]) for i in block]).encode('utf-8'))
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+                    buffer = ReplyBuffer()
+                    for i in block:
+                        reply = buffer.next()
+                        while reply is None :
+                            received = await asyncio.wait_for(reader.read(65536), self.timeout)
+                            if not received :
+                                raise EOFError("connection closed by dicServer")
+                            buffer.feed(received)
+                            reply = buffer.next()
+                        results[i] = reply
+                        nbReplies += 1
+                    if not self.pipelining :
+                        writer.close()
+                        (reader, writer) = (None, None)
+                    stats.add("dicoRTT", time.perf_counter()-start)
+                    stats.count("dicoRequests", len(block))
+                except (OSError, EOFError, asyncio.TimeoutError) as e:
+                    if writer is not None :
+                        writer.close()
+                    (reader, writer) = (None, None)
+                    stats.count("dicoRequests", nbReplies)
+                    remaining = block[nbReplies:]
+                    if self.closedAfterReply(e, fresh, nbReplies) :
+                        # the server closes the connection after each reply : one connection per request from now on
+                        self.pipelining = False
+                        blocks.extend([([i], attempt) for i in remaining])
+                    elif attempt == 0 :
+                        blocks.append((remaining, 1))
+                except ValueError:
+                    if writer is not None :
+                        writer.close()      # (malformed reply)
+                    raise
+            if writer is not None :
+                writer.close()
+
+        await asyncio.gather(*[exchange() for i in range(min(self.maxConnections, len(blocks)))])
+        return results
+
+
+#
+# In-process dictionary backend : compiled lexicon, memory-mapped (same interface as DicServerClient, no server needed)
+#   The lexicon is built offline (see buildLexicon) from one word list per language, and stored in a single file :
+#       - header : magic number, size of the languages table, number of words
+#       - languages table (JSON list of language codes, the index of a language is its bit in the masks)
+#       - offsets of the words (uint64, nbWords+1 values) into the words area
+#       - language bitmask of each word (uint64, nbWords values)
+#       - words area : words (lower case, UTF-8), sorted, one after the other
+#   At runtime the file is memory-mapped (near-zero startup, the page cache is shared between processes) and a word is found by binary search.
+#
+LEXICON_MAGIC=b"CSWLEX1\0"
+LEXICON_HEADER=struct.Struct("<8sII")
+
+
+class MmapLexicon(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, langsSize, self.nbWords) = LEXICON_HEADER.unpack_from(self.mm, 0)
+        if magic != LEXICON_MAGIC :
+            raise ValueError("%s is not a CoSwID lexicon"%path)
+        pos = LEXICON_HEADER.size
+        self.languages = json.loads(self.mm[pos:pos+langsSize].decode('utf-8'))
+        self.bits = {lg:1<<i for (i,lg) in enumerate(self.languages)}
+        pos += langsSize + (-(pos+langsSize))%8
+        self.offsets = numpy.frombuffer(self.mm, dtype='<u8', count=self.nbWords+1, offset=pos)
+        pos += (self.nbWords+1)*8
+        self.masks = numpy.frombuffer(self.mm, dtype='<u8', count=self.nbWords, offset=pos)
+        self.wordsStart = pos + self.nbWords*8
+
+    def close(self):
+        # the numpy views must be released before the mmap
+        self.offsets = None
+        self.masks = None
+        self.mm.close()
+
+    # same request format as dicServer (for information only)
+    def request(self, word, languages):
+        return " word_possibleLanguages::%s::%s\n"%(word, ",".join(languages))
+
+    # language bitmask of a word (0 if unknown)
+    def mask(self, word):
+        key = word.lower().encode('utf-8')
+        (lo, hi) = (0, self.nbWords)
+        while lo < hi :
+            mid = (lo+hi)//2
+            cur = self.mm[self.wordsStart+int(self.offsets[mid]):self.wordsStart+int(self.offsets[mid+1])]
+            if cur < key :
+                lo = mid+1
+            elif cur > key :
+                hi = mid
+            else :
+                return int(self.masks[mid])
+        return 0
+
+    # possible languages of one word, amongst 'languages'
+    def possibleLanguages(self, word, languages):
+        mask = self.mask(word)
+        return [lg for lg in languages if mask & self.bits.get(lg, 0)]
+
+    # possible languages of several words : queries=[(word, languages), ...] ; returns a list of results in the same order
+    def possibleLanguagesBatch(self, queries):
+        return [self.possibleLanguages(word, languages) for (word, languages) in queries]
+
+
+#
+# Build a lexicon file (see MmapLexicon) from word lists
+#   - wordLists : [ (lg, path) , ... , (lg, path) ] ; one word per line (only the first column is used if the lines contain tabulations)
+#
+def buildLexicon(outputPath, wordLists):
+    # (several word lists can be given for the same language)
+    languages = list(dict.fromkeys([lg for (lg, path) in wordLists]))
+    if len(languages) > 64 :
+        raise ValueError("a lexicon can not contain more than 64 languages")
+    words = {}
+    for (lg, path) in wordLists:
+        bit = 1<<languages.index(lg)
+        with codecs.open(path, 'r', "utf-8") as f:
+            for line in f:
+                word = line.split('\t')[0].strip().lower()
+                if word :
+                    words[word] = words.get(word, 0) | bit
+    entries = sorted([(word.encode('utf-8'), mask) for (word, mask) in words.items()])
+    langsJson = json.dumps(languages).encode('utf-8')
+    offsets = numpy.zeros(len(entries)+1, dtype='<u8')
+    offsets[1:] = numpy.cumsum([len(word) for (word, mask) in entries], dtype=numpy.uint64)
+    masks = numpy.array([mask for (word, mask) in entries], dtype='<u8')
+    # write to a temporary file, then rename (a lexicon in use is never partially written)
+    tmpPath = "%s.tmp%d"%(outputPath, os.getpid())
+    with open(tmpPath, 'wb') as f:
+        f.write(LEXICON_HEADER.pack(LEXICON_MAGIC, len(langsJson), len(entries)))
+        f.write(langsJson)
+        f.write(b"\0"*((-(LEXICON_HEADER.size+len(langsJson)))%8))
+        f.write(offsets.tobytes())
+        f.write(masks.tobytes())
+        for (word, mask) in entries:
+            f.write(word)
+    os.replace(tmpPath, outputPath)
+    return (languages, len(entries))
+
+
+#
+# Dictionary backend with answers fetched in advance (eg. for all the tokens of a document, in one exchange with dicServer)
+#   The answers obtained with prefetch() are used first, the other lookups are sent to the backend
+#   - cache : shared cache of the answers (see cache.LRUCache; key = (word, languages)), used before the backend ; None = no cache
+#   The failed lookups (None) are not cached
+#
+class PrefetchedDictionary(object):
+    def __init__(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache
+        self.answers = {}   # (word, languages) -> [lg, ... ,lg]
+
+    def request(self, word, languages):
+        return self.backend.request(word, languages)
+
+    def prefetch(self, queries):
+        queries = [query for query in dict.fromkeys([(word, tuple(languages)) for (word, languages) in queries]) if query not in self.answers]
+        if self.cache is not None :
+            cached = [(query, self.cache.get(query)) for query in queries]
+            self.answers.update([(query, answer) for (query, answer) in cached if answer is not None])
+            queries = [query for (query, answer) in cached if answer is None]
+            instrument.current().count("dicoCached", len(cached)-len(queries))
+        answers = self.backend.possibleLanguagesBatch(queries)
+        self.answers.update(zip(queries, answers))
+        if self.cache is not None :
+            for (query, answer) in zip(queries, answers):
+                if answer is not None :
+                    self.cache.put(query, answer)
+
+    def possibleLanguages(self, word, languages):
+        key = (word, tuple(languages))
+        if key not in self.answers :
+            self.prefetch([key])
+        return self.answers[key]
+
+    def possibleLanguagesBatch(self, queries):
+        self.prefetch(queries)
+        return [self.answers[(word, tuple(languages))] for (word, languages) in queries]
+
+
+#
+# Dictionary backend without any word : each lookup returns an empty list (the _dico_ vote never decides)
+#   Used for reproducible measures without dicServer (see bench.py)
+#
+class StubDictionary(object):
+    def request(self, word, languages):
+        return " word_possibleLanguages::%s::%s\n"%(word, ",".join(languages))
+
+    def possibleLanguages(self, word, languages):
+        return []
+
+    def possibleLanguagesBatch(self, queries):
+        return [[] for query in queries]
+
+    def close(self):
+        pass
+
+
+#
+# Open the dictionary backend : the compiled lexicon if a path is given, dicServer otherwise
+#
+def openDictionary(lexicon="", host="localhost", port=1112, timeout=5.0):
+    if lexicon :
+        return MmapLexicon(lexicon)
+    return DicServerClient(host, port, timeout)
+
+
+# ___ MAIN : build a lexicon ___
+#   python3 dico.py -o <lexicon file> <lg>=<word list> ... <lg>=<word list>
+#   Eg. python3 dico.py -o ../models/dico.lex cos=dicos/cos.txt fra=dicos/fra.txt
+if __name__ == "__main__" :
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],"ho:",["output="])
+    except getopt.GetoptError:
+        print ('dico.py -o <lexicon file> <lg>=<word list> ... <lg>=<word list>')
+        sys.exit(2)
+    outputPath = ""
+    for opt, arg in opts:
+        if opt == '-h':
+            print ('dico.py -o <lexicon file> <lg>=<word list> ... <lg>=<word list>')
+            sys.exit()
+        elif opt in ('-o','--output') :
+            outputPath = arg
+    if len(outputPath)==0 or len(args)==0 :
+        print ('dico.py -o <lexicon file> <lg>=<word list> ... <lg>=<word list>')
+        sys.exit(2)
+    wordLists = [tuple(arg.split('=',1)) for arg in args]
+    (languages, nbWords) = buildLexicon(outputPath, wordLists)
+    print("Lexicon %s : %s words, languages %s"%(outputPath, nbWords, str(languages)))
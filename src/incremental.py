@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Incremental mode : re-analysis of a document after each edit, limited to the tokens around the edit
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+
+import time
+import numpy
+import coswid
+import dico
+import instrument
+
+#
+# Incremental analysis of a document being edited (eg. behind an editor) : the document is analysed once, then each edit only re-analyses the tokens around it
+#
+#   The document keeps its tokens, the raw probabilities of its sliding windows and the features of its global detection (counted token by token).
+#   For each edit (a text range replaced by a new text, see edit / update) :
+#       - only the tokens of the edited range are tokenized again (the range is extended to the whitespaces around it)
+#       - the features of the global detection are updated (the tokens whose features change are the edited tokens and the following tokens within
+#         the length of the features), and the global detection is scored again
+#       - only the windows containing an edited token, or crossing the edit, are detected again (within swSize tokens of the edit ;
+#         and the windows wrapping around the begining and the end of the text when the number of tokens changes)
+#       - only the tokens of these windows are accumulated and decided again (thresholding and vote)
+#   If the global detection changes the possible languages (see filterGlob) or the best global language (used by the full vote), the scores of all the tokens
+#   are computed again from the raw probabilities of the windows, and all the tokens are decided again.
+#   The results are the same as the analysis of the whole new text (see CoSwID.analyse ; the adaptive window skipping is not available).
+#   The cost of an edit does not depend on the length of the document (except a copy of the arrays when the number of tokens changes, and the normalization of the
+#   whole text that checks the features of the global detection when the normalization of the detector may not work inside the tokens, see globalLanguages).
+#
+#   Eg. : doc=Document(cosw, "Voici un texte à analyser", swSize=2)
+#         doc.edit(6, 8, "une phrase")          --> indexes of the tokens decided again
+#         doc.result()                          --> [(token,lg), ... ,(token,lg)]
+#
+
+#
+# Document analysed incrementally
+#   - cosw : CoSwID analyser (model, dictionary and caches)
+#   - options : settings of the analyses (see CoSwID.analyse) ; they can not be changed afterwards
+#   - name : name of the document in the trace file (see CoSwID.record)
+#
+class Document(object):
+    def __init__(self, cosw, text, name=None, **options):
+        self.cosw = cosw
+        self.detector = cosw.detector
+        self.settings = cosw.settingsFor(options)
+        if self.settings["skipMargin"] > 0 :
+            raise ValueError("the adaptive window skipping (skipMargin) is not available in incremental mode")
+        self.swSize = self.settings["swSize"]
+        self.name = name
+        self.maxLen = self.detector.maxFeatureLen
+        self.analyse(text)
+
+    # tokens and languages : [ (token,lg) , ... ] or, with spans, [ (start,end,token,lg) , ... ] (see CoSwID.analyse)
+    def result(self, spans=False):
+        if spans :
+            return [(int(begin), int(end), tok, lg) for ((begin, end), tok, lg) in zip(self.offsets.tolist(), self.tokens, self.languages)]
+        return list(zip(self.tokens, self.languages))
+
+    # analysis of the whole text
+    def analyse(self, text):
+        stats = instrument.Stats()
+        start = time.perf_counter()
+        with instrument.collect(stats, self.cosw.debugTrace, self.name):
+            self.text = text
+            with stats.timer("tokenize"):
+                (cleanedText, self.tokens, self.cleanedTokens, offsets) = coswid.tokenize(text)
+                self.offsets = numpy.array(offsets, dtype=numpy.int64).reshape(len(offsets), 2)
+            with stats.timer("global"):
+                self.normTokens = [self.detector.normalize(tok) for tok in self.tokens]
+                self.features = [None]*len(self.tokens)
+                self.globalCounts = {}
+                self.globalFeatures(range(len(self.tokens)))
+                (self.possibleLg, self.bestGlobLg) = self.globalLanguages()
+            if len(self.possibleLg)==0:
+                raise ValueError("no language available!")
+            self.windowProb = coswid.windowProbabilities(self.detector, self.cleanedTokens, self.swSize, self.cosw.batchSize, self.cosw.threads)
+            self.decideAll()
+        stats.count("documents")
+        stats.count("tokens", len(self.tokens))
+        self.cosw.record(stats, self.name, time.perf_counter()-start)
+
+    #
+    # Replace the chars [start:end] of the text by 'replacement', and update the analysis
+    #   - Output : indexes (in the new text) of the tokens decided again
+    #   If no language is available for the new text (see filterGlob), the edit is cancelled (ValueError)
+    #
+    def edit(self, start, end, replacement):
+        if not 0 <= start <= end <= len(self.text) :
+            raise ValueError("invalid range of the edit : %s-%s (length of the text : %s)"%(start, end, len(self.text)))
+        stats = instrument.Stats()
+        begin = time.perf_counter()
+        oldText = self.text
+        with instrument.collect(stats, self.cosw.debugTrace, self.name):
+            with stats.timer("tokenize"):
+                (first, nbRemoved, nbInserted) = self.retokenize(start, end, replacement)
+            nbToks = len(self.tokens)
+            (sw, inserted) = (self.swSize, range(first, first+nbInserted))
+            with stats.timer("global"):
+                # the features of the following tokens include chars of the edited tokens (up to maxLen-1 chars before them)
+                following = []
+                (r, distance) = (first+nbInserted, 0)
+                while r < nbToks and distance < self.maxLen-1 :
+                    following.append(r)
+                    if self.normTokens[r] :
+                        distance += len(self.normTokens[r])+1
+                    r += 1
+                self.globalFeatures(list(inserted)+following)
+                (possibleLg, bestGlobLg) = self.globalLanguages()
+            if len(possibleLg)==0:
+                self.analyse(oldText)
+                raise ValueError("no language available!")
+            # windows detected again : the windows containing an inserted token or crossing the edit (and the windows wrapping around the text if the number of tokens changed)
+            if min(nbToks, nbToks-nbInserted+nbRemoved) <= 2*sw+1 :
+                centers = list(range(nbToks))
+            else :
+                centers = {c % nbToks for c in range(first-sw, first+nbInserted+sw)}
+                if nbInserted != nbRemoved :
+                    centers.update(range(sw))
+                    centers.update(range(nbToks-sw, nbToks))
+                centers = sorted(centers)
+            if nbInserted != nbRemoved :
+                self.windowProb = numpy.concatenate((self.windowProb[:first], numpy.zeros((nbInserted, self.windowProb.shape[1]), dtype=self.windowProb.dtype), self.windowProb[first+nbRemoved:]))
+                self.filteredResults = numpy.concatenate((self.filteredResults[:first], numpy.zeros((nbInserted, self.filteredResults.shape[1]), dtype=self.filteredResults.dtype), self.filteredResults[first+nbRemoved:]))
+                self.languages[first:first+nbRemoved] = [None]*nbInserted
+            if centers :
+                fragments = [coswid.slidingWindow(c, self.cleanedTokens, sw)[0] for c in centers]
+                stats.count("windows", len(fragments))
+                self.windowProb[centers] = self.detector.detect_batch(fragments)[1]
+            if possibleLg != self.possibleLg or (bestGlobLg != self.bestGlobLg and self.settings["voteMethod"] == "full") :
+                # the scores of all the tokens change
+                stats.count("incrementalFallbacks")
+                (self.possibleLg, self.bestGlobLg) = (possibleLg, bestGlobLg)
+                self.decideAll()
+                redecided = list(range(nbToks))
+            else :
+                self.bestGlobLg = bestGlobLg
+                redecided = sorted({(c+k) % nbToks for c in centers for k in range(-sw, sw+1)}.union(inserted)) if nbToks > 0 else []
+                self.decide(redecided)
+        stats.count("edits")
+        stats.count("tokens", len(redecided))
+        self.cosw.record(stats, self.name, time.perf_counter()-begin)
+        return redecided
+
+    #
+    # Replace the text by 'text' : the edit is the range between the common prefix and the common suffix of the two texts (see edit)
+    #   - Output : see edit
+    #
+    def update(self, text):
+        (old, n) = (self.text, min(len(self.text), len(text)))
+        # common prefix and suffix (binary search : only the part of the texts not compared yet is compared at each step)
+        (lo, hi) = (0, n)
+        while lo < hi :
+            mid = (lo+hi+1)//2
+            if old.startswith(text[lo:mid], lo) :
+                lo = mid
+            else :
+                hi = mid-1
+        prefix = lo
+        (lo, hi) = (0, n-prefix)
+        while lo < hi :
+            mid = (lo+hi+1)//2
+            if old.endswith(text[len(text)-mid:len(text)-lo], 0, len(old)-lo) :
+                lo = mid
+            else :
+                hi = mid-1
+        suffix = lo
+        return self.edit(prefix, len(old)-suffix, text[prefix:len(text)-suffix])
+
+    #
+    # Tokenize the edited range again, and replace its tokens
+    #   - Output : (index of the first replaced token, number of tokens removed, number of tokens inserted)
+    #
+    def retokenize(self, start, end, replacement):
+        spaceRe = coswid.tokenizer.forAlphabet(coswid.alphabet).spaceRe
+        text = self.text[:start]+replacement+self.text[end:]
+        delta = len(replacement)-(end-start)
+        # the range is extended to the whitespaces (or the limits of the text) around it : the tokens of the range are the same as in the whole text
+        (regionStart, regionEnd) = (start, end+delta)
+        while regionStart > 0 and not spaceRe.match(text, regionStart-1) :
+            regionStart -= 1
+        while regionEnd < len(text) and not spaceRe.match(text, regionEnd) :
+            regionEnd += 1
+        first = int(numpy.searchsorted(self.offsets[:,0], regionStart))
+        last = int(numpy.searchsorted(self.offsets[:,0], regionEnd-delta))
+        (cleanedText, tokens, cleanedTokens, offsets) = coswid.tokenize(text[regionStart:regionEnd])
+        offsets = numpy.array(offsets, dtype=numpy.int64).reshape(len(offsets), 2) + regionStart
+        self.offsets = numpy.concatenate((self.offsets[:first], offsets, self.offsets[last:] + delta))
+        self.tokens[first:last] = tokens
+        self.cleanedTokens[first:last] = cleanedTokens
+        for r in range(first, last):
+            self.forget(r)
+        self.normTokens[first:last] = [self.detector.normalize(tok) for tok in tokens]
+        self.features[first:last] = [None]*len(tokens)
+        self.text = text
+        return (first, last-first, len(tokens))
+
+    # scores and languages of all the tokens, from the raw probabilities of the windows
+    def decideAll(self):
+        stats = instrument.current()
+        nbToks = len(self.tokens)
+        possibleIdx = numpy.array([self.detector.lgIndex[lg] for lg in self.possibleLg], dtype=int)
+        with stats.timer("accumulation"):
+            results = numpy.zeros((nbToks, len(self.possibleLg)), dtype=numpy.float32)
+            results = coswid.accumulateWindows(coswid.recalibrateResults(self.windowProb, possibleIdx), numpy.arange(nbToks), self.swSize, results)
+            self.filteredResults = coswid.normLanguageScores(results, self.swSize)
+        self.languages = coswid.decideLanguages(self.detector, dico.PrefetchedDictionary(self.cosw.dictionary(), self.cosw.dicoCache()), self.tokens, self.filteredResults,
+                                                self.possibleLg, self.bestGlobLg, self.settings["significantGap"], self.settings["voteMethod"])
+
+    #
+    # Scores and languages of the tokens 'indexes' (sorted), from the raw probabilities of the windows
+    # The windows are added in the same order as accumulateWindows : the scores are the same as the scores of the whole text
+    #
+    def decide(self, indexes):
+        if not indexes :
+            return
+        stats = instrument.current()
+        nbToks = len(self.tokens)
+        sw = self.swSize
+        possibleIdx = numpy.array([self.detector.lgIndex[lg] for lg in self.possibleLg], dtype=int)
+        with stats.timer("accumulation"):
+            centers = numpy.array(sorted({(t+k) % nbToks for t in indexes for k in range(-sw, sw+1)}), dtype=numpy.intp)
+            shifts = numpy.array([0]+[-i for i in range(1,sw+1)]+list(range(1,sw+1)), dtype=int)
+            # row of each token of the windows in the results (-1 for the tokens that are not decided again)
+            tokens = (centers[:,None]+shifts[None,:]) % nbToks
+            targets = numpy.minimum(numpy.searchsorted(indexes, tokens), len(indexes)-1)
+            targets = numpy.where(numpy.asarray(indexes)[targets] == tokens, targets, -1)
+            recProbs = numpy.broadcast_to(coswid.recalibrateResults(self.windowProb[centers], possibleIdx)[:,None,:], targets.shape+(len(possibleIdx),))
+            kept = targets >= 0
+            results = numpy.zeros((len(indexes), len(possibleIdx)), dtype=numpy.float32)
+            numpy.add.at(results, targets[kept], recProbs[kept])
+            self.filteredResults[indexes] = coswid.normLanguageScores(results, sw)
+        # (decided by runs of consecutive tokens, see decideLanguages)
+        dictionary = dico.PrefetchedDictionary(self.cosw.dictionary(), self.cosw.dicoCache())
+        runStart = 0
+        for k in range(1, len(indexes)+1):
+            if k == len(indexes) or indexes[k] != indexes[k-1]+1 :
+                (first, last) = (indexes[runStart], indexes[k-1]+1)
+                self.languages[first:last] = coswid.decideLanguages(self.detector, dictionary, self.tokens[first:last], self.filteredResults[first:last],
+                                                                    self.possibleLg, self.bestGlobLg, self.settings["significantGap"], self.settings["voteMethod"], firstIdx=first)
+                runStart = k
+
+    #
+    # Features of the global detection, counted token by token (see coswid.WindowFeatures) :
+    #   the features of a non empty (normalized) token are the features ending inside the token (tokEnd) and on the space after it (sepEnd), and the global
+    #   features are : sum(tokEnd+sepEnd) of all the tokens - sepEnd of the last token + the features involving the "\u0001" at the begining and at the end of the text
+    #   (the same features as the global detection of the text when the normalization works inside the tokens, see globalLanguages)
+    #
+    def globalFeatures(self, indexes):
+        for r in indexes:
+            self.forget(r)
+            tok = self.normTokens[r]
+            if not tok :
+                continue
+            context = self.context(r)
+            tokEnd = self.diff(context+tok, context)
+            tail = (context+tok)[-(self.maxLen-1):] if self.maxLen > 1 else ""
+            sepEnd = self.diff(tail+" ", tail)
+            self.features[r] = (tokEnd, sepEnd)
+            self.addEvents(self.globalCounts, tokEnd, 1)
+            self.addEvents(self.globalCounts, sepEnd, 1)
+
+    # remove the features of token r from the global features
+    def forget(self, r):
+        if self.features[r] is not None :
+            (tokEnd, sepEnd) = self.features[r]
+            self.addEvents(self.globalCounts, tokEnd, -1)
+            self.addEvents(self.globalCounts, sepEnd, -1)
+            self.features[r] = None
+
+    # the maxLen-1 chars before the non empty token r in the normalized text (the non empty tokens joined by a space)
+    def context(self, r):
+        (parts, size) = ([], 0)
+        r -= 1
+        while r >= 0 and size < self.maxLen-1 :
+            if self.normTokens[r] :
+                parts.append(self.normTokens[r])
+                size += len(self.normTokens[r])+1
+            r -= 1
+        context = " ".join(reversed(parts))+" " if parts else ""
+        return context[len(context)-self.maxLen+1:] if self.maxLen > 1 else ""
+
+    # possibleLg and bestGlobLg from the global features (see coswid.globalLanguages)
+    #   the features counted token by token are the features of the normalized text if it is the normalized tokens joined by a space ; otherwise (the normalization
+    #   does not work inside the tokens, eg. the Turkish dotted I or the rules of the tweets of ldig) the features are extracted from the normalized text
+    def globalLanguages(self):
+        # (only checked if the normalization of the detector may not work inside the tokens, see coswid.DetectorBackend.tokenLocal)
+        normText = None if self.detector.tokenLocal else self.detector.normalize(coswid.tokenize(self.text)[0])
+        if normText is not None and normText != " ".join([tok for tok in self.normTokens if tok]) :
+            events = self.detector.extract_features(u"\u0001" + normText + u"\u0001")
+        else :
+            events = self.countedEvents()
+        globProb = self.cosw.globalDetector.score_events([events])[1][0]
+        return coswid.selectLanguages(self.cosw.globalDetector, globProb, self.settings["acceptedLg"], self.settings["filterGlob"])
+
+    # features of the normalized text, from the features counted token by token
+    def countedEvents(self):
+        L = self.maxLen
+        # begining of the normalized text (at least L-1 chars, or the whole text)
+        (head, r) = ("", 0)
+        while r < len(self.normTokens) and len(head) < L-1 :
+            if self.normTokens[r] :
+                head = head+" "+self.normTokens[r] if head else self.normTokens[r]
+            r += 1
+        if len(head) < L-1 and r == len(self.normTokens) :
+            # short text : some features may involve the "\u0001" at both ends
+            events = self.detector.extract_features(u"\u0001" + head + u"\u0001")
+        else :
+            events = dict(self.globalCounts)
+            last = len(self.normTokens)-1
+            while not self.normTokens[last] :
+                last -= 1
+            self.addEvents(events, self.features[last][1], -1)
+            (tail, r) = ("", last)
+            while r >= 0 and len(tail) < L-1 :
+                if self.normTokens[r] :
+                    tail = self.normTokens[r]+" "+tail if tail else self.normTokens[r]
+                r -= 1
+            (head, tail) = (head[:L-1], tail[len(tail)-L+1:])
+            self.addEvents(events, self.diff(u"\u0001"+head, head), 1)
+            self.addEvents(events, self.diff(tail+u"\u0001", tail), 1)
+        return events
+
+    # features of the string 'st' minus the features of the string 'sub' (see coswid.WindowFeatures.diff)
+    def diff(self, st, sub):
+        events = self.detector.extract_features(st)
+        for (id,n) in self.detector.extract_features(sub).items():
+            events[id] -= n
+            if events[id] == 0 :
+                del events[id]
+        return events
+
+    # add (sign=1) or remove (sign=-1) 'events' from 'counts'
+    def addEvents(self, counts, events, sign):
+        for (id,n) in events.items():
+            n = counts.get(id, 0) + sign*n
+            if n == 0 :
+                del counts[id]
+            else :
+                counts[id] = n
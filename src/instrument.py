@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Instrumentation : time of each step of the analysis, counters, profiling
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+import sys
+import time
+import codecs
+import json
+import threading
+import contextlib
+import collections
+import concurrent.futures
+
+#
+# Measures of the analyses : time (and number of calls) of each step, and counters
+#   The functions of the analysis add their measures to the Stats object of the current thread (see current), given by the caller with collect()
+#   Steps : tokenize, global, features, scoring, recalibration, accumulation, thresholding, lgIDVote, dicoVote, dicoRTT (exchanges with dicServer), decision, output
+#   Counters : documents, tokens, windows, fragments, fragmentsCached, ambiguousTokens, dicoRequests, dicoCached, dicoFailures
+#
+class Stats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+
+    def add(self, step, seconds, calls=1):
+        with self.lock:
+            self.times[step] = self.times.get(step, 0.0) + seconds
+            self.calls[step] = self.calls.get(step, 0) + calls
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # measure the time of a block : with stats.timer("step"): ...
+    @contextlib.contextmanager
+    def timer(self, step):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(step, time.perf_counter()-start)
+
+    # add the measures of another Stats (or of a summary, see summary())
+    def merge(self, other):
+        if isinstance(other, Stats) :
+            other = other.summary()
+        for (step, measure) in other["steps"].items():
+            self.add(step, measure["time"], measure["calls"])
+        for (name, n) in other["counters"].items():
+            self.count(name, n)
+
+    def summary(self):
+        with self.lock:
+            return {"steps":{step:{"time":round(self.times[step],6), "calls":self.calls[step]} for step in self.times}, "counters":dict(self.counters)}
+
+
+#
+# Debug trace : one JSON line for the tokens of the analyses (probabilities, languages kept after thresholding, vote, decision)
+#   Only one token every 'every' tokens is written (token number % every == 0)
+#
+class DebugTrace(object):
+    def __init__(self, path, every=1):
+        self.file = codecs.open(path, 'a', "utf-8")
+        self.every = max(every, 1)
+        self.lock = threading.Lock()
+
+    def sampled(self, index):
+        return index % self.every == 0
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line+"\n")
+
+    def close(self):
+        self.file.close()
+
+
+# Stats (and debug trace, document name) of the current thread (measures are not kept if no Stats was given with collect())
+local = threading.local()
+discarded = Stats()
+
+def current():
+    return getattr(local, "stats", None) or discarded
+
+def debugTrace():
+    return getattr(local, "debugTrace", None)
+
+def document():
+    return getattr(local, "document", None)
+
+
+# the measures of the current thread are added to 'stats' inside the block : with collect(stats): ...
+#   - debug, document : DebugTrace (if any) and name of the document analysed in the block
+@contextlib.contextmanager
+def collect(stats, debug=None, document=None):
+    previous = (getattr(local, "stats", None), getattr(local, "debugTrace", None), getattr(local, "document", None))
+    (local.stats, local.debugTrace, local.document) = (stats, debug, document)
+    try:
+        yield stats
+    finally:
+        (local.stats, local.debugTrace, local.document) = previous
+
+
+# run 'target' in a thread, its measures being added to the Stats of the current thread
+def thread(target, args=()):
+    (stats, debug, name) = (current(), debugTrace(), document())
+    def run():
+        with collect(stats, debug, name):
+            target(*args)
+    return threading.Thread(target=run)
+
+
+# run function(*args) for each 'args' of 'argsList' on 'threads' threads, the measures being added to the Stats of the current thread
+#   - Output : [ result , ... , result ] in the order of argsList
+def parallel(function, argsList, threads):
+    if threads <= 1 or len(argsList) <= 1 :
+        return [function(*args) for args in argsList]
+    (stats, debug, name) = (current(), debugTrace(), document())
+    def run(args):
+        with collect(stats, debug, name):
+            return function(*args)
+    with concurrent.futures.ThreadPoolExecutor(min(threads, len(argsList))) as pool:
+        return list(pool.map(run, argsList))
+
+
+#
+# Sampling profiler : the stacks of all the threads are recorded every 'interval' seconds (the cost does not depend on the number of function calls)
+#   The result is written in the "collapsed stacks" format (one line per stack : "function;function;...;function <number of samples>"), used by the flame graph tools
+#
+class SamplingProfiler(object):
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.running = False
+
+    def sample(self):
+        me = threading.get_ident()
+        while self.running :
+            for (ident, frame) in sys._current_frames().items():
+                if ident == me :
+                    continue
+                stack = []
+                while frame is not None :
+                    stack.append("%s (%s:%s)"%(frame.f_code.co_name, frame.f_code.co_filename.split("/")[-1], frame.f_code.co_firstlineno))
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self, path):
+        self.running = False
+        self.thread.join()
+        with open(path, 'w') as f:
+            for (stack, n) in self.samples.most_common():
+                f.write("%s %s\n"%(stack, n))
+
+
+# profilers of the profile function
+PROFILERS=("cprofile", "sample")
+
+#
+# Run 'function' with a profiler ("cprofile" : deterministic profiler, the statistics are saved for pstats ; "sample" : SamplingProfiler)
+# The results are written into 'path' ; for cProfile the 20 most expensive functions are displayed
+#
+def profile(mode, path, function, *args):
+    if mode == "cprofile" :
+        import cProfile, pstats
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args)
+        finally:
+            profiler.dump_stats(path)
+            pstats.Stats(path).sort_stats("cumulative").print_stats(20)
+    elif mode == "sample" :
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            return function(*args)
+        finally:
+            profiler.stop(path)
+    else :
+        raise ValueError("unknown profiler : %s"%mode)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Character n-gram language identification model : hashed n-grams, trained in a few minutes (built-in alternative to ldig, see coswid.NgramDetector)
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+
+import sys, getopt
+import os
+import re
+import codecs
+import json
+import mmap
+import struct
+import time
+import numpy
+
+#
+# Hashed character n-gram model
+#   - features : all the n-grams (1 to maxOrder characters) of the normalized fragment, "\u0001" at its edges included (the same kind of features as ldig :
+#     substrings of at most maxOrder characters, so that the features of the sliding windows can be computed incrementally, see coswid.WindowFeatures)
+#   - each n-gram is hashed into one of the 2^bits rows of the weights table (polynomial hash, 64 bits) : no dictionary of the n-grams is needed
+#   - weights (nbRows, nbLabels) : log-probabilities of the rows for each language (naive Bayes, additive smoothing 'alpha'), minus their mean over
+#     the languages (the same probabilities, and smaller weights for the quantization and the pruning, see coswid.Detector.quantize and subset)
+#   - probabilities of a fragment : softmax of the sums of the weights of its features, divided by 'temperature'
+#
+# Model file : header (magic number, size of the metadata) + metadata (JSON) + weights (raw array, 64 bytes aligned, memory-mapped when loaded)
+#
+# Training data : the ldig format, one "label\ttext" line per sentence (eg. data_lgID_learn/filter2/LEARN_data_filter2_ALL.txt)
+#
+NGRAM_MAGIC=b"CSWNGM1\0"
+NGRAM_HEADER=struct.Struct("<8sQ")
+
+# hash of an n-gram : h = h*PRIME + code of the character (modulo 2^64) for each character, starting from SEED ; row = high bits of mix(h)
+SEED=0xcbf29ce484222325
+PRIME=0x100000001b3
+MIX=0x9e3779b97f4a7c15
+MASK=(1<<64)-1
+# fragments of at least LONG characters are hashed with numpy (the short fragments, eg. the sliding windows, are faster in Python)
+LONG=256
+
+DIGITS=re.compile(r"[0-9]+")
+SPACES=re.compile(r"\s+")
+
+
+def weightsOffset(metaSize):
+    return ((NGRAM_HEADER.size+metaSize+63)//64)*64
+
+
+#
+# Normalized text : lower case, numbers replaced by "0", spaces collapsed
+#   (the normalization works inside the tokens : the normalized text of tokens joined by a space is the normalized tokens joined by a space)
+#
+def normalize(st):
+    return SPACES.sub(" ", DIGITS.sub("0", st.lower())).strip()
+
+
+#
+# Features of the fragments : dictionary row:count (see above)
+#
+class HashedNgrams(object):
+    def __init__(self, maxOrder, bits):
+        self.maxOrder = maxOrder
+        self.bits = bits
+        self.shift = 64-bits
+
+    # rows of all the n-grams of 'codes' (array of the codes of the characters)
+    #   - separators : boolean array, True for the characters separating two sentences (the n-grams having a separator inside are ignored ; training only)
+    def rows(self, codes, separators=None):
+        (prime, mix, shift) = (numpy.uint64(PRIME), numpy.uint64(MIX), numpy.uint64(self.shift))
+        codes = codes.astype(numpy.uint64)
+        h = numpy.full(len(codes), SEED, dtype=numpy.uint64)
+        valid = numpy.ones(len(codes), dtype=bool)
+        rows = []
+        for n in range(1, self.maxOrder+1):
+            nb = len(codes)-n+1
+            if nb <= 0 :
+                break
+            h = h[:nb]*prime + codes[n-1:n-1+nb]
+            valid = valid[:nb]
+            if separators is not None and n >= 3 :
+                valid &= ~separators[n-2:n-2+nb]
+            mixed = h[valid] if separators is not None else h
+            rows.append(((mixed ^ (mixed >> numpy.uint64(32))) * mix) >> shift)
+        return numpy.concatenate(rows) if rows else numpy.zeros(0, dtype=numpy.uint64)
+
+    def extract_features(self, st):
+        if len(st) >= LONG :
+            (rows, counts) = numpy.unique(self.rows(numpy.frombuffer(st.encode('utf-32-le'), dtype='<u4')), return_counts=True)
+            return dict(zip(rows.tolist(), counts.tolist()))
+        (maxOrder, shift) = (self.maxOrder, self.shift)
+        events = {}
+        codes = [ord(c) for c in st]
+        for i in range(len(codes)):
+            h = SEED
+            for c in codes[i:i+maxOrder]:
+                h = (h*PRIME + c) & MASK
+                row = (((h ^ (h >> 32)) * MIX) & MASK) >> shift
+                events[row] = events.get(row, 0) + 1
+        return events
+
+
+#
+# Read the training data : sentences of each label
+#   - paths : files (ldig format, see above), or directories (all their files, recursively)
+#   - Output : generator of (label, [ normalized sentence , ... ]) blocks of about 'blockSize' characters
+#
+def readCorpus(paths, blockSize=1<<22):
+    files = []
+    for path in paths:
+        if os.path.isdir(path) :
+            files += sorted([os.path.join(root, name) for (root, dirs, names) in os.walk(path) for name in names])
+        else :
+            files.append(path)
+    blocks = {}     # label -> [ sentences , [number of characters] ]
+    for path in files:
+        with codecs.open(path, 'r', "utf-8") as f:
+            for line in f:
+                if '\t' not in line :
+                    continue
+                (label, text) = line.split('\t', 1)
+                text = normalize(text)
+                if not label.strip() or not text :
+                    continue
+                block = blocks.setdefault(label.strip(), [[], 0])
+                block[0].append(text)
+                block[1] += len(text)+1
+                if block[1] >= blockSize :
+                    yield (label.strip(), block[0])
+                    blocks[label.strip()] = [[], 0]
+    for (label, (sentences, size)) in blocks.items():
+        if sentences :
+            yield (label, sentences)
+
+
+#
+# Train a model
+#   - maxOrder : maximum length of the n-grams ; bits : size of the weights table (2^bits rows) ; alpha : additive smoothing ; temperature : see above
+#   - Output : (labels, weights, metadata)
+#
+def train(paths, maxOrder=5, bits=19, alpha=0.5, temperature=16.0):
+    ngrams = HashedNgrams(maxOrder, bits)
+    counts = {}     # label -> counts of the rows
+    chars = {}      # label -> number of characters
+    for (label, sentences) in readCorpus(paths):
+        # the sentences are hashed together ("\u0001" before and after each sentence, as the fragments)
+        codes = numpy.frombuffer(("\u0001"+"\u0001".join(sentences)+"\u0001").encode('utf-32-le'), dtype='<u4')
+        rows = ngrams.rows(codes, codes == 1)
+        counts[label] = counts.get(label, 0) + numpy.bincount(rows.astype(numpy.intp), minlength=1<<bits)
+        chars[label] = chars.get(label, 0) + len(codes)
+    if not counts :
+        raise ValueError("no training data in %s"%", ".join(paths))
+    labels = sorted(counts)
+    table = numpy.stack([counts[label] for label in labels], axis=1).astype(numpy.float64)
+    weights = numpy.log(table+alpha) - numpy.log(table.sum(axis=0)+alpha*(1<<bits))
+    weights -= weights.mean(axis=1, keepdims=True)
+    meta = {"labels":labels, "maxOrder":maxOrder, "bits":bits, "alpha":alpha, "temperature":temperature, "chars":chars}
+    return (labels, weights.astype(numpy.float32), meta)
+
+
+#
+# Write a model file (see above)
+#   - meta : metadata (labels, maxOrder, bits, temperature ; quantization and scale of the columns of a quantized model)
+#
+def save(path, weights, meta):
+    weights = numpy.ascontiguousarray(weights)
+    meta = json.dumps(dict(meta, dtype=weights.dtype.str, shape=weights.shape)).encode('utf-8')
+    tmpPath = "%s.tmp%d"%(path, os.getpid())
+    with open(tmpPath, 'wb') as f:
+        f.write(NGRAM_HEADER.pack(NGRAM_MAGIC, len(meta)))
+        f.write(meta)
+        f.write(b"\0"*(weightsOffset(len(meta))-NGRAM_HEADER.size-len(meta)))
+        f.write(weights.tobytes())
+    os.replace(tmpPath, path)
+
+
+# True if 'path' is a model file
+def isModel(path):
+    if not os.path.isfile(path) :
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(NGRAM_MAGIC)) == NGRAM_MAGIC
+
+
+#
+# Load a model file : the weights are memory-mapped (read only)
+#   - Output : (metadata, weights)
+#
+def load(path):
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, metaSize) = NGRAM_HEADER.unpack_from(mm, 0)
+    if magic != NGRAM_MAGIC :
+        raise ValueError("%s is not a CoSwID n-gram model"%path)
+    meta = json.loads(mm[NGRAM_HEADER.size:NGRAM_HEADER.size+metaSize].decode('utf-8'))
+    weights = numpy.ndarray(tuple(meta["shape"]), dtype=numpy.dtype(meta["dtype"]), buffer=mm, offset=weightsOffset(metaSize))
+    return (meta, weights)
+
+
+def usage():
+    print('ngram.py -o <model file> [-n <maximum length of the n-grams> (DEFAULT : 5)] [-b <bits : 2^bits rows in the weights table> (DEFAULT : 19)] [-a <smoothing> (DEFAULT : 0.5)] [-T <temperature> (DEFAULT : 16)] <training data : files (label\\ttext lines) or directories> ...')
+
+
+# ___ MAIN : train a model ___
+#   Eg. python3 ngram.py -o ../models/filter2.ngm ../data_lgID_learn/filter2/LEARN_data_filter2_ALL.txt
+if __name__ == "__main__" :
+    try:
+        opts, args = getopt.getopt(sys.argv[1:],"ho:n:b:a:T:",["output=","order=","bits=","alpha=","temperature="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    outputPath = ""
+    (maxOrder, bits, alpha, temperature) = (5, 19, 0.5, 16.0)
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt in ('-o','--output') :
+            outputPath = arg
+        elif opt in ('-n','--order') :
+            maxOrder = int(arg)
+        elif opt in ('-b','--bits') :
+            bits = int(arg)
+        elif opt in ('-a','--alpha') :
+            alpha = float(arg)
+        elif opt in ('-T','--temperature') :
+            temperature = float(arg)
+    if len(outputPath)==0 or len(args)==0 :
+        usage()
+        sys.exit(2)
+    start = time.time()
+    (labels, weights, meta) = train(args, maxOrder, bits, alpha, temperature)
+    save(outputPath, weights, meta)
+    print("Model %s : %s languages (%s), %s characters, %s bytes, trained in %0.1fs"%(outputPath, len(labels), ",".join(labels), sum(meta["chars"].values()), weights.nbytes, time.time()-start))
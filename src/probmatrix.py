@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Probability matrix : compact binary output of an analysis (offsets, languages and probabilities of the tokens), and its conversion to TSV or JSONL
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+
+import sys, getopt
+import os
+import codecs
+import json
+import mmap
+import struct
+import numpy
+
+#
+# Probability matrix file (see coswid.py, --matrix option) : written alongside the .out file (<file>.out.pm)
+#   - header : magic number, size of the metadata
+#   - metadata (JSON) : number of tokens, languages of the columns, settings of the analysis, and the position, type and shape of each array
+#   - arrays (raw, little endian, 64 bytes aligned) :
+#       offsets (nbToks, 2) int64 : char offsets of the tokens in the original text (text[start:end] is the token)
+#       language (nbToks) int16 : chosen language of each token (index in the languages)
+#       probabilities (nbToks, nbLg) float16 or float32 : probabilities of the languages for each token (see normLanguageScores)
+#       votes (nbToks) float32 : score of the vote of each token (NaN if there was no vote)
+#       tokenEnds (nbToks) int64 and tokens (bytes) : tokens (utf-8), the token i being tokens[tokenEnds[i-1]:tokenEnds[i]]
+#   The file is memory-mapped when it is opened (see ProbabilityMatrix) : the arrays are read-only views of the file, they are never parsed nor copied
+#
+PROB_MAGIC=b"CSWPRB1\0"
+PROB_HEADER=struct.Struct("<8sQ")
+DTYPES=("float16", "float32")
+
+
+def align(offset):
+    return ((offset+63)//64)*64
+
+
+#
+# Write a probability matrix file
+#   - tokens, offsets, languages : tokens, (start,end) char offsets and chosen language of the tokens
+#   - lgCodes : languages of the columns of 'probabilities' (array (nbToks, len(lgCodes)))
+#   - votes : score of the vote of each token (None = no vote)
+#   - dtype : type of the stored probabilities ("float16" or "float32")
+#   - settings : settings of the analysis (for information)
+#
+def write(path, tokens, offsets, languages, lgCodes, probabilities, votes=None, dtype="float32", settings=None):
+    if dtype not in DTYPES :
+        raise ValueError("unknown type of probabilities : %s (%s)"%(dtype, ",".join(DTYPES)))
+    (nbToks, nbLg) = (len(tokens), len(lgCodes))
+    lgCodes = list(lgCodes) + [lg for lg in dict.fromkeys(languages) if lg not in lgCodes]
+    lgIndex = {lg:i for (i,lg) in enumerate(lgCodes)}
+    encoded = [tok.encode('utf-8') for tok in tokens]
+    arrays = [
+        ("offsets", numpy.array(offsets, dtype='<i8').reshape(nbToks, 2)),
+        ("language", numpy.array([lgIndex[lg] for lg in languages], dtype='<i2')),
+        ("probabilities", numpy.ascontiguousarray(numpy.asarray(probabilities).reshape(nbToks, nbLg), dtype=numpy.dtype(dtype).newbyteorder('<'))),
+        ("votes", numpy.array([numpy.nan if vote is None else vote for vote in votes] if votes is not None else [numpy.nan]*nbToks, dtype='<f4')),
+        ("tokenEnds", numpy.cumsum([len(tok) for tok in encoded], dtype='<i8')),
+        ("tokens", numpy.frombuffer(b"".join(encoded), dtype=numpy.uint8)),
+    ]
+    layout = {}
+    meta = b""
+    # the positions of the arrays depend on the size of the metadata : computed until they do not change
+    while True :
+        offset = align(PROB_HEADER.size+len(meta))
+        for (name, array) in arrays:
+            layout[name] = {"offset":offset, "dtype":array.dtype.str, "shape":array.shape}
+            offset = align(offset+array.nbytes)
+        newMeta = json.dumps({"nbToks":nbToks, "lgCodes":lgCodes, "settings":settings, "arrays":layout}).encode('utf-8')
+        if len(newMeta) == len(meta) :
+            break
+        meta = newMeta
+    tmpPath = "%s.tmp%d"%(path, os.getpid())
+    with open(tmpPath, 'wb') as f:
+        f.write(PROB_HEADER.pack(PROB_MAGIC, len(meta)))
+        f.write(meta)
+        for (name, array) in arrays:
+            f.write(b"\0"*(layout[name]["offset"]-f.tell()))
+            f.write(array.tobytes())
+        f.write(b"\0"*(offset-f.tell()))
+    os.replace(tmpPath, path)
+
+
+#
+# Probability matrix file opened with mmap (see above)
+#   The arrays (offsets, language, probabilities, votes) are numpy views of the file : slicing them does not copy nor read the whole file
+#   Eg. : pm=ProbabilityMatrix("text.txt.out.pm")
+#         pm.probabilities[1000:2000, pm.lgIndex["cos"]]  --> probabilities of cos for the tokens 1000 to 1999
+#
+class ProbabilityMatrix(object):
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, metaSize) = PROB_HEADER.unpack_from(self.mm, 0)
+        if magic != PROB_MAGIC :
+            raise ValueError("%s is not a CoSwID probability matrix"%path)
+        meta = json.loads(self.mm[PROB_HEADER.size:PROB_HEADER.size+metaSize].decode('utf-8'))
+        self.nbToks = meta["nbToks"]
+        self.lgCodes = meta["lgCodes"]
+        self.lgIndex = {lg:i for (i,lg) in enumerate(self.lgCodes)}
+        self.settings = meta["settings"]
+        for (name, array) in meta["arrays"].items():
+            setattr(self, name, numpy.ndarray(tuple(array["shape"]), dtype=numpy.dtype(array["dtype"]), buffer=self.mm, offset=array["offset"]))
+
+    def __len__(self):
+        return self.nbToks
+
+    def close(self):
+        # the numpy views must be released before the mmap
+        self.offsets = self.language = self.probabilities = self.votes = self.tokenEnds = self.tokens = None
+        self.mm.close()
+
+    # token i (decoded from the file)
+    def token(self, i):
+        start = int(self.tokenEnds[i-1]) if i > 0 else 0
+        return self.tokens[start:int(self.tokenEnds[i])].tobytes().decode('utf-8')
+
+    # chosen language of token i
+    def languageOf(self, i):
+        return self.lgCodes[self.language[i]]
+
+
+#
+# Conversion of a probability matrix to the .out format : "token\tlg" lines (with spans : "start\tend\ttoken\tlg")
+#
+def toTSV(pm, fout, spans=False):
+    for i in range(len(pm)):
+        if spans :
+            fout.write("%s\t%s\t%s\t%s\n"%(pm.offsets[i,0], pm.offsets[i,1], pm.token(i), pm.languageOf(i)))
+        else :
+            fout.write("%s\t%s\n"%(pm.token(i), pm.languageOf(i)))
+
+
+#
+# Conversion of a probability matrix to JSONL : one JSON object per token (start, end, token, language, probabilities of the languages, vote score or null)
+#
+def toJSONL(pm, fout):
+    for i in range(len(pm)):
+        vote = float(pm.votes[i])
+        fout.write(json.dumps({"start":int(pm.offsets[i,0]), "end":int(pm.offsets[i,1]), "token":pm.token(i), "language":pm.languageOf(i),
+                               "probabilities":dict(zip(pm.lgCodes, pm.probabilities[i].tolist())), "vote":None if numpy.isnan(vote) else vote}, ensure_ascii=False)+"\n")
+
+
+def usage():
+    print('probmatrix.py [-f <tsv or jsonl>] [--spans] [-o <output file>] <probability matrix file>')
+    print('  converts a probability matrix (see coswid.py --matrix) to the .out format (tsv, DEFAULT) or to JSONL ; the output is written to the standard output by default')
+
+
+def main(argv):
+    outputFormat="tsv"
+    spans=False
+    outputFile=""
+    try:
+        opts, args = getopt.getopt(argv,"hf:o:",["format=","spans","output="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt in ('-f','--format') :
+            outputFormat=arg
+        elif opt == '--spans':
+            spans=True
+        elif opt in ('-o','--output') :
+            outputFile=arg
+    if len(args) != 1 or outputFormat not in ("tsv","jsonl") :
+        usage()
+        sys.exit(2)
+
+    pm=ProbabilityMatrix(args[0])
+    fout=codecs.open(outputFile,'w',"utf-8") if outputFile else codecs.getwriter("utf-8")(sys.stdout.buffer)
+    try:
+        if outputFormat=="jsonl" :
+            toJSONL(pm, fout)
+        else :
+            toTSV(pm, fout, spans)
+    finally:
+        fout.flush()
+        if outputFile :
+            fout.close()
+        pm.close()
+
+
+if __name__ == "__main__" :
+    main(sys.argv[1:])
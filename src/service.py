@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Service mode : CoSwID as a resident HTTP server (the model is loaded once)
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+import json
+import itertools
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import incremental
+
+#
+# HTTP service around a CoSwID instance (see coswid.py, --serve option)
+#
+#   POST /analyse   : analyse the text given in the body of the request
+#                       - text/plain body (UTF-8) : the options are given in the query string, eg. /analyse?c=2&v=dico&s=cos,fra
+#                       - application/json body : {"text":"...", "c":2, "v":"dico", "s":"cos,fra"}
+#                     options (same as the command line) : c/ctxtsize, f/fltrtresh, g/gap, v/vote, s/subset ; format=json (default) or tsv
+#                     JSON output : {"result":[[token,lg], ... ,[token,lg]], "time":<analysis time in seconds>}
+#                     TSV output : one "token<TAB>lg" line per token (as in the .out files)
+#   POST /documents : open a document analysed incrementally (see incremental.py), body and options as /analyse
+#                     JSON output : {"id":<document id>, "result":[[token,lg], ... ,[token,lg]], "time":<analysis time in seconds>}
+#   POST /documents/<id>/edit : edit the document : {"start":<char>, "end":<char>, "text":"..."} (text[start:end] replaced by "text"), or {"text":"..."} (new text of the document)
+#                     JSON output : {"changed":[[index,token,lg], ... ], "tokens":<number of tokens>, "time":<update time in seconds>} (the tokens decided again)
+#   GET /documents/<id> : tokens and languages of the document ({"result":[[token,lg], ... ,[token,lg]]}) ; DELETE /documents/<id> : close the document
+#   GET /health     : status of the service, model, default settings, statistics (requests, errors, tokens, analysis time, uptime), cache hits/misses and measures of the analysis steps (see instrument.py)
+#   Invalid request (non object JSON body, unknown option, option of the wrong type or out of range, see CoSwID.settingsFor) : 400 {"error":"..."}
+#
+# Requests are handled concurrently (one thread per request); the model is shared by all the threads, and the dictionary backends (connections to dicServer
+# or lexicons) are reused from one request to another. The edits of a document are applied one at a time.
+# The documents are kept in memory until they are closed.
+#
+
+# conversion of an option given as a string (query string), the values of a JSON body keep their JSON type (checked by CoSwID.settingsFor)
+def fromText(conversion):
+    return lambda x: conversion(x) if isinstance(x, str) else x
+
+# request options -> (CoSwID setting, conversion)
+OPTIONS={
+    "c":("swSize",fromText(int)), "ctxtsize":("swSize",fromText(int)),
+    "f":("filterGlob",fromText(float)), "fltrtresh":("filterGlob",fromText(float)),
+    "g":("significantGap",fromText(float)), "gap":("significantGap",fromText(float)),
+    "v":("voteMethod",str), "vote":("voteMethod",str),
+    "skipmargin":("skipMargin",fromText(float)), "skipstride":("skipStride",fromText(int)),
+    "s":("acceptedLg",fromText(lambda x: x.split(','))), "subset":("acceptedLg",fromText(lambda x: x.split(','))),
+}
+
+
+#
+# Statistics of the service (shared by the request threads)
+#
+class ServiceStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.inProgress = 0
+        self.tokens = 0
+        self.analysisTime = 0.0
+
+    def begin(self):
+        with self.lock:
+            self.requests += 1
+            self.inProgress += 1
+
+    def end(self, nbTokens, analysisTime, error=False):
+        with self.lock:
+            self.inProgress -= 1
+            self.tokens += nbTokens
+            self.analysisTime += analysisTime
+            if error :
+                self.errors += 1
+
+    def summary(self):
+        with self.lock:
+            return {"requests":self.requests, "errors":self.errors, "inProgress":self.inProgress, "tokens":self.tokens,
+                    "analysisTime":round(self.analysisTime,3), "uptime":round(time.time()-self.start,3)}
+
+
+class CoSwIDHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, code, body, contentType="application/json; charset=utf-8"):
+        if not isinstance(body, str) :
+            body = json.dumps(body, ensure_ascii=False)
+        data = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass    # no log line for each request
+
+    # document (see incremental.py) and its lock for the path /documents/<id>[/...], None if there is no such document
+    def document(self, path):
+        parts = path.split("/")
+        with self.server.documentsLock:
+            return self.server.documents.get(parts[2]) if len(parts) > 2 else None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/health" :
+            cosw = self.server.cosw
+            self.reply(200, {"status":"ok", "model":cosw.model, "languages":cosw.modelLg, "settings":cosw.settings, "stats":self.server.stats.summary(), "cache":cosw.cacheStats(), "measures":cosw.stats.summary(),
+                             "documents":len(self.server.documents)})
+        elif url.path.startswith("/documents/") and self.document(url.path) is not None :
+            (doc, lock) = self.document(url.path)
+            with lock:
+                self.reply(200, {"result":doc.result()})
+        else :
+            self.reply(404, {"error":"unknown path %s"%url.path})
+
+    def do_DELETE(self):
+        url = urllib.parse.urlparse(self.path)
+        parts = url.path.split("/")
+        with self.server.documentsLock:
+            found = len(parts) == 3 and parts[1] == "documents" and self.server.documents.pop(parts[2], None) is not None
+        if found :
+            self.reply(200, {"status":"closed"})
+        else :
+            self.reply(404, {"error":"unknown path %s"%url.path})
+
+    def do_POST(self):
+        try:
+            self.post()
+        finally:
+            # this thread only lives for one connection : its dictionary backend goes back to the pool of the instance (see CoSwID.releaseDictionary)
+            self.server.cosw.releaseDictionary()
+
+    def post(self):
+        url = urllib.parse.urlparse(self.path)
+        edit = url.path.startswith("/documents/") and url.path.endswith("/edit")
+        if url.path not in ("/analyse", "/documents") and not edit :
+            self.reply(404, {"error":"unknown path %s"%url.path})
+            return
+        if edit and self.document(url.path) is None :
+            self.reply(404, {"error":"unknown document %s"%url.path})
+            return
+        stats = self.server.stats
+        stats.begin()
+        start = time.time()
+        result = []
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode('utf-8')
+            params = dict(urllib.parse.parse_qsl(url.query))
+            if self.headers.get("Content-Type", "").startswith("application/json") :
+                body = json.loads(body)
+                if not isinstance(body, dict) :
+                    raise ValueError("the JSON body must be an object")
+                params.update(body)
+                text = params.pop("text", "")
+                if not isinstance(text, str) :
+                    raise ValueError("the text must be a string")
+            else :
+                text = body
+            if edit :
+                (doc, lock) = self.document(url.path)
+                span = tuple(fromText(int)(params.get(name, params["start"])) for name in ("start", "end")) if "start" in params else None
+                if span is not None and not all(isinstance(pos, int) and not isinstance(pos, bool) for pos in span) :
+                    raise ValueError("invalid start/end : %s, %s"%(params.get("start"), params.get("end")))
+                with lock:
+                    if span is not None :
+                        changed = doc.edit(span[0], span[1], text)
+                    else :
+                        changed = doc.update(text)
+                    result = [[i, doc.tokens[i], doc.languages[i]] for i in changed]
+                    nbTokens = len(doc.tokens)
+                analysisTime = time.time()-start
+                stats.end(len(result), analysisTime)
+                self.reply(200, {"changed":result, "tokens":nbTokens, "time":round(analysisTime,6)})
+                return
+            outputFormat = params.pop("format", "json")
+            options = {}
+            for (name, value) in params.items():
+                if name not in OPTIONS :
+                    raise ValueError("unknown option : %s"%name)
+                (setting, conversion) = OPTIONS[name]
+                options[setting] = conversion(value)
+            if url.path == "/documents" :
+                docId = str(next(self.server.documentIds))
+                doc = incremental.Document(self.server.cosw, text, name=docId, **options)
+                with self.server.documentsLock:
+                    self.server.documents[docId] = (doc, threading.Lock())
+                result = doc.result()
+                analysisTime = time.time()-start
+                stats.end(len(result), analysisTime)
+                self.reply(200, {"id":docId, "result":result, "time":round(analysisTime,6)})
+                return
+            result = self.server.cosw.analyse(text, **options)
+        except ValueError as e:
+            stats.end(0, time.time()-start, error=True)
+            self.reply(400, {"error":str(e)})
+            return
+        except Exception as e:
+            stats.end(0, time.time()-start, error=True)
+            self.reply(500, {"error":str(e)})
+            return
+        analysisTime = time.time()-start
+        stats.end(len(result), analysisTime)
+        if outputFormat == "tsv" :
+            self.reply(200, "".join(["%s\t%s\n"%(tok,lg) for (tok,lg) in result]), "text/tab-separated-values; charset=utf-8")
+        else :
+            self.reply(200, {"result":result, "time":round(analysisTime,6)})
+
+
+#
+# Start the service (blocking) on 'address' ("[host:]port", default host : localhost)
+#
+def serve(cosw, address):
+    if ":" in address :
+        (host, port) = address.rsplit(":", 1)
+    else :
+        (host, port) = ("localhost", address)
+    server = ThreadingHTTPServer((host, int(port)), CoSwIDHandler)
+    server.daemon_threads = True
+    server.cosw = cosw
+    server.stats = ServiceStats()
+    server.documents = {}       # id -> (incremental.Document, lock)
+    server.documentsLock = threading.Lock()
+    server.documentIds = itertools.count(1)
+    print("CoSwID service listening on http://%s:%s (POST /analyse, POST /documents, GET /health)"%(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Parameter sweep : accuracy of many settings on the gold standard data, the detections being done once
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+
+import sys, getopt
+import os
+import json
+import time
+import itertools
+import multiprocessing
+import numpy
+import coswid
+import dico
+import bench
+
+#
+# Parameter sweep on the gold standard data (see bench.py) :
+#   the global detection and the detection of the sliding windows are done once for each (data set, context size), and their raw probabilities are kept
+#   (optionally saved into a .npz file, reused by the next sweeps with the same model and data sets).
+#   Then the full grid of the other settings (filter threshold, gap, voting method, subset of languages) is evaluated from these probabilities :
+#   only the recalibration, the thresholding and the votes are done for each combination (the results are the same as coswid.py with the same settings).
+#   The combinations are evaluated by a pool of processes (sharing the probabilities).
+#
+#   python3 sweep.py -m FILTER2 -c 1,2,3 -f 0,0.01 -g 0,0.1,0.2 -v dico,lgID,full -s "all;cos,fra" -o sweep.json
+#
+
+# raw detections of the data sets : { (data set name, swSize) : (globProb, windowProb) } and the data sets (see bench.loadDatasets)
+raws = {}
+datasets = []
+# CoSwID instance of the worker processes (inherited from the parent process)
+worker = None
+
+
+#
+# Raw detections of a text for one context size
+#   - Output : (globProb : vector of probabilities of the global detection, columns ordered as cosw.globalDetector.lgCodes ; windowProb : array (nbToks, nbLabels) probabilities of the sliding windows, columns ordered as cosw.detector.lgCodes)
+#
+def detect(cosw, text, swSize):
+    (cleanedText, tokens, cleanedTokens, offsets) = coswid.tokenize(text)
+    (globBest, globProb) = cosw.globalDetector.detect_array(cleanedText, useCache=False)
+    windowProb = coswid.windowProbabilities(cosw.detector, cleanedTokens, swSize, cosw.batchSize, cosw.threads)
+    return (globProb, windowProb)
+
+
+#
+# Raw detections of all the (data set, context size), loaded from (or saved into) 'matricesFile' if given
+#
+def detectAll(cosw, swSizes, matricesFile=""):
+    key = json.dumps({"model":cosw.model, "lgCodes":cosw.detector.lgCodes, "datasets":[name for (name, text, gold) in datasets]})
+    saved = {}
+    if matricesFile and os.path.isfile(matricesFile) :
+        with numpy.load(matricesFile) as f:
+            if str(f["key"]) == key :
+                saved = {name:f[name] for name in f.files}
+    for ((name, text, gold), swSize) in itertools.product(datasets, swSizes):
+        if "glob/%s/%s"%(name, swSize) in saved :
+            raws[(name, swSize)] = (saved["glob/%s/%s"%(name, swSize)], saved["win/%s/%s"%(name, swSize)])
+        else :
+            raws[(name, swSize)] = detect(cosw, text, swSize)
+            print("Detection %s (c=%s) : %s tokens"%(name, swSize, len(gold)))
+    if matricesFile :
+        arrays = {"key":numpy.array(key)}
+        for ((name, swSize), (globProb, windowProb)) in raws.items():
+            arrays["glob/%s/%s"%(name, swSize)] = globProb
+            arrays["win/%s/%s"%(name, swSize)] = windowProb
+        tmpFile = "%s.tmp%d.npz"%(matricesFile, os.getpid())
+        numpy.savez(tmpFile, **arrays)
+        os.replace(tmpFile, matricesFile)
+
+
+#
+# Languages of the tokens of a text from its raw detections, with the given settings (same steps as CoSwID.analyse after the detections)
+#
+def decide(cosw, tokens, globProb, windowProb, swSize, filterGlob, significantGap, voteMethod, acceptedLg):
+    detector = cosw.detector
+    (possibleLg, bestGlobLg) = coswid.selectLanguages(cosw.globalDetector, globProb, acceptedLg, filterGlob)
+    if len(possibleLg)==0 :
+        raise ValueError("no language available!")
+    possibleIdx = numpy.array([detector.lgIndex[lg] for lg in possibleLg], dtype=int)
+    results = numpy.zeros((len(tokens), len(possibleLg)), dtype=numpy.float32)
+    results = coswid.accumulateWindows(coswid.recalibrateResults(windowProb, possibleIdx), numpy.arange(len(tokens)), swSize, results)
+    filteredResults = coswid.normLanguageScores(results, swSize)
+    return coswid.decideLanguages(detector, dico.PrefetchedDictionary(cosw.dictionary(), cosw.dicoCache()), tokens, filteredResults, possibleLg, bestGlobLg, significantGap, voteMethod)
+
+
+#
+# Evaluate one combination of settings on all the data sets (in a worker process)
+#   - Output : (combination, { data set name : (evaluated tokens, correct tokens) } or None if no language is available, evaluation time)
+#
+def evaluate(combination):
+    (swSize, filterGlob, significantGap, voteMethod, acceptedLg) = combination
+    start = time.perf_counter()
+    scores = {}
+    for (name, text, gold) in datasets:
+        tokens = [tok for (tok, lg) in gold]
+        (globProb, windowProb) = raws[(name, swSize)]
+        try:
+            languages = decide(worker, tokens, globProb, windowProb, swSize, filterGlob, significantGap, voteMethod, acceptedLg if acceptedLg else worker.modelLg)
+        except ValueError:
+            return (combination, None, time.perf_counter()-start)
+        evaluated = [(lg, goldLg) for (lg, (tok, goldLg)) in zip(languages, gold) if goldLg != bench.NOLG]
+        scores[name] = (len(evaluated), sum([1 for (lg, goldLg) in evaluated if lg == goldLg]))
+    return (combination, scores, time.perf_counter()-start)
+
+
+def initWorker(cosw):
+    global worker
+    worker = cosw
+
+
+#
+# Evaluate the grid of settings with 'workers' processes
+#   - Output : [ (combination, scores, time) , ... ] (see evaluate), in the order of the grid
+#
+def sweep(cosw, grid, workers):
+    if workers > 1 and "fork" in multiprocessing.get_all_start_methods() :
+        with multiprocessing.get_context("fork").Pool(workers, initializer=initWorker, initargs=(cosw,)) as pool:
+            return pool.map(evaluate, grid)
+    initWorker(cosw)
+    return [evaluate(combination) for combination in grid]
+
+
+def report(results, nbTokens):
+    names = [name for (name, text, gold) in datasets]
+    print("%3s %6s %6s %5s %-24s "%("c", "f", "g", "v", "s") + " ".join(["%14s"%name[:14] for name in names]) + " %9s %10s"%("accuracy", "tokens/s"))
+    for ((swSize, filterGlob, significantGap, voteMethod, acceptedLg), scores, evalTime) in results:
+        line = "%3s %6s %6s %5s %-24s "%(swSize, filterGlob, significantGap, voteMethod, ",".join(acceptedLg) if acceptedLg else "all")
+        if scores is None :
+            print(line + "no language available")
+            continue
+        (evaluated, correct) = (sum([scores[name][0] for name in names]), sum([scores[name][1] for name in names]))
+        print(line + " ".join(["%14.4f"%(scores[name][1]/max(scores[name][0],1)) for name in names]) + " %9.4f %10.0f"%(correct/max(evaluated,1), nbTokens/max(evalTime,1e-9)))
+
+
+def usage():
+    print('sweep.py -m <model name> -c <context sizes> -f <filter thresholds> -g <gaps> -v <voting methods> -s <subsets : "all" or languages separated by a ",", separated by a ";"> [-d <data set,...>] [-o <results.json>] [--workers <processes>] [--matrices <file.npz>] [--gold <data_test_gold directory>] [--diclexicon <lexicon>]')
+    print('  each option is a list of values separated by a "," (except -s), all the combinations are evaluated')
+    print('  data sets : %s'%",".join([name for (name, zipName, evalFile, goldFile) in bench.DATASETS]))
+
+
+def main(argv):
+    global datasets
+    modelName="FILTER2"
+    swSizes=[1]
+    filterGlobs=[0.0]
+    significantGaps=[0.1]
+    voteMethods=["dico"]
+    subsets=[None]          # None = all the languages of the model
+    names=None
+    outputFile=""
+    workers=os.cpu_count() or 1
+    matricesFile=""         # file where the raw detections are kept from one sweep to another ; "" = no persistence
+    goldDir=bench.GOLD_DIR
+    dicLexicon=""           # compiled lexicon used for the dico vote ; "" = StubDictionary (no word is known)
+    try:
+        opts, args = getopt.getopt(argv,"hm:c:f:g:v:s:d:o:",["model=","ctxtsize=","fltrtresh=","gap=","vote=","subset=","datasets=","output=","workers=","matrices=","gold=","diclexicon="])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            usage()
+            sys.exit()
+        elif opt in ('-m','--model') :
+            modelName=arg
+        elif opt in ('-c','--ctxtsize') :
+            swSizes=[int(x) for x in arg.split(',')]
+        elif opt in ('-f','--fltrtresh') :
+            filterGlobs=[float(x) for x in arg.split(',')]
+        elif opt in ('-g','--gap') :
+            significantGaps=[float(x) for x in arg.split(',')]
+        elif opt in ('-v','--vote') :
+            voteMethods=arg.split(',')
+        elif opt in ('-s','--subset') :
+            subsets=[None if x=="all" else x.split(',') for x in arg.split(';')]
+        elif opt in ('-d','--datasets') :
+            names=arg.split(',')
+        elif opt in ('-o','--output') :
+            outputFile=arg
+        elif opt == '--workers':
+            workers=int(arg)
+        elif opt == '--matrices':
+            matricesFile=arg
+        elif opt == '--gold':
+            goldDir=arg
+        elif opt == '--diclexicon':
+            dicLexicon=arg
+
+    dicFactory=(lambda: dico.MmapLexicon(dicLexicon)) if dicLexicon else dico.StubDictionary
+    cosw=coswid.CoSwID(coswid.modelList[modelName], coswid.lgList[modelName], dicFactory=dicFactory)
+    for voteMethod in voteMethods:
+        cosw.settingsFor({"voteMethod":voteMethod})
+    datasets=bench.loadDatasets(goldDir, names)
+    nbTokens=sum([len(gold) for (name, text, gold) in datasets])
+
+    start=time.perf_counter()
+    detectAll(cosw, swSizes, matricesFile)
+    detectionTime=time.perf_counter()-start
+    grid=list(itertools.product(swSizes, filterGlobs, significantGaps, voteMethods, subsets))
+    start=time.perf_counter()
+    results=sweep(cosw, grid, workers)
+    sweepTime=time.perf_counter()-start
+
+    report(results, nbTokens)
+    valid=[(combination, scores) for (combination, scores, evalTime) in results if scores is not None]
+    if valid :
+        accuracy=lambda scores: sum([correct for (evaluated, correct) in scores.values()])/max(sum([evaluated for (evaluated, correct) in scores.values()]),1)
+        (best, scores)=max(valid, key=lambda res: accuracy(res[1]))
+        print("Best : -c %s -f %s -g %s -v %s -s %s (accuracy %0.4f)"%(best[0], best[1], best[2], best[3], ",".join(best[4]) if best[4] else "all", accuracy(scores)))
+    print("Detections : %0.3fs ; %s combinations evaluated in %0.3fs (%s workers)"%(detectionTime, len(grid), sweepTime, workers))
+    if outputFile :
+        with open(outputFile, 'w') as f:
+            json.dump({"model":cosw.model, "dictionary":dicLexicon if dicLexicon else "stub", "detectionTime":detectionTime, "sweepTime":sweepTime,
+                       "results":[{"swSize":c[0], "filterGlob":c[1], "significantGap":c[2], "voteMethod":c[3], "acceptedLg":c[4], "time":evalTime,
+                                   "datasets":{name:{"evaluated":score[0], "correct":score[1], "accuracy":score[1]/max(score[0],1)} for (name, score) in scores.items()} if scores is not None else None}
+                                  for (c, scores, evalTime) in results]}, f, indent=1)
+        print("Results written into %s"%outputFile)
+
+
+if __name__ == "__main__" :
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# CoSwID - Code Switching Identification
+#
+# Author :  Laurent Kevers - University of Corsica
+#           kevers_l@univ-corse.fr
+#
+#           Tokenizer : cleaning and tokenization of the texts, with the offsets of the tokens in the original text
+#
+
+#
+# Copyright University of Corsica -- Laurent Kevers (2022)
+#
+# kevers_l@univ-corse.fr
+#
+# This software is a computer program whose purpose is Code Switching Identification.
+#
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software. You can use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info".
+#
+# As a counterpart to the access to the source code and rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty and the software's author, the holder of the
+# economic rights, and the successive licensors have only limited
+# liability.
+#
+# In this respect, the user's attention is drawn to the risks associated
+# with loading, using, modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean that it is complicated to manipulate, and that also
+# therefore means that it is reserved for developers and experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or
+# data to be ensured and, more generally, to use and operate it in the
+# same conditions as regards security.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+#
+
+import re
+
+#
+# Tokenizer (see coswid.tokenize) : the patterns are compiled once for an alphabet (see forAlphabet)
+#   - the chars U+00AC (NOT SIGN) and U+00AD (SOFT HYPHEN) are removed
+#   - the tokens are separated by whitespaces
+#   - the cleaned token is the token without the chars that are not in the alphabet (or digits) at its begining and at its end
+#   The text is tokenized in one pass (one match for each token), and the offsets of the tokens in the original text are kept :
+#   text[start:end] is the original token (including the removed chars, if any)
+#
+class Tokenizer(object):
+    REMOVED = "\u00AC\u00AD"
+
+    def __init__(self, alphabet):
+        self.alphabet = alphabet
+        # token : unalpha at the begining, cleaned token, unalpha at the end
+        self.tokenRe = re.compile(r"(?=\S)[^\s%s0-9]*(\S*?)[^\s%s0-9]*(?!\S)"%(alphabet, alphabet))
+        self.cleanRe = re.compile(r"[^%s0-9]*(.*?)[^%s0-9]*"%(alphabet, alphabet), re.S)
+        self.wordRe = re.compile(r"[%s0-9]+"%alphabet)
+        self.removedRe = re.compile("[%s]"%self.REMOVED)
+        self.spaceRe = re.compile(r"\s")
+
+    # cleaned form of a token (see above)
+    def clean(self, token):
+        return self.cleanRe.fullmatch(token).group(1)
+
+    # longest subtoken (made of alphabet chars and digits) of a token, "" if there is none
+    def longestWord(self, token):
+        return max(self.wordRe.findall(token), key=len, default="")
+
+    #
+    # Tokenize a text
+    #   - Output : (cleanedText, tokens, cleanedTokens, offsets)
+    #       cleanedText : the text without the removed chars, each sequence of whitespaces being replaced by one space char
+    #       tokens : ORIGINAL tokens (without the removed chars), cleanedTokens : see clean
+    #       offsets : [ (start, end) , ... , (start, end) ] position of each token in 'text'
+    #
+    def tokenize(self, text):
+        (tokens, cleanedTokens, offsets) = ([], [], [])
+        removed = self.removedRe.search(text) is not None
+        for m in self.tokenRe.finditer(text):
+            token = m.group()
+            cleanedToken = m.group(1)
+            if removed and self.removedRe.search(token) :
+                token = self.removedRe.sub("", token)
+                if not token :
+                    continue
+                cleanedToken = self.clean(token)
+            tokens.append(token)
+            cleanedTokens.append(cleanedToken)
+            offsets.append(m.span())
+        # (the space chars before the first token and after the last token are kept)
+        if offsets :
+            (first, last) = (offsets[0][0], offsets[-1][1])
+        else :
+            (first, last) = (len(text), len(text))
+        cleanedText = " ".join(tokens)
+        if self.spaceRe.search(text, 0, first) :
+            cleanedText = " "+cleanedText if tokens else " "
+        if tokens and self.spaceRe.search(text, last) :
+            cleanedText = cleanedText+" "
+        return (cleanedText, tokens, cleanedTokens, offsets)
+
+
+# Tokenizers already built (one for each alphabet)
+tokenizers = {}
+
+def forAlphabet(alphabet):
+    if alphabet not in tokenizers :
+        tokenizers[alphabet] = Tokenizer(alphabet)
+    return tokenizers[alphabet]